@@ -1,222 +1,282 @@
 from fastapi import APIRouter, UploadFile, File, HTTPException, Response, BackgroundTasks
-from app.schemas.copilot import DraftProposalResponse, ChatRequest, ChatResponse, ProposalSchema
-from app.services.ai.document_processor import doc_processor
-from app.services.ai.geotech_analyzer import geotech_analyzer
-from app.services.directus import fetch_matching_data, fetch_global_settings
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from app.schemas.copilot import DraftProposalResponse, ChatRequest, ChatResponse, ChatStreamRequest, ProposalSchema, AuditJobResponse
+from app.services.directus import fetch_matching_data
+from app.services.estimator import calculate_estimate
+from app.services import audit_queue, chat_sessions
+from app.services.audit_service import (
+    AuditError, analyze_document, process_document, run_audit, save_audit_to_directus,
+)
 from app.core.config import settings
+from app.core.llm_gateway import CircuitOpenError
 from app.core.redis import get_redis
 from app.services.pdf_generator import pdf_generator
+import asyncio
 import hashlib
 import json
 import logging
 from fastapi import Request
-from typing import Optional
-import httpx
+from typing import Any, Optional
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
 
-async def _save_audit_to_directus(
-    filename: str, result_data: dict, client_access_code: Optional[str] = None
-):
-    """Background task: persist audit results to Directus audit_history + send email."""
-    try:
-        client_id = None
-        client_email = None
-        company_name = "Клиент"
-        if client_access_code:
-            async with httpx.AsyncClient(base_url=settings.DIRECTUS_URL, timeout=10.0) as client:
-                res = await client.get("/items/clients", params={
-                    "filter[access_code][_eq]": client_access_code,
-                    "fields": "id,email,company_name",
-                    "limit": 1,
-                })
-                if res.status_code == 200:
-                    data = res.json().get("data", [])
-                    if data:
-                        client_id = data[0]["id"]
-                        client_email = data[0].get("email")
-                        company_name = data[0].get("company_name", "Клиент")
-
-        parsed = result_data.get("parsed_data", {})
-        record = {
-            "filename": filename,
-            "work_type": parsed.get("work_type"),
-            "soil_type": parsed.get("soil_type"),
-            "volume": parsed.get("volume"),
-            "depth": parsed.get("depth"),
-            "confidence_score": result_data.get("confidence_score"),
-            "risks_count": len(result_data.get("risks", [])),
-            "estimated_total": result_data.get("estimated_total"),
-            "technical_summary": result_data.get("technical_summary"),
-            "full_result": result_data,
-        }
-        if client_id:
-            record["client_id"] = client_id
-
-        async with httpx.AsyncClient(base_url=settings.DIRECTUS_URL, timeout=10.0) as client:
-            await client.post("/items/audit_history", json=record)
-        logger.info(f"Audit saved to Directus: {filename}")
-
-        # Email notification
-        if client_email:
-            from app.services.email_service import email_service
-            email_service.send_audit_completed(
-                to_email=client_email,
-                company_name=company_name,
-                filename=filename,
-                work_type=parsed.get("work_type"),
-                risks_count=len(result_data.get("risks", [])),
-                confidence=result_data.get("confidence_score"),
-                estimated_total=result_data.get("estimated_total"),
-            )
-    except Exception as e:
-        logger.error(f"Failed to save audit to Directus: {e}")
+def _client_code_from_request(request: Request) -> Optional[str]:
+    """Access code of the authenticated dashboard client, if a valid JWT was sent."""
+    auth_header = request.headers.get("authorization", "")
+    if auth_header.startswith("Bearer "):
+        try:
+            from app.core.security import decode_access_token
+            payload = decode_access_token(auth_header[7:])
+            return payload.get("sub")
+        except Exception:
+            pass
+    return None
 
-@router.post("/parse-document", response_model=DraftProposalResponse)
-async def parse_document(
-    request: Request,
-    background_tasks: BackgroundTasks,
-    file: UploadFile = File(...),
-):
+
+async def _guard_upload(request: Request, file: UploadFile):
     """
-    Professional technical audit of uploaded documents with abuse protection.
-    Results are automatically saved to Directus audit_history.
+    Abuse protection shared by the audit endpoints: file size, IP rate limit, cache.
+    Returns (content, cache_key, rate_key, cached_result).
     """
     client_ip = request.client.host
     redis = get_redis()
-    
+
     # 0. Basic Protection: File Size
     content = await file.read()
     file_size_mb = len(content) / (1024 * 1024)
     if file_size_mb > settings.MAX_FILE_SIZE_MB:
         raise HTTPException(status_code=413, detail=f"File too large. Max {settings.MAX_FILE_SIZE_MB}MB")
-    
-    # 0. Protection: Rate Limiting (IP based)
+
+    # 0. Protection: Rate Limiting (IP based) + 1. Cache (File Hash), one round trip
     rate_key = f"rate_limit:{client_ip}"
-    current_requests = redis.get(rate_key)
-    if current_requests and int(current_requests) >= settings.AUDIT_RATE_LIMIT:
-        raise HTTPException(status_code=429, detail="Rate limit exceeded. Try again in an hour.")
-    
-    # 1. Check Cache (File Hash)
     file_hash = hashlib.sha256(content).hexdigest()
     cache_key = f"audit_cache:{file_hash}"
-    cached_result = redis.get(cache_key)
-    if cached_result:
-        return DraftProposalResponse(**json.loads(cached_result))
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.get(rate_key)
+        pipe.get(cache_key)
+        current_requests, cached_result = await pipe.execute()
+    if current_requests and int(current_requests) >= settings.AUDIT_RATE_LIMIT:
+        raise HTTPException(status_code=429, detail="Rate limit exceeded. Try again in an hour.")
 
     # Reset file pointer for processor
     await file.seek(0)
+    return content, cache_key, rate_key, cached_result
 
-    # 1. High-fidelity Processing
-    try:
-        processed_doc = await doc_processor.process_file(file)
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Error processing document: {str(e)}")
-    
-    # 2. Expert Engineering Analysis (with pre-validation)
-    try:
-        analysis_result = await geotech_analyzer.analyze_project(processed_doc)
-    except Exception as e:
-        # If it's a validation error (not a geotech doc), we don't count it towards rate limit
-        if "not a geotechnical" in str(e).lower():
-            raise HTTPException(status_code=422, detail=str(e))
-        raise HTTPException(status_code=500, detail=f"Professional audit failed: {str(e)}")
-    
-    parsed_data = analysis_result["parsed_data"]
-    
-    # 3. Directus Lookup
-    shpunts, machinery = await fetch_matching_data(
-        work_type=parsed_data.work_type,
-        required_profile=parsed_data.required_profile
-    )
-    
-    # 4. Professional Estimate Calculation
-    estimated_total = 0
-    if parsed_data.volume:
-        # Fetch rates from Directus (with fallbacks)
-        rates = await fetch_global_settings()
-        
-        WORK_RATES_MAP = {
-            "погружение": rates["rate_piling"],
-            "вдавливание": rates["rate_vibration"],
-            "бурение": rates["rate_drilling"],
-            "выемка": rates["rate_excavation"],
-            "извлечение": rates["rate_extraction"]
-        }
-        
-        # Determine work unit price based on work_type
-        work_type_lower = (parsed_data.work_type or "").lower()
-        work_unit_price = 0
-        for key, rate in WORK_RATES_MAP.items():
-            if key in work_type_lower:
-                work_unit_price = rate
-                break
-        if work_unit_price == 0:
-            work_unit_price = rates["rate_piling"] # Default to piling if unknown
-            
-        # 1. Material Cost (Shpunts)
-        material_cost = 0
-        if shpunts:
-            material_cost = shpunts[0].price * parsed_data.volume
-            
-        # 2. Field Work Cost
-        field_work_total = work_unit_price * parsed_data.volume
-        
-        # 3. Machinery Rental Cost
-        machinery_rental_total = 0
-        if machinery and parsed_data.estimated_shifts:
-            # Sum up all recommended machinery for the estimate
-            shifts = parsed_data.estimated_shifts
-            machinery_rental_total = sum(m.price_per_shift for m in machinery) * shifts
-            
-        # Final weighted total with complexity coefficient
-        base_total = material_cost + field_work_total + machinery_rental_total
-        complexity = parsed_data.complexity_coefficient or 1.0
-        estimated_total = base_total * complexity
-        
-        logger.info(
-            f"PROF CALC: (Mat:{material_cost} + Work:{field_work_total} + Mach:{machinery_rental_total}) "
-            f"* Complex:{complexity} = {estimated_total}"
-        )
-    
-    response_data = DraftProposalResponse(
-        parsed_data=parsed_data,
-        technical_summary=analysis_result["technical_summary"],
-        risks=analysis_result["risks"],
-        matched_shpunts=shpunts,
-        recommended_machinery=machinery,
-        estimated_total=estimated_total if estimated_total > 0 else None,
-        confidence_score=analysis_result["confidence_score"],
-        clarifying_questions=analysis_result.get("clarifying_questions", [])
-    )
 
-    # Increment rate limit counter
-    if not current_requests:
-        redis.setex(rate_key, 3600, 1) # 1 hour TTL
-    else:
-        redis.incr(rate_key)
+async def _count_request(rate_key: str):
+    """Increment the hourly rate limit counter; the TTL starts with the first request."""
+    async with get_redis().pipeline(transaction=True) as pipe:
+        pipe.incr(rate_key)
+        pipe.expire(rate_key, 3600, nx=True) # 1 hour TTL
+        await pipe.execute()
+
+
+async def _record_audit(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    filename: str,
+    response_data: DraftProposalResponse,
+    cache_key: str,
+    rate_key: str,
+):
+    """Count the audit against the rate limit, cache it and schedule the Directus save."""
+    await _count_request(rate_key)
 
     # Store in cache
-    redis.setex(cache_key, 86400, response_data.model_dump_json()) # 24 hour cache
+    await get_redis().setex(cache_key, 86400, response_data.model_dump_json()) # 24 hour cache
 
-    # 6. Background: save to Directus audit_history
-    client_code = None
-    auth_header = request.headers.get("authorization", "")
-    if auth_header.startswith("Bearer "):
-        try:
-            from app.core.security import decode_access_token
-            payload = decode_access_token(auth_header[7:])
-            client_code = payload.get("sub")
-        except Exception:
-            pass
+    # Background: save to Directus audit_history
     background_tasks.add_task(
-        _save_audit_to_directus, file.filename or "unknown", response_data.model_dump(), client_code
+        save_audit_to_directus, filename, response_data.model_dump(), _client_code_from_request(request)
     )
 
+
+@router.post("/parse-document", response_model=DraftProposalResponse)
+async def parse_document(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    file: UploadFile = File(...),
+):
+    """
+    Professional technical audit of uploaded documents with abuse protection.
+    Results are automatically saved to Directus audit_history.
+    """
+    content, cache_key, rate_key, cached_result = await _guard_upload(request, file)
+    if cached_result:
+        return DraftProposalResponse(**json.loads(cached_result))
+
+    try:
+        response_data = await run_audit(content, file.filename or "unknown")
+    except AuditError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+    await _record_audit(
+        request, background_tasks, file.filename or "unknown",
+        response_data, cache_key, rate_key,
+    )
     return response_data
 
+
+@router.post("/audits", response_model=AuditJobResponse, status_code=202)
+async def submit_audit_job(request: Request, file: UploadFile = File(...)):
+    """
+    Queue a document for audit by the worker pool; poll GET /audits/{job_id}.
+    Same size/rate limits as /parse-document, plus a per-client cap on unfinished jobs.
+    """
+    content, cache_key, rate_key, cached_result = await _guard_upload(request, file)
+    filename = file.filename or "unknown"
+    if cached_result:
+        job_id = await audit_queue.complete_cached(cached_result, filename)
+        return AuditJobResponse(**await audit_queue.get_job(job_id))
+
+    client_code = _client_code_from_request(request)
+    try:
+        job_id = await audit_queue.submit_job(
+            content, filename,
+            client_key=client_code or request.client.host,
+            client_code=client_code,
+            cache_key=cache_key,
+        )
+    except audit_queue.QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+
+    # Submissions count against the hourly limit like synchronous audits
+    await _count_request(rate_key)
+
+    return AuditJobResponse(job_id=job_id, status=audit_queue.STATUS_QUEUED)
+
+
+@router.get("/audits/{job_id}", response_model=AuditJobResponse)
+async def get_audit_job(job_id: str):
+    """Status of a queued audit; `result` is set once status is `done`."""
+    job = await audit_queue.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Audit job not found")
+    return AuditJobResponse(**job)
+
+
+def _ndjson(event: str, data: Any) -> bytes:
+    if isinstance(data, BaseModel):
+        data = data.model_dump(mode="json")
+    return (json.dumps({"event": event, "data": data}, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+@router.post("/parse-document/stream")
+async def parse_document_stream(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    file: UploadFile = File(...),
+):
+    """
+    Streaming variant of /parse-document (NDJSON, one event per line).
+    Events in order: document, parsed_data, matches, risks, summary_delta (many),
+    estimate, result. On failure a single `error` event with status/detail is sent.
+    """
+    content, cache_key, rate_key, cached_result = await _guard_upload(request, file)
+    filename = file.filename or "unknown"
+
+    async def replay_cached():
+        cached = DraftProposalResponse(**json.loads(cached_result))
+        yield _ndjson("document", {"cached": True})
+        yield _ndjson("parsed_data", cached.parsed_data)
+        yield _ndjson("matches", {
+            "matched_shpunts": [s.model_dump() for s in cached.matched_shpunts],
+            "recommended_machinery": [m.model_dump() for m in cached.recommended_machinery],
+        })
+        yield _ndjson("risks", [r.model_dump() for r in cached.risks])
+        yield _ndjson("summary_delta", cached.technical_summary)
+        yield _ndjson("estimate", {"estimated_total": cached.estimated_total})
+        yield _ndjson("result", cached)
+
+    async def stream_audit():
+        try:
+            processed_doc = await process_document(content, filename)
+        except AuditError as e:
+            yield _ndjson("error", {"status": e.status_code, "detail": e.detail})
+            return
+        yield _ndjson("document", {
+            "metadata": processed_doc.get("metadata", {}),
+            "sections": list(processed_doc.get("sections", {}).keys()),
+            "chars": len(processed_doc.get("full_text", "")),
+        })
+
+        # The analyzer runs in its own task and pushes stage events into the queue
+        events: asyncio.Queue = asyncio.Queue()
+
+        async def on_event(name: str, payload: Any):
+            await events.put((name, payload))
+
+        analysis = asyncio.create_task(analyze_document(
+            processed_doc, hashlib.sha256(content).hexdigest(), filename, on_event=on_event
+        ))
+        analysis.add_done_callback(lambda _: events.put_nowait(None))
+        shpunts, machinery = [], []
+        try:
+            while (item := await events.get()) is not None:
+                name, payload = item
+                yield _ndjson(name, payload)
+                if name == "parsed_data":
+                    # Catalogue lookup overlaps the remaining LLM stages; later
+                    # events simply wait in the queue so the order is preserved
+                    try:
+                        shpunts, machinery = await fetch_matching_data(
+                            work_type=payload.work_type,
+                            required_profile=payload.required_profile
+                        )
+                    except Exception as e:
+                        logger.error(f"Catalogue lookup failed: {e}")
+                        yield _ndjson("error", {"status": 500, "detail": f"Professional audit failed: {str(e)}"})
+                        return
+                    yield _ndjson("matches", {
+                        "matched_shpunts": [s.model_dump() for s in shpunts],
+                        "recommended_machinery": [m.model_dump() for m in machinery],
+                    })
+            try:
+                analysis_result = analysis.result()
+            except AuditError as e:
+                yield _ndjson("error", {"status": e.status_code, "detail": e.detail})
+                return
+        finally:
+            # Client went away mid-stream: stop paying for LLM calls
+            if not analysis.done():
+                analysis.cancel()
+
+        parsed_data = analysis_result["parsed_data"]
+        try:
+            estimated_total = await calculate_estimate(parsed_data, shpunts, machinery)
+        except Exception as e:
+            logger.error(f"Estimate calculation failed: {e}")
+            yield _ndjson("error", {"status": 500, "detail": f"Professional audit failed: {str(e)}"})
+            return
+        yield _ndjson("estimate", {"estimated_total": estimated_total})
+
+        response_data = DraftProposalResponse(
+            parsed_data=parsed_data,
+            technical_summary=analysis_result["technical_summary"],
+            risks=analysis_result["risks"],
+            matched_shpunts=shpunts,
+            recommended_machinery=machinery,
+            estimated_total=estimated_total,
+            confidence_score=analysis_result["confidence_score"],
+            clarifying_questions=analysis_result.get("clarifying_questions", []),
+            near_duplicate_of=analysis_result["near_duplicate"],
+        )
+        await _record_audit(
+            request, background_tasks, filename,
+            response_data, cache_key, rate_key,
+        )
+        yield _ndjson("result", response_data)
+
+    return StreamingResponse(
+        replay_cached() if cached_result else stream_audit(),
+        media_type="application/x-ndjson",
+        # Tell nginx not to buffer the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @router.post("/chat", response_model=ChatResponse)
 async def chat_endpoint(request: ChatRequest):
     """
@@ -230,16 +290,61 @@ async def chat_endpoint(request: ChatRequest):
             context=request.context
         )
         return ChatResponse(answer=answer)
+    except CircuitOpenError as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Chat failed: {str(e)}")
 
+@router.post("/chat/stream")
+async def chat_stream_endpoint(request: ChatStreamRequest):
+    """
+    Streaming chat (NDJSON) with the history kept server-side.
+    The first turn sends `context` without `session_id`; later turns send only
+    `session_id` and `message`. Events: session {session_id}, token (many),
+    done. On failure a single `error` event is sent. An unknown or expired
+    session is replaced by a new one, announced in the `session` event.
+    """
+    from app.services.llm import stream_chat
+
+    session = await chat_sessions.load(request.session_id) if request.session_id else None
+    if session is None:
+        session_id = await chat_sessions.create(request.context)
+        context, history = request.context, []
+    else:
+        session_id = request.session_id
+        context, history = session
+
+    async def generate():
+        yield _ndjson("session", {"session_id": session_id})
+        parts = []
+        try:
+            async for token in stream_chat(request.message, history, context):
+                parts.append(token)
+                yield _ndjson("token", token)
+        except CircuitOpenError as e:
+            yield _ndjson("error", {"status": 503, "detail": str(e)})
+            return
+        except Exception as e:
+            logger.error(f"Chat stream failed: {e}")
+            yield _ndjson("error", {"status": 500, "detail": f"Chat failed: {str(e)}"})
+            return
+        # Only complete answers enter the history
+        await chat_sessions.append_turn(session_id, request.message, "".join(parts))
+        yield _ndjson("done", {})
+
+    return StreamingResponse(
+        generate(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @router.post("/download-report")
 async def download_report(proposal: ProposalSchema):
     """
     Generates and returns a PDF report based on the provided proposal data.
     """
     try:
-        pdf_content = pdf_generator.generate_audit_report(proposal.model_dump())
+        pdf_content = await pdf_generator.get_audit_report(proposal.model_dump())
         
         return Response(
             content=pdf_content,
@@ -4,9 +4,9 @@ Validates access codes against Directus `clients` collection, with fallback to e
 """
 import logging
 from fastapi import APIRouter, HTTPException, status
-import httpx
-from app.core.config import settings
+from app.core.http_client import directus_client
 from app.core.security import create_access_token
+from app.services.client_resolver import client_resolver
 from app.schemas.auth import VerifyCodeRequest, AuthTokenResponse, ClientInfo
 
 logger = logging.getLogger(__name__)
@@ -23,29 +23,24 @@ DEMO_CLIENTS = {
 async def _verify_via_directus(access_code: str) -> ClientInfo | None:
     """Try to verify the access code against the Directus `clients` collection."""
     try:
-        headers = {}
-        if settings.DIRECTUS_ADMIN_TOKEN:
-            headers["Authorization"] = f"Bearer {settings.DIRECTUS_ADMIN_TOKEN}"
-            
-        async with httpx.AsyncClient(base_url=settings.DIRECTUS_URL, timeout=5.0) as client:
-            res = await client.get(
-                "/items/clients",
-                params={
-                    "filter[access_code][_eq]": access_code,
-                    "filter[active][_eq]": True,
-                    "limit": 1,
-                },
-                headers=headers
-            )
-            if res.status_code == 200:
-                items = res.json().get("data", [])
-                if items:
-                    item = items[0]
-                    return ClientInfo(
-                        company_name=item.get("company_name", "Unknown"),
-                        email=item.get("email"),
-                        access_level=item.get("access_level", "standard"),
-                    )
+        res = await directus_client.get(
+            "/items/clients",
+            params={
+                "filter[access_code][_eq]": access_code,
+                "filter[active][_eq]": True,
+                "limit": 1,
+            },
+            timeout=5.0,
+        )
+        if res.status_code == 200:
+            items = res.json().get("data", [])
+            if items:
+                item = items[0]
+                return ClientInfo(
+                    company_name=item.get("company_name", "Unknown"),
+                    email=item.get("email"),
+                    access_level=item.get("access_level", "standard"),
+                )
     except Exception as e:
         logger.warning(f"Directus auth check failed, falling back to demo codes: {e}")
     return None
@@ -73,6 +68,9 @@ async def verify_access_code(body: VerifyCodeRequest):
             detail="Неверный код доступа",
         )
 
+    # A re-activated client must not wait for a cached "inactive" to expire
+    client_resolver.invalidate(code)
+
     # Generate JWT
     token = create_access_token(
         data={
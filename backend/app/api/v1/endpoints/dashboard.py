@@ -1,33 +1,45 @@
 """
 Dashboard API endpoints.
 Serves client-specific data (projects, overview, audit history) from Directus.
-All endpoints require JWT authentication.
+All endpoints require JWT authentication. GET responses carry an ETag, honour
+If-None-Match with 304 and are cached per client (see services/dashboard_cache.py).
 """
+import asyncio
+import base64
+import json
 import logging
-from typing import Dict, Any, List, Optional
-from fastapi import APIRouter, Depends, HTTPException
-import httpx
-from app.core.config import settings
+from typing import Awaitable, Callable, Dict, Any, List, Optional, Tuple
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from app.core.security import get_current_client
-from app.core.http_client import http_manager
+from app.core.http_client import directus_client
+from app.services import dashboard_cache
+from app.services.client_resolver import client_resolver
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
+# List views carry only what the cards render, with relations capped; full
+# relations, manager contacts and summaries come from the detail endpoints.
+PROJECT_LIST_FIELDS = (
+    "id,title,description,status,location,progress,work_type,start_date,end_date,tags,date_created,"
+    "photos.directus_files_id.id,documents.directus_files_id.id,documents.directus_files_id.filename_download,"
+    "documents.directus_files_id.title,machinery_used.machinery_id.id,machinery_used.machinery_id.name,"
+    "machinery_used.machinery_id.category"
+)
+PROJECT_LIST_DEEP = {"photos": {"_limit": 4}, "documents": {"_limit": 3}, "machinery_used": {"_limit": 6}}
+PROJECT_DETAIL_FIELDS = (
+    "id,title,description,status,location,progress,work_type,start_date,end_date,tags,date_created,"
+    "photos.directus_files_id.id,photos.directus_files_id.filename_disk,documents.directus_files_id.id,"
+    "documents.directus_files_id.filename_download,documents.directus_files_id.title,"
+    "machinery_used.machinery_id.*,client_id.id,client_id.manager_name,client_id.manager_contact"
+)
+AUDIT_LIST_FIELDS = "id,filename,work_type,soil_type,volume,depth,confidence_score,risks_count,estimated_total,date_created"
+AUDIT_DETAIL_FIELDS = f"{AUDIT_LIST_FIELDS},technical_summary"
+
+
 async def _directus_get(path: str, params: Optional[Dict] = None) -> Optional[Any]:
     """Helper to fetch data from Directus."""
-    headers = {}
-    if settings.DIRECTUS_ADMIN_TOKEN:
-        headers["Authorization"] = f"Bearer {settings.DIRECTUS_ADMIN_TOKEN}"
-
-    async def _do_get():
-        if not http_manager.client:
-            # Fallback if lifecycle failing or in tests
-            async with httpx.AsyncClient(base_url=settings.DIRECTUS_URL, timeout=10.0) as client:
-                return await client.get(path, params=params or {}, headers=headers)
-        return await http_manager.client.get(f"{settings.DIRECTUS_URL}{path}", params=params or {}, headers=headers)
-
-    res = await _do_get()
+    res = await directus_client.get(path, params=params or {})
     if res.status_code != 200:
         logger.warning(f"Directus GET {path} returned {res.status_code}: {res.text[:200]}")
         return None
@@ -35,93 +47,173 @@ async def _directus_get(path: str, params: Optional[Dict] = None) -> Optional[An
 
 
 async def _get_client_id(access_code: str) -> Optional[int]:
-    """Resolve access_code to client_id in Directus."""
-    data = await _directus_get("/items/clients", {
-        "filter[access_code][_eq]": access_code,
-        "fields": "id",
-        "limit": 1,
-    })
-    if data and len(data) > 0:
-        cid = data[0].get("id")
-        logger.info(f"Resolved access_code {access_code} to client_id {cid}")
-        return cid
-    logger.warning(f"Failed to resolve access_code {access_code} to client_id in Directus")
-    return None
+    """Resolve access_code to an active client's id (cached per process, see client_resolver)."""
+    return await client_resolver.resolve(access_code)
+
+
+def _json_response(request: Request, body: bytes, etag: str) -> Response:
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        if "*" in tags or etag in tags:
+            return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+async def _conditional(
+    request: Request,
+    client_id: Optional[int],
+    view: str,
+    build: Callable[[], Awaitable[Tuple[Any, bool]]],
+) -> Response:
+    """
+    Serve a client's view from the dashboard cache, or build it.
+    `build` returns (payload, cacheable); partial results after a Directus
+    failure are sent but not cached, so the next poll retries them.
+    """
+    if client_id:
+        cached = await dashboard_cache.get_entry(client_id, view)
+        if cached is not None:
+            return _json_response(request, *cached)
+
+    payload, cacheable = await build()
+    body, etag = dashboard_cache.serialise(payload)
+    if client_id and cacheable:
+        await dashboard_cache.set_entry(client_id, view, body, etag)
+    return _json_response(request, body, etag)
 
 
 @router.get("/overview")
-async def get_overview(client: Dict = Depends(get_current_client)):
+async def get_overview(request: Request, client: Dict = Depends(get_current_client)):
     """
     Dashboard overview: stats + recent activity.
+    Projects and audits are fetched concurrently.
     """
     access_code = client.get("sub")
     client_id = await _get_client_id(access_code)
 
-    # Defaults
-    stats = {
-        "active_projects": 0,
-        "total_audits": 0,
-        "completed_projects": 0,
-        "company_name": client.get("company", "Клиент"),
-    }
-    recent_projects = []
-    recent_audits = []
+    async def build():
+        # Defaults
+        stats = {
+            "active_projects": 0,
+            "total_audits": 0,
+            "completed_projects": 0,
+            "company_name": client.get("company", "Клиент"),
+        }
+        recent_projects = []
+        recent_audits = []
+        projects = audits = None
+
+        if client_id:
+            projects, audits = await asyncio.gather(
+                _directus_get("/items/projects", {
+                    "filter[client_id][_eq]": client_id,
+                    "fields": "id,title,status,progress,location,work_type,start_date",
+                    "sort": "-date_created",
+                    "limit": 10,
+                }),
+                _directus_get("/items/audit_history", {
+                    "filter[client_id][_eq]": client_id,
+                    "fields": "id,filename,work_type,confidence_score,risks_count,estimated_total,date_created",
+                    "sort": "-date_created",
+                    "limit": 10,
+                }),
+            )
+            if projects:
+                stats["active_projects"] = sum(1 for p in projects if p.get("status") in ("in_progress", "planning"))
+                stats["completed_projects"] = sum(1 for p in projects if p.get("status") == "completed")
+                recent_projects = projects[:5]
+            if audits:
+                stats["total_audits"] = len(audits)
+                recent_audits = audits[:5]
+
+        overview = {
+            "stats": stats,
+            "recent_projects": recent_projects,
+            "recent_audits": recent_audits,
+        }
+        return overview, projects is not None and audits is not None
 
-    if client_id:
-        # Fetch projects
-        projects = await _directus_get("/items/projects", {
-            "filter[client_id][_eq]": client_id,
-            "fields": "id,title,status,progress,location,work_type,start_date",
-            "sort": "-date_created",
-            "limit": 10,
-        })
-        if projects:
-            stats["active_projects"] = sum(1 for p in projects if p.get("status") in ("in_progress", "planning"))
-            stats["completed_projects"] = sum(1 for p in projects if p.get("status") == "completed")
-            recent_projects = projects[:5]
+    return await _conditional(request, client_id, "overview", build)
 
-        # Fetch audit history
-        audits = await _directus_get("/items/audit_history", {
-            "filter[client_id][_eq]": client_id,
-            "fields": "id,filename,work_type,confidence_score,risks_count,estimated_total,date_created",
-            "sort": "-date_created",
-            "limit": 10,
-        })
-        if audits:
-            stats["total_audits"] = len(audits)
-            recent_audits = audits[:5]
-
-    return {
-        "stats": stats,
-        "recent_projects": recent_projects,
-        "recent_audits": recent_audits,
+
+def _encode_cursor(row: Dict[str, Any]) -> str:
+    raw = json.dumps([row.get("date_created"), row.get("id")], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> List[Any]:
+    try:
+        date_created, row_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return [date_created, row_id]
+    except Exception:
+        raise HTTPException(status_code=400, detail="Некорректный курсор")
+
+
+async def _list_page(
+    collection: str, client_id: int, fields: str, cursor: Optional[str], limit: int,
+    deep: Optional[Dict] = None,
+) -> Tuple[Optional[List[Dict]], Optional[str]]:
+    """
+    Keyset page of a client's rows, newest first (date_created, id).
+    Returns (rows, next_cursor); rows is None when Directus fails.
+    """
+    conditions: List[Dict] = [{"client_id": {"_eq": client_id}}]
+    if cursor:
+        date_created, row_id = _decode_cursor(cursor)
+        conditions.append({"_or": [
+            {"date_created": {"_lt": date_created}},
+            {"_and": [{"date_created": {"_eq": date_created}}, {"id": {"_lt": row_id}}]},
+        ]})
+    params = {
+        "filter": json.dumps({"_and": conditions}),
+        "fields": fields,
+        "sort": "-date_created,-id",
+        "limit": limit + 1,  # one extra row tells whether there is a next page
     }
+    if deep:
+        params["deep"] = json.dumps(deep)
+
+    rows = await _directus_get(f"/items/{collection}", params)
+    if rows is None:
+        return None, None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, _encode_cursor(rows[-1])
+    return rows, None
 
 
 @router.get("/projects")
-async def get_projects(client: Dict = Depends(get_current_client)):
+async def get_projects(
+    request: Request,
+    cursor: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+    client: Dict = Depends(get_current_client),
+):
     """
-    List all projects for the authenticated client.
+    List projects for the authenticated client, newest first.
+    Pass `next_cursor` back as `cursor` for the next page.
     """
     access_code = client.get("sub")
     client_id = await _get_client_id(access_code)
 
     if not client_id:
         logger.warning(f"No client_id found for projects request (sub: {access_code})")
-        return {"projects": []}
+        return {"projects": [], "next_cursor": None}
 
-    projects = await _directus_get("/items/projects", {
-        "filter[client_id][_eq]": client_id,
-        "fields": "id,title,description,status,location,progress,work_type,start_date,end_date,tags,date_created,photos.directus_files_id.id,photos.directus_files_id.filename_disk,documents.directus_files_id.id,documents.directus_files_id.filename_download,documents.directus_files_id.title,machinery_used.machinery_id.*,client_id.manager_name,client_id.manager_contact",
-        "sort": "-date_created",
-    })
+    async def build():
+        projects, next_cursor = await _list_page(
+            "projects", client_id, PROJECT_LIST_FIELDS, cursor, limit, deep=PROJECT_LIST_DEEP
+        )
+        logger.info(f"Fetched {len(projects) if projects else 0} projects for client_id {client_id}")
+        return {"projects": projects or [], "next_cursor": next_cursor}, projects is not None
 
-    logger.info(f"Fetched {len(projects) if projects else 0} projects for client_id {client_id}")
-    return {"projects": projects or []}
+    return await _conditional(request, client_id, f"projects:{cursor or ''}:{limit}", build)
 
 
 @router.get("/projects/{project_id}")
-async def get_project_detail(project_id: int, client: Dict = Depends(get_current_client)):
+async def get_project_detail(project_id: int, request: Request, client: Dict = Depends(get_current_client)):
     """
     Get detailed information for a specific project.
     Includes security check for client ownership.
@@ -132,76 +224,114 @@ async def get_project_detail(project_id: int, client: Dict = Depends(get_current
     if not client_id:
         raise HTTPException(status_code=403, detail="Доступ запрещен")
 
-    project = await _directus_get(f"/items/projects/{project_id}", {
-        "fields": "id,title,description,status,location,progress,work_type,start_date,end_date,tags,date_created,photos.directus_files_id.id,photos.directus_files_id.filename_disk,documents.directus_files_id.id,documents.directus_files_id.filename_download,documents.directus_files_id.title,machinery_used.machinery_id.*,client_id.manager_name,client_id.manager_contact",
-    })
+    async def build():
+        project = await _directus_get(f"/items/projects/{project_id}", {
+            "fields": PROJECT_DETAIL_FIELDS,
+        })
 
-    if not project:
-        raise HTTPException(status_code=404, detail="Проект не найден")
+        if not project:
+            raise HTTPException(status_code=404, detail="Проект не найден")
 
-    # Security Check: Compare project's client_id with current authenticated client_id
-    # Note: Directus might return client_id as a dict or int depending on configuration.
-    project_client = project.get("client_id")
-    if isinstance(project_client, dict):
-        p_cid = project_client.get("id")
-    else:
-        # If it's just the ID (standard) or not returned in fields, we need to ensure it's there
-        # Let's re-fetch with client_id if not present
-        if "client_id" not in project:
-             # Basic check: if we can't verify ownership, we must deny
-             raise HTTPException(status_code=403, detail="Ошибка верификации прав доступа")
-        p_cid = project_client
+        # Security Check: Compare project's client_id with current authenticated client_id
+        # Note: Directus might return client_id as a dict or int depending on configuration.
+        project_client = project.get("client_id")
+        if isinstance(project_client, dict):
+            p_cid = project_client.get("id")
+        else:
+            # If it's just the ID (standard) or not returned in fields, we need to ensure it's there
+            # Let's re-fetch with client_id if not present
+            if "client_id" not in project:
+                 # Basic check: if we can't verify ownership, we must deny
+                 raise HTTPException(status_code=403, detail="Ошибка верификации прав доступа")
+            p_cid = project_client
 
-    if p_cid != client_id:
-        logger.warning(f"Client {client_id} attempted access to project {project_id} owned by {p_cid}")
-        raise HTTPException(status_code=403, detail="У вас нет прав доступа к этому проекту")
+        if p_cid != client_id:
+            logger.warning(f"Client {client_id} attempted access to project {project_id} owned by {p_cid}")
+            raise HTTPException(status_code=403, detail="У вас нет прав доступа к этому проекту")
 
-    return project
+        return project, True
+
+    return await _conditional(request, client_id, f"project:{project_id}", build)
 
 
 @router.get("/audit-history")
-async def get_audit_history(client: Dict = Depends(get_current_client)):
+async def get_audit_history(
+    request: Request,
+    cursor: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+    client: Dict = Depends(get_current_client),
+):
     """
-    List audit history for the authenticated client.
+    List audit history for the authenticated client, newest first.
+    The technical summary is served by /audit-history/{audit_id}.
     """
     access_code = client.get("sub")
     client_id = await _get_client_id(access_code)
 
     if not client_id:
-        return {"audits": []}
+        return {"audits": [], "next_cursor": None}
+
+    async def build():
+        audits, next_cursor = await _list_page("audit_history", client_id, AUDIT_LIST_FIELDS, cursor, limit)
+        return {"audits": audits or [], "next_cursor": next_cursor}, audits is not None
 
-    audits = await _directus_get("/items/audit_history", {
-        "filter[client_id][_eq]": client_id,
-        "fields": "id,filename,work_type,soil_type,volume,depth,confidence_score,risks_count,estimated_total,technical_summary,date_created",
-        "sort": "-date_created",
-    })
+    return await _conditional(request, client_id, f"audits:{cursor or ''}:{limit}", build)
 
-    return {"audits": audits or []}
+
+@router.get("/audit-history/{audit_id}")
+async def get_audit_detail(audit_id: int, request: Request, client: Dict = Depends(get_current_client)):
+    """
+    Get a single audit, including its technical summary.
+    """
+    access_code = client.get("sub")
+    client_id = await _get_client_id(access_code)
+
+    if not client_id:
+        raise HTTPException(status_code=403, detail="Доступ запрещен")
+
+    async def build():
+        # Ownership is part of the query: another client's audit is simply not found
+        audits = await _directus_get("/items/audit_history", {
+            "filter[id][_eq]": audit_id,
+            "filter[client_id][_eq]": client_id,
+            "fields": AUDIT_DETAIL_FIELDS,
+            "limit": 1,
+        })
+        if not audits:
+            raise HTTPException(status_code=404, detail="Аудит не найден")
+        return audits[0], True
+
+    return await _conditional(request, client_id, f"audit:{audit_id}", build)
 
 
 @router.get("/profile")
-async def get_profile(client: Dict = Depends(get_current_client)):
+async def get_profile(request: Request, client: Dict = Depends(get_current_client)):
     """
     Get client profile info.
     """
     access_code = client.get("sub")
-    data = await _directus_get("/items/clients", {
-        "filter[access_code][_eq]": access_code,
-        "fields": "id,company_name,email,phone,access_level,date_created,manager_name,manager_contact",
-        "limit": 1,
-    })
-
-    if data and len(data) > 0:
-        return {"profile": data[0]}
-
-    # Fallback from JWT
-    return {
-        "profile": {
-            "company_name": client.get("company"),
-            "email": client.get("email"),
-            "access_level": client.get("level", "standard"),
-        }
-    }
+    client_id = await _get_client_id(access_code)
+
+    async def build():
+        data = await _directus_get("/items/clients", {
+            "filter[access_code][_eq]": access_code,
+            "fields": "id,company_name,email,phone,access_level,date_created,manager_name,manager_contact",
+            "limit": 1,
+        })
+
+        if data and len(data) > 0:
+            return {"profile": data[0]}, True
+
+        # Fallback from JWT
+        return {
+            "profile": {
+                "company_name": client.get("company"),
+                "email": client.get("email"),
+                "access_level": client.get("level", "standard"),
+            }
+        }, False
+
+    return await _conditional(request, client_id, "profile", build)
 
 
 @router.patch("/profile")
@@ -225,25 +355,9 @@ async def update_profile(
     if not safe_updates:
         raise HTTPException(status_code=400, detail="Нет допустимых полей для обновления")
 
-    headers = {}
-    if settings.DIRECTUS_ADMIN_TOKEN:
-        headers["Authorization"] = f"Bearer {settings.DIRECTUS_ADMIN_TOKEN}"
-        
-    if http_manager.client:
-        res = await http_manager.client.patch(
-            f"{settings.DIRECTUS_URL}/items/clients/{client_id}",
-            json=safe_updates,
-            headers=headers
-        )
-    else:
-        async with httpx.AsyncClient(base_url=settings.DIRECTUS_URL, timeout=10.0) as http_client:
-            res = await http_client.patch(
-                f"/items/clients/{client_id}",
-                json=safe_updates,
-                headers=headers
-            )
-            
+    res = await directus_client.patch(f"/items/clients/{client_id}", json=safe_updates)
     if res.status_code != 200:
         raise HTTPException(status_code=500, detail="Ошибка обновления профиля")
+    await dashboard_cache.invalidate_client(client_id)
 
     return {"success": True, "updated": safe_updates}
@@ -1,76 +1,94 @@
+import hmac
 import logging
-import httpx
-from fastapi import APIRouter, HTTPException, Depends
-from app.api.v1.endpoints.dashboard import _directus_get # Reuse helper if possible or keep local
+from typing import List, Optional
+from fastapi import APIRouter, Header, HTTPException, status
 from app.core.config import settings
-from app.schemas.copilot import LeadInput, LeadResponse
-from app.services.amocrm import amocrm_service
-from app.services.mail import mail_service
+from app.core.http_client import directus_client
+from app.schemas.copilot import LeadInput, LeadResponse, LeadBatchResponse
+from app.services import lead_outbox
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
+
+def _directus_record(lead_data: LeadInput) -> dict:
+    return {
+        "name": lead_data.name,
+        "phone": lead_data.phone,
+        "email": lead_data.email,
+        "company": lead_data.company,
+        "audit_data": lead_data.audit_data,
+        "status": "new"
+    }
+
+
+def _crm_payload(lead_data: LeadInput, directus_id: Optional[str]) -> dict:
+    return {"directus_id": directus_id, **lead_data.model_dump()}
+
+
 @router.post("/submit", response_model=LeadResponse)
 async def submit_lead(lead_data: LeadInput):
     """
     Submits a lead from the frontend (Hero form or Audit capture).
     1. Saves the lead to Directus for local persistence and display.
-    2. Integrates with AmoCRM to create a lead/deal.
+    2. Queues the AmoCRM sync and the manager e-mail in the lead outbox
+       (delivered by the worker pool with retries), then answers at once.
     """
+    directus_id = None
+    try:
+        res = await directus_client.post("/items/leads", json=_directus_record(lead_data))
+        if res.status_code in (200, 201):
+            directus_id = str(res.json()["data"]["id"])
+        elif res.status_code != 204:
+            logger.warning(f"Failed to save lead to Directus: {res.status_code} {res.text}")
+    except Exception as e:
+        logger.error(f"Error saving lead to Directus: {e}")
+
     try:
-        # 1. Save to Directus
-        headers = {}
-        if settings.DIRECTUS_ADMIN_TOKEN:
-            headers["Authorization"] = f"Bearer {settings.DIRECTUS_ADMIN_TOKEN}"
-            
-        from app.core.http_client import http_manager
-        
-        async def _save_to_cms():
-            payload = {
-                "name": lead_data.name,
-                "phone": lead_data.phone,
-                "email": lead_data.email,
-                "company": lead_data.company,
-                "audit_data": lead_data.audit_data,
-                "status": "new"
-            }
-            if http_manager.client:
-                return await http_manager.client.post(f"{settings.DIRECTUS_URL}/items/leads", json=payload, headers=headers)
-            else:
-                async with httpx.AsyncClient(base_url=settings.DIRECTUS_URL, timeout=10.0) as cms_client:
-                    return await cms_client.post("/items/leads", json=payload, headers=headers)
+        payload = _crm_payload(lead_data, directus_id)
+        await lead_outbox.enqueue([
+            {"kind": lead_outbox.KIND_CRM, "payload": payload},
+            {"kind": lead_outbox.KIND_MAIL, "payload": payload},
+        ])
+    except Exception as e:
+        logger.error(f"Error queueing lead side effects: {e}")
+        if directus_id is None:
+            # Neither persisted nor queued: the lead would be lost
+            raise HTTPException(status_code=500, detail=f"Ошибка при отправке заявки: {str(e)}")
 
-        res = await _save_to_cms()
-        if res.status_code not in (200, 201, 204):
-            logging.warning(f"Failed to save lead to Directus: {res.status_code} {res.text}")
+    return LeadResponse(
+        success=True,
+        message="Заявка успешно отправлена. Наш инженер свяжется с вами в ближайшее время.",
+        lead_id=directus_id
+    )
 
-        # 2. Call AmoCRM (or mock)
-        lead_id = await amocrm_service.create_lead(
-            name=lead_data.name,
-            phone=lead_data.phone,
-            email=lead_data.email,
-            company=lead_data.company,
-            audit_data=lead_data.audit_data
-        )
-        
-        # 3. Notify Manager via Email
-        try:
-            await mail_service.send_lead_notification({
-                "name": lead_data.name,
-                "phone": lead_data.phone,
-                "email": lead_data.email,
-                "company": lead_data.company,
-                "audit_data": lead_data.audit_data
-            })
-        except Exception as mail_err:
-            logger.error(f"Failed to trigger mail notification: {mail_err}")
-            # We don't fail the whole request if email fails
 
-        return LeadResponse(
-            success=True,
-            message="Заявка успешно отправлена. Наш инженер свяжется с вами в ближайшее время.",
-            lead_id=lead_id
-        )
-    except Exception as e:
-        logger.error(f"Error submitting lead: {e}")
-        raise HTTPException(status_code=500, detail=f"Ошибка при отправке заявки: {str(e)}")
+@router.post("/batch", response_model=LeadBatchResponse)
+async def submit_lead_batch(leads: List[LeadInput], x_import_token: Optional[str] = Header(None)):
+    """
+    Bulk import of campaign leads (requires X-Import-Token).
+    All leads are written to Directus in one request and queued for AmoCRM,
+    which the outbox syncs in batches. No per-lead manager e-mail is sent.
+    """
+    if not settings.LEADS_IMPORT_TOKEN or not hmac.compare_digest(
+        x_import_token or "", settings.LEADS_IMPORT_TOKEN
+    ):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid import token")
+    if not leads:
+        raise HTTPException(status_code=400, detail="Пустой список заявок")
+    if len(leads) > settings.LEAD_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"Не более {settings.LEAD_BATCH_MAX} заявок за запрос")
+
+    res = await directus_client.post("/items/leads", json=[_directus_record(lead) for lead in leads])
+    if res.status_code not in (200, 201, 204):
+        logger.error(f"Failed to import leads to Directus: {res.status_code} {res.text[:200]}")
+        raise HTTPException(status_code=502, detail="Ошибка сохранения заявок")
+    saved = (res.json().get("data") or []) if res.status_code != 204 else []
+    directus_ids = [str(item.get("id")) for item in saved] or [None] * len(leads)
+
+    await lead_outbox.enqueue([
+        {"kind": lead_outbox.KIND_CRM, "payload": _crm_payload(lead, directus_id)}
+        for lead, directus_id in zip(leads, directus_ids)
+    ])
+    logger.info(f"Imported {len(leads)} leads, CRM sync queued")
+    return LeadBatchResponse(success=True, imported=len(leads), lead_ids=[i for i in directus_ids if i])
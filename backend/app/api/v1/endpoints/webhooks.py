@@ -0,0 +1,49 @@
+"""
+Inbound webhooks from Directus flows.
+Flows on `site_settings` and on `shpunts`/`machinery` changes should POST to
+/webhooks/directus/site-settings and /webhooks/directus/catalogue respectively,
+with the `X-Webhook-Secret` header set to DIRECTUS_WEBHOOK_SECRET.
+"""
+import hmac
+import logging
+from typing import Optional
+from fastapi import APIRouter, Header, HTTPException, status
+from app.core.config import settings
+from app.services.catalogue import catalogue
+from app.services.directus import global_settings_cache
+
+logger = logging.getLogger(__name__)
+router = APIRouter()
+
+
+def _check_secret(secret: Optional[str]):
+    if not settings.DIRECTUS_WEBHOOK_SECRET or not hmac.compare_digest(
+        secret or "", settings.DIRECTUS_WEBHOOK_SECRET
+    ):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid webhook secret")
+
+
+@router.post("/directus/site-settings", status_code=status.HTTP_204_NO_CONTENT)
+async def site_settings_changed(x_webhook_secret: Optional[str] = Header(None)):
+    """Drop the cached labor rates in every API and worker process."""
+    _check_secret(x_webhook_secret)
+
+    global_settings_cache.invalidate()
+    try:
+        await global_settings_cache.publish_invalidation()
+    except Exception as e:
+        # Other processes pick the change up when their TTL expires
+        logger.warning(f"Failed to publish settings invalidation: {e}")
+
+
+@router.post("/directus/catalogue", status_code=status.HTTP_204_NO_CONTENT)
+async def catalogue_changed(x_webhook_secret: Optional[str] = Header(None)):
+    """Reload the shpunts/machinery mirror in every API and worker process."""
+    _check_secret(x_webhook_secret)
+
+    catalogue.refresh()
+    try:
+        await catalogue.publish_invalidation()
+    except Exception as e:
+        # Other processes pick the change up on their next periodic refresh
+        logger.warning(f"Failed to publish catalogue refresh: {e}")
@@ -1,5 +1,5 @@
 from pydantic_settings import BaseSettings, SettingsConfigDict
-from typing import Optional
+from typing import Dict, List, Optional
 
 class Settings(BaseSettings):
     PROJECT_NAME: str = "Terra Expert"
@@ -8,18 +8,39 @@ class Settings(BaseSettings):
     # CMS
     DIRECTUS_URL: str = "http://localhost:8055"
     DIRECTUS_ADMIN_TOKEN: Optional[str] = None
+    DIRECTUS_HTTP2: bool = True
+    DIRECTUS_TIMEOUT: float = 10.0
+    DIRECTUS_MAX_CONNECTIONS: int = 50
+    DIRECTUS_MAX_KEEPALIVE: int = 20
+    DIRECTUS_KEEPALIVE_EXPIRY: float = 30.0  # seconds an idle connection stays in the pool
     ADMIN_EMAIL: str = "admin@example.com"
     ADMIN_PASSWORD: str = "password-must-be-set-via-env"
     
     # ProxyAPI
     PROXY_API_KEY: Optional[str] = None
     PROXY_API_BASE_URL: str = "https://api.proxyapi.ru/openai/v1"
+    LLM_MAX_CONCURRENCY: int = 16  # in-flight LLM requests per process, hedges included
+    LLM_TIMEOUT: float = 60.0  # seconds per attempt
+    LLM_DEADLINE: float = 150.0  # seconds per call, retries included
+    LLM_STREAM_IDLE_TIMEOUT: float = 30.0  # longest gap between streamed chunks
+    LLM_MAX_RETRIES: int = 2
+    LLM_RETRY_BACKOFF: float = 0.5  # seconds, doubled on each retry, full jitter
+    LLM_HEDGE: bool = True  # duplicate calls still unanswered after their route's p95 latency
+    LLM_HEDGE_MIN_SAMPLES: int = 20  # latencies a route needs before it is hedged
+    LLM_HEDGE_MIN_DELAY: float = 1.0
+    LLM_BREAKER_FAILURES: int = 5  # consecutive failed calls that open the circuit breaker
+    LLM_BREAKER_COOLDOWN: float = 30.0  # seconds calls fail fast before a probe is let through
 
     # Infrastructure
     REDIS_URL: str = "redis://localhost:6379/0"
+    REDIS_MAX_CONNECTIONS: int = 50
     
     # Auth
     JWT_SECRET: str = "static-placeholder-secret-replace-in-prod"
+    CLIENT_RESOLVE_TTL: int = 60  # seconds an access_code -> client_id lookup is reused (revocation delay)
+    CLIENT_RESOLVE_MAX_ENTRIES: int = 10000
+    DASHBOARD_CACHE_TTL: int = 30  # seconds a client's dashboard responses (and ETags) are reused
+    METRICS_TOKEN: Optional[str] = None  # X-Metrics-Token for GET /metrics; unset disables it
     
     # Frontend (for CORS)
     FRONTEND_URL: str = "http://localhost:3000"
@@ -28,6 +49,78 @@ class Settings(BaseSettings):
     AUDIT_RATE_LIMIT: int = 5  # requests per hour
     MAX_FILE_SIZE_MB: int = 5
 
+    # Document parsing process pool
+    PARSER_WORKERS: int = 0  # 0 = number of available cores
+    PARSER_MAX_PENDING: int = 8  # documents admitted beyond one per process; their tasks queue on the pool
+    PARSER_QUEUE_WAIT: float = 2.0  # seconds to wait for a slot before rejecting with 503
+    PARSER_TIMEOUT: int = 60  # seconds per document, all of its parser tasks included
+    PDF_SHARD_PAGES: int = 16  # pages per parser task for large PDFs
+    PDF_TEXT_BUDGET: int = 0  # chars; >0 stops extraction once the budget and section coverage are reached
+    PDF_BUDGET_HARD_FACTOR: int = 3  # stop at budget * factor even without full section coverage
+
+    # Normative RAG
+    RAG_TOP_K: int = 12  # clauses passed to the risk and summary prompts
+
+    # Per-stage audit cache (parsed document, extraction, RAG, risks, summary, questions)
+    STAGE_CACHE_TTL: int = 7 * 86400
+
+    # Global settings (labor rates) cache, invalidated by the Directus webhook
+    SETTINGS_CACHE_TTL: int = 600  # seconds a cached copy is fresh
+    SETTINGS_CACHE_STALE: int = 3600  # seconds a stale copy is served while refreshing
+    SETTINGS_INVALIDATION_CHANNEL: str = "site_settings:invalidate"
+    DIRECTUS_WEBHOOK_SECRET: Optional[str] = None  # X-Webhook-Secret expected from Directus flows
+
+    # Local catalogue mirror (shpunts, machinery)
+    CATALOGUE_REFRESH_INTERVAL: int = 900  # seconds between full reloads
+    CATALOGUE_INVALIDATION_CHANNEL: str = "catalogue:refresh"
+    CATALOGUE_MIN_SCORE: float = 0.45  # minimum match score (1.0 = exact mark)
+    CATALOGUE_SHPUNT_LIMIT: int = 5
+    CATALOGUE_MACHINERY_LIMIT: int = 3
+
+    # Rendered PDF reports, keyed by proposal hash
+    REPORT_CACHE_TTL: int = 7 * 86400
+
+    # Server-side chat sessions (/ai/chat/stream)
+    CHAT_SESSION_TTL: int = 2 * 3600  # seconds after the last turn
+    CHAT_HISTORY_MAX_MESSAGES: int = 20  # newest user/assistant messages sent back to the model
+
+    # Prompt token budgets (app/services/ai/context_window.py)
+    CONTEXT_CHUNK_TOKENS: int = 400  # document chunk size for relevance packing
+    CHAT_CONTEXT_TOKENS: int = 12000  # whole chat prompt
+    CHAT_DOC_CONTEXT_TOKENS: int = 4000  # document context within the chat prompt
+    CHAT_HISTORY_NOTE_TOKENS: int = 300  # note replacing chat turns that no longer fit
+    EXTRACT_DOC_TOKENS: int = 6000  # document text for parameter extraction
+    EXTRACT_MAP_REDUCE: bool = True  # longer documents: per-chunk cheap extraction + merge
+    EXTRACT_MAP_CHUNK_TOKENS: int = 3000
+    EXTRACT_MAP_MAX_CHUNKS: int = 24  # most relevant chunks read when a document has more
+    EXTRACT_MAP_CONCURRENCY: int = 6
+    RISKS_DOC_TOKENS: int = 1500  # document excerpt for risk assessment
+    SUMMARY_GEOLOGY_TOKENS: int = 1500  # geology section for the summary
+    VALIDATE_DOC_TOKENS: int = 600  # document head for the cheap validation call
+
+    # Analyzer model tiers, cheapest first, per route (overrides model_router.ROUTE_POLICIES)
+    AI_MODEL_ROUTES: Dict[str, List[str]] = {}
+
+    # Near-duplicate audit reuse (MinHash/LSH)
+    NEAR_DUP_THRESHOLD: float = 0.9  # estimated Jaccard similarity of word shingles
+    NEAR_DUP_TTL: int = 90 * 86400
+
+    # Audit job queue (python -m app.worker)
+    AUDIT_WORKERS: int = 2  # worker processes
+    AUDIT_JOB_MAX_ATTEMPTS: int = 3
+    AUDIT_JOB_VISIBILITY_TIMEOUT: int = 300  # seconds before an unacknowledged job is redelivered
+    AUDIT_JOB_RETRY_BACKOFF: int = 10  # seconds, doubled on each retry
+    AUDIT_JOB_CLIENT_CONCURRENCY: int = 2  # unfinished jobs per client
+    AUDIT_JOB_TTL: int = 86400
+
+    # Lead outbox (CRM sync + notifications, drained by the worker pool)
+    LEAD_OUTBOX_BATCH: int = 50  # AmoCRM complex-leads limit per call
+    LEAD_OUTBOX_MAX_ATTEMPTS: int = 8
+    LEAD_OUTBOX_RETRY_BACKOFF: int = 30  # seconds, doubled on each retry (capped at 1 h)
+    LEAD_OUTBOX_VISIBILITY_TIMEOUT: int = 120
+    LEAD_BATCH_MAX: int = 500  # leads per POST /leads/batch
+    LEADS_IMPORT_TOKEN: Optional[str] = None  # X-Import-Token for POST /leads/batch; unset disables it
+
     # Email (SMTP)
     SMTP_HOST: str = "smtp.yandex.ru"
     SMTP_PORT: int = 465
@@ -36,6 +129,12 @@ class Settings(BaseSettings):
     SMTP_FROM_NAME: str = "Terra Expert"
     SMTP_FROM_EMAIL: str = "noreply@geotech-hub.ru"
     EMAIL_ENABLED: bool = False  # Enable when SMTP credentials are set
+    MAIL_BACKEND: str = "smtp"  # smtp | file (append to MAIL_SINK_PATH, for local runs and tests)
+    MAIL_SINK_PATH: str = "mail_sink.mbox"
+    SMTP_POOL_SIZE: int = 2  # persistent authenticated connections
+    SMTP_BATCH_SIZE: int = 20  # queued messages sent per connection wake-up
+    SMTP_IDLE_TIMEOUT: float = 60.0  # seconds before an idle connection is closed
+    SMTP_TIMEOUT: float = 20.0
 
     model_config = SettingsConfigDict(
         env_file=["../.env", ".env"],
@@ -1,15 +1,89 @@
 import httpx
-from typing import Optional
+from collections import Counter
+from typing import Any, Dict, Optional
+from app.core.config import settings
 
-class HTTPClientManager:
+
+class DirectusClient:
+    """
+    Shared pooled Directus client (HTTP/2 where the server offers it, keep-alive pool).
+    Started in the FastAPI lifespan (and in each worker process). Base URL and the
+    admin token are injected here, so callers pass only the path, e.g. "/items/leads".
+    """
     client: Optional[httpx.AsyncClient] = None
 
+    def __init__(self):
+        self.requests = 0
+        self.connections_opened = 0
+        self.errors = 0
+        self.http_versions: Counter = Counter()
+
     def start(self):
-        self.client = httpx.AsyncClient(timeout=10.0)
+        headers = {}
+        if settings.DIRECTUS_ADMIN_TOKEN:
+            headers["Authorization"] = f"Bearer {settings.DIRECTUS_ADMIN_TOKEN}"
+        self.client = httpx.AsyncClient(
+            base_url=settings.DIRECTUS_URL,
+            headers=headers,
+            http2=settings.DIRECTUS_HTTP2,
+            timeout=settings.DIRECTUS_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=settings.DIRECTUS_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.DIRECTUS_MAX_KEEPALIVE,
+                keepalive_expiry=settings.DIRECTUS_KEEPALIVE_EXPIRY,
+            ),
+            event_hooks={"request": [self._on_request], "response": [self._on_response]},
+        )
 
     async def stop(self):
         if self.client:
             await self.client.aclose()
             self.client = None
 
-http_manager = HTTPClientManager()
+    async def _on_request(self, request: httpx.Request):
+        self.requests += 1
+        request.extensions["trace"] = self._trace
+
+    async def _on_response(self, response: httpx.Response):
+        self.http_versions[response.http_version] += 1
+
+    async def _trace(self, event_name: str, info: Dict[str, Any]):
+        # Fired only when the pool has to open a new connection
+        if event_name == "connection.connect_tcp.complete":
+            self.connections_opened += 1
+
+    async def request(self, method: str, path: str, **kwargs) -> httpx.Response:
+        try:
+            return await get_directus().request(method, path, **kwargs)
+        except httpx.HTTPError:
+            self.errors += 1
+            raise
+
+    async def get(self, path: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", path, **kwargs)
+
+    async def post(self, path: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", path, **kwargs)
+
+    async def patch(self, path: str, **kwargs) -> httpx.Response:
+        return await self.request("PATCH", path, **kwargs)
+
+    def stats(self) -> Dict[str, Any]:
+        reused = max(self.requests - self.connections_opened, 0)
+        return {
+            "requests": self.requests,
+            "connections_opened": self.connections_opened,
+            "connection_reuse_ratio": round(reused / self.requests, 3) if self.requests else None,
+            "errors": self.errors,
+            "http_versions": dict(self.http_versions),
+        }
+
+
+directus_client = DirectusClient()
+
+
+def get_directus() -> httpx.AsyncClient:
+    if directus_client.client is None:
+        # Scripts and tests that skip the lifespan hook
+        directus_client.start()
+    return directus_client.client
@@ -0,0 +1,253 @@
+import asyncio
+import logging
+import random
+import time
+from collections import defaultdict, deque
+from typing import Any, AsyncIterator, Callable, Dict, Optional, Tuple
+import httpx
+import openai
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+LATENCY_WINDOW = 200  # recent successful attempts kept per route and model for the hedge delay
+
+
+class CircuitOpenError(Exception):
+    """The LLM proxy is failing; calls are refused until the breaker's cooldown ends."""
+
+
+def _transient(error: BaseException) -> bool:
+    """Worth retrying (and a sign of proxy trouble): timeouts, connection errors, 429 and 5xx."""
+    if isinstance(error, (TimeoutError, openai.APIConnectionError, openai.RateLimitError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+class LLMGateway:
+    """
+    Shared ProxyAPI (OpenAI-compatible) client for every LLM call.
+    Started in the FastAPI lifespan (and in each worker process).
+
+    - at most LLM_MAX_CONCURRENCY requests in flight per process, hedges included;
+    - each attempt is cut at LLM_TIMEOUT and the whole call at LLM_DEADLINE;
+    - transient failures are retried LLM_MAX_RETRIES times with jittered
+      exponential backoff (the SDK's own retries are off);
+    - a call still unanswered after the p95 latency of its route on that model
+      gets a duplicate request if a slot is free; the first answer wins, the other is cancelled;
+    - LLM_BREAKER_FAILURES consecutive failed calls open the circuit breaker:
+      calls fail fast with CircuitOpenError for LLM_BREAKER_COOLDOWN seconds,
+      then a single probe call decides whether it closes again.
+    Streamed calls are retried only until the stream opens, are never hedged,
+    and fail when no chunk arrives for LLM_STREAM_IDLE_TIMEOUT.
+    """
+    client: Optional[openai.AsyncOpenAI] = None
+
+    def __init__(self):
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        # Keyed by (route, model): a routed escalation is slower than the cheap tier
+        self._latencies: Dict[Tuple[str, str], deque] = defaultdict(lambda: deque(maxlen=LATENCY_WINDOW))
+        self._consecutive_failures = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+        self.calls = 0
+        self.failures = 0
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.rejected = 0
+        self.breaker_trips = 0
+        self.in_flight = 0
+
+    def start(self):
+        self.client = openai.AsyncOpenAI(
+            api_key=settings.PROXY_API_KEY,
+            base_url=settings.PROXY_API_BASE_URL,
+            max_retries=0,
+            timeout=httpx.Timeout(settings.LLM_TIMEOUT, connect=10.0),
+            http_client=openai.DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=settings.LLM_MAX_CONCURRENCY,
+                    max_keepalive_connections=settings.LLM_MAX_CONCURRENCY,
+                ),
+            ),
+        )
+        self._semaphore = asyncio.Semaphore(settings.LLM_MAX_CONCURRENCY)
+
+    async def stop(self):
+        if self.client:
+            await self.client.close()
+            self.client = None
+
+    def _client(self) -> openai.AsyncOpenAI:
+        if self.client is None:
+            # Scripts and tests that skip the lifespan hook
+            self.start()
+        return self.client
+
+    # --- circuit breaker ---------------------------------------------------
+
+    def _admit(self) -> bool:
+        """Raise while the breaker is open; True if this call is the half-open probe."""
+        if self._opened_at is None:
+            return False
+        if time.monotonic() - self._opened_at < settings.LLM_BREAKER_COOLDOWN or self._probing:
+            self.rejected += 1
+            raise CircuitOpenError("LLM proxy is unavailable, try again later")
+        self._probing = True
+        return True
+
+    def _on_success(self):
+        if self._opened_at is not None:
+            logger.info("LLM circuit breaker closed")
+        self._consecutive_failures = 0
+        self._opened_at = None
+
+    def _on_failure(self, probe: bool, error: BaseException):
+        self.failures += 1
+        self._consecutive_failures += 1
+        if probe or (self._opened_at is None and self._consecutive_failures >= settings.LLM_BREAKER_FAILURES):
+            self._opened_at = time.monotonic()
+            self.breaker_trips += 1
+            logger.error(f"LLM circuit breaker open for {settings.LLM_BREAKER_COOLDOWN}s: {error!r}")
+
+    # --- calls -------------------------------------------------------------
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, settings.LLM_RETRY_BACKOFF * (2 ** attempt))
+
+    def _hedge_delay(self, key: Tuple[str, str]) -> Optional[float]:
+        latencies = self._latencies[key]
+        if not settings.LLM_HEDGE or len(latencies) < settings.LLM_HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(latencies)
+        return max(ordered[int(0.95 * (len(ordered) - 1))], settings.LLM_HEDGE_MIN_DELAY)
+
+    async def _attempt(self, route: str, kwargs: Dict[str, Any]) -> Any:
+        async with self._semaphore:
+            self.in_flight += 1
+            started = time.perf_counter()
+            try:
+                response = await asyncio.wait_for(
+                    self._client().chat.completions.create(**kwargs), settings.LLM_TIMEOUT
+                )
+            finally:
+                self.in_flight -= 1
+        self._latencies[(route, kwargs.get("model", ""))].append(time.perf_counter() - started)
+        return response
+
+    async def _hedged(self, route: str, kwargs: Dict[str, Any]) -> Any:
+        primary = asyncio.create_task(self._attempt(route, kwargs))
+        tasks = {primary}
+        try:
+            delay = self._hedge_delay((route, kwargs.get("model", "")))
+            if delay is not None:
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                # Only when a slot is free: a saturated proxy is not helped by more load
+                if not done and not self._semaphore.locked():
+                    self.hedges += 1
+                    tasks.add(asyncio.create_task(self._attempt(route, kwargs)))
+            error: Optional[BaseException] = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks | {primary}:
+                if not task.done():
+                    task.cancel()
+
+    async def _with_retries(self, route: str, call: Callable[[], Any]) -> Any:
+        """Run `call` (one request) with retries under the breaker and LLM_DEADLINE."""
+        probe = self._admit()
+        self.calls += 1
+        try:
+            async with asyncio.timeout(settings.LLM_DEADLINE):
+                for attempt in range(settings.LLM_MAX_RETRIES + 1):
+                    try:
+                        result = await call()
+                    except Exception as e:
+                        # Breaker opened meanwhile by other calls: stop retrying
+                        if not _transient(e) or attempt == settings.LLM_MAX_RETRIES or self._opened_at:
+                            raise
+                        self.retries += 1
+                        logger.warning(f"LLM {route} attempt {attempt + 1} failed, retrying: {e!r}")
+                        await asyncio.sleep(self._backoff(attempt))
+                        continue
+                    self._on_success()
+                    return result
+        except Exception as e:
+            if _transient(e):
+                self._on_failure(probe, e)
+            raise
+        finally:
+            if probe:
+                self._probing = False
+
+    async def complete(self, route: str, **kwargs) -> Any:
+        """chat.completions.create(**kwargs) with deadlines, retries, hedging and the breaker."""
+        self._client()
+        return await self._with_retries(route, lambda: self._hedged(route, kwargs))
+
+    async def _open_stream(self, kwargs: Dict[str, Any]) -> Any:
+        """One attempt at opening a stream; on success its slot stays taken until the stream ends."""
+        await self._semaphore.acquire()
+        self.in_flight += 1
+        try:
+            return await asyncio.wait_for(
+                self._client().chat.completions.create(stream=True, **kwargs), settings.LLM_TIMEOUT
+            )
+        except BaseException:
+            self.in_flight -= 1
+            self._semaphore.release()
+            raise
+
+    async def stream(self, route: str, **kwargs) -> AsyncIterator[Any]:
+        """Streamed chat completion chunks (stream=True is added)."""
+        self._client()
+        # The slot is taken per attempt, so backoff sleeps do not hold one
+        stream = await self._with_retries(route, lambda: self._open_stream(kwargs))
+        try:
+            chunks = stream.__aiter__()
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), settings.LLM_STREAM_IDLE_TIMEOUT)
+                except StopAsyncIteration:
+                    break
+                except TimeoutError as e:
+                    self._on_failure(False, e)
+                    raise
+                yield chunk
+        finally:
+            # Also reached when the consumer goes away mid-stream
+            try:
+                await stream.close()
+            finally:
+                self.in_flight -= 1
+                self._semaphore.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "failures": self.failures,
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "in_flight": self.in_flight,
+            "breaker": "open" if self._opened_at is not None else "closed",
+            "breaker_trips": self.breaker_trips,
+            "rejected": self.rejected,
+            "hedge_delay_ms": {
+                f"{route}/{model}": round(delay * 1000)
+                for route, model in list(self._latencies)
+                if (delay := self._hedge_delay((route, model))) is not None
+            },
+        }
+
+
+llm_gateway = LLMGateway()
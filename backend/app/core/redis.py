@@ -1,9 +1,83 @@
-import redis
+import asyncio
+import logging
+import redis.asyncio as aioredis
+from typing import Callable, Optional
 from app.core.config import settings
 
-# Initialize Redis client
-# The REDIS_URL should be in format redis://host:port/db
-redis_client = redis.from_url(settings.REDIS_URL, decode_responses=True)
+logger = logging.getLogger(__name__)
 
-def get_redis():
-    return redis_client
+
+class RedisManager:
+    """
+    Shared asyncio Redis connection pool.
+    Started in the FastAPI lifespan (and in each worker process); the REDIS_URL
+    should be in format redis://host:port/db
+    """
+    pool: Optional[aioredis.ConnectionPool] = None
+    client: Optional[aioredis.Redis] = None
+
+    def start(self):
+        self.pool = aioredis.ConnectionPool.from_url(
+            settings.REDIS_URL,
+            decode_responses=True,
+            max_connections=settings.REDIS_MAX_CONNECTIONS,
+        )
+        self.client = aioredis.Redis(connection_pool=self.pool)
+
+    async def stop(self):
+        if self.client:
+            await self.client.aclose()
+            self.client = None
+        if self.pool:
+            await self.pool.disconnect()
+            self.pool = None
+
+
+redis_manager = RedisManager()
+
+
+def get_redis() -> aioredis.Redis:
+    if redis_manager.client is None:
+        # Scripts and tests that skip the lifespan hook
+        redis_manager.start()
+    return redis_manager.client
+
+
+class RedisScript:
+    """
+    A Lua script hashed once and run on the shared client (EVALSHA, loading
+    it on the first NOSCRIPT). Safe to define at module level: the client is
+    looked up per call, so it follows redis_manager restarts.
+    """
+
+    def __init__(self, source: str):
+        self.source = source
+        self._script = None
+
+    async def __call__(self, keys: list, args: list):
+        client = get_redis()
+        if self._script is None:
+            self._script = client.register_script(self.source)
+        return await self._script(keys=keys, args=args, client=client)
+
+
+async def listen_channel(channel: str, on_message: Callable[[str], None], on_subscribe: Callable[[], None] = None):
+    """
+    Call `on_message(data)` for every message published on `channel`, resubscribing
+    after connection errors. Runs until cancelled; messages published while
+    disconnected are not replayed, so `on_subscribe` should resync local state.
+    """
+    while True:
+        try:
+            async with get_redis().pubsub() as pubsub:
+                await pubsub.subscribe(channel)
+                if on_subscribe:
+                    on_subscribe()
+                async for message in pubsub.listen():
+                    if message.get("type") == "message":
+                        on_message(message["data"])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Redis listener on {channel} failed, resubscribing: {e}")
+            await asyncio.sleep(5)
@@ -1,17 +1,40 @@
+import hmac
 from contextlib import asynccontextmanager
-from fastapi import FastAPI
+from typing import Optional
+from fastapi import FastAPI, Header, HTTPException, status
 from fastapi.middleware.cors import CORSMiddleware
 from app.core.config import settings
-from app.core.http_client import http_manager
-from app.api.v1.endpoints import auth, dashboard, ai_copilot, leads
+from app.core.http_client import directus_client
+from app.core.llm_gateway import llm_gateway
+from app.core.redis import redis_manager
+from app.services.ai.context_window import prompt_meter
+from app.services.ai.document_processor import doc_processor
+from app.services.ai.model_router import model_router
+from app.services.ai.stage_cache import stage_cache
+from app.services.catalogue import catalogue
+from app.services.client_resolver import client_resolver
+from app.services.mail_transport import mail_transport
+from app.services.directus import global_settings_cache
+from app.api.v1.endpoints import auth, dashboard, ai_copilot, leads, webhooks
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Startup: Initialize global HTTP client
-    http_manager.start()
+    # Startup: Initialize Directus client pool, Redis pool, parser processes, settings invalidation and catalogue mirror
+    directus_client.start()
+    llm_gateway.start()
+    redis_manager.start()
+    doc_processor.start()
+    global_settings_cache.start()
+    catalogue.start()
     yield
-    # Shutdown: Close global HTTP client
-    await http_manager.stop()
+    # Shutdown: Close Directus client pool, Redis pool and parser processes
+    await mail_transport.stop()
+    await catalogue.stop()
+    await global_settings_cache.stop()
+    doc_processor.stop()
+    await llm_gateway.stop()
+    await directus_client.stop()
+    await redis_manager.stop()
 
 app = FastAPI(
     title="Terra Expert API",
@@ -41,11 +64,32 @@ app.include_router(auth.router, prefix=f"{settings.API_V1_STR}/auth", tags=["Aut
 app.include_router(dashboard.router, prefix=f"{settings.API_V1_STR}/dashboard", tags=["Dashboard"])
 app.include_router(ai_copilot.router, prefix=f"{settings.API_V1_STR}/ai", tags=["AI Copilot"])
 app.include_router(leads.router, prefix=f"{settings.API_V1_STR}/leads", tags=["Leads"])
+app.include_router(webhooks.router, prefix=f"{settings.API_V1_STR}/webhooks", tags=["Webhooks"])
 
 @app.get("/health")
 async def health_check():
     return {"status": "ok"}
 
+@app.get("/metrics")
+async def metrics(x_metrics_token: Optional[str] = Header(None)):
+    # Exposes LLM cost, breaker state and queue internals: operators only
+    if not settings.METRICS_TOKEN or not hmac.compare_digest(
+        (x_metrics_token or "").encode("utf-8"), settings.METRICS_TOKEN.encode("utf-8")
+    ):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid metrics token")
+    return {
+        "directus": directus_client.stats(),
+        "llm": llm_gateway.stats(),
+        "document_parser": doc_processor.stats(),
+        "stage_cache": stage_cache.stats(),
+        "global_settings_cache": global_settings_cache.stats(),
+        "catalogue": catalogue.stats(),
+        "client_resolver": client_resolver.stats(),
+        "mail": mail_transport.stats(),
+        "prompt_tokens": prompt_meter.stats(),
+        "model_routes": model_router.stats(),
+    }
+
 @app.get("/")
 async def root():
     return {"message": "Welcome to Terra Expert API"}
@@ -28,6 +28,11 @@ class MachineryInfo(BaseModel):
     category: str
     price_per_shift: float = Field(0.0, description="Стоимость аренды за смену")
 
+class NearDuplicateMatch(BaseModel):
+    audit_id: str = Field(..., description="SHA-256 исходного файла ранее проведённого аудита")
+    filename: Optional[str] = None
+    similarity: float = Field(..., description="Оценка сходства по Жаккару (MinHash)")
+
 class DraftProposalResponse(BaseModel):
     parsed_data: ParsedSpecSchema
     technical_summary: str = Field(..., description="Профессиональное резюме от AI-инженера (Markdown)")
@@ -37,6 +42,14 @@ class DraftProposalResponse(BaseModel):
     estimated_total: Optional[float] = Field(None, description="Ориентировочная стоимость (может отсутствовать)")
     confidence_score: float = Field(..., description="Уровень уверенности AI в извлеченных данных (0-1)")
     clarifying_questions: List[str] = Field(default_factory=list, description="Уточняющие вопросы от AI, если данных недостаточно")
+    near_duplicate_of: Optional[NearDuplicateMatch] = Field(None, description="Ранее проведённый аудит почти идентичного документа, чьи данные переиспользованы")
+
+class AuditJobResponse(BaseModel):
+    job_id: str
+    status: str = Field(..., description="queued | running | done | failed")
+    attempts: int = 0
+    result: Optional[DraftProposalResponse] = None
+    error: Optional[str] = None
 
 class ChatMessage(BaseModel):
     role: str = Field(..., pattern="^(user|assistant|system)$")
@@ -50,6 +63,11 @@ class ChatRequest(BaseModel):
 class ChatResponse(BaseModel):
     answer: str
 
+class ChatStreamRequest(BaseModel):
+    session_id: Optional[str] = Field(None, description="ID сессии из события `session`; пусто — новая сессия")
+    message: str = Field(..., min_length=1)
+    context: Optional[str] = Field(None, description="Контекст документа, нужен только при создании сессии")
+
 class LeadInput(BaseModel):
     name: str = Field(..., min_length=2)
     phone: str = Field(..., pattern=r"^\+?[\d\s\-()]{10,}$")
@@ -62,5 +80,10 @@ class LeadResponse(BaseModel):
     message: str
     lead_id: Optional[str] = None
 
+class LeadBatchResponse(BaseModel):
+    success: bool
+    imported: int
+    lead_ids: List[str] = []
+
 class ProposalSchema(DraftProposalResponse):
     pass
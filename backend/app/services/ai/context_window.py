@@ -0,0 +1,220 @@
+"""
+Token budgets for LLM prompts (chat and analyzer).
+
+- count_tokens / message_tokens count with the target model's tiktoken
+  encoding; where the encoding cannot be loaded (it is downloaded on first use)
+  a conservative characters-per-token estimate is used instead;
+- pack_chunks fits a long document into a budget: it is split into paragraph
+  chunks of about CONTEXT_CHUNK_TOKENS, the head chunk is always kept and the
+  rest are ranked by overlap with a query (stemmed terms) and re-joined in
+  document order;
+- fit_history keeps the newest chat turns that fit and condenses the dropped
+  ones into a short note of the earlier questions;
+- prompt_meter records the prompt size of every call for /metrics.
+Tokenizing a whole document is CPU-bound: async callers run pack_chunks and
+split_chunks on full document text in a thread (asyncio.to_thread).
+"""
+import logging
+import math
+import re
+from collections import Counter
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+import tiktoken
+from app.core.config import settings
+from app.services.ai.standards_index import tokenize
+
+logger = logging.getLogger(__name__)
+
+# Fallback estimate; Cyrillic text runs at roughly 3-4 characters per token
+CHARS_PER_TOKEN = 3.0
+# Characters per token well above any real text; a prefix this long holds `budget` tokens
+MAX_CHARS_PER_TOKEN = 12
+# Per-message framing of the chat format, plus the reply priming
+MESSAGE_OVERHEAD = 3
+REPLY_OVERHEAD = 3
+
+# Paragraph breaks: blank lines, list/heading numbers, page and sheet markers of parsed documents
+_PARAGRAPH_RE = re.compile(r"\n\s*\n|\n(?=\s*(?:\d+[.)]|[-•*]) )|\n(?=--- (?:Page|Sheet)\b)")
+GAP = "\n[…]\n"
+
+
+@lru_cache(maxsize=8)
+def _encoding(model: str) -> Optional["tiktoken.Encoding"]:
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        logger.warning(f"tiktoken encoding for {model} unavailable, estimating token counts: {e}")
+        return None
+
+
+def _surely_fits(text: str, budget: int) -> bool:
+    # Every token is at least one UTF-8 byte, so this needs no tokenizing
+    return len(text.encode("utf-8")) <= budget
+
+
+def count_tokens(text: str, model: str) -> int:
+    encoding = _encoding(model)
+    if encoding is None:
+        return math.ceil(len(text) / CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def message_tokens(messages: List[Dict[str, str]], model: str) -> int:
+    """Prompt size of a chat completion request."""
+    return REPLY_OVERHEAD + sum(
+        MESSAGE_OVERHEAD + count_tokens(m.get("content") or "", model) for m in messages
+    )
+
+
+def truncate_tokens(text: str, budget: int, model: str) -> str:
+    """The head of `text` that fits into `budget` tokens."""
+    if _surely_fits(text, budget):
+        return text
+    encoding = _encoding(model)
+    if encoding is None:
+        return text[:int(budget * CHARS_PER_TOKEN)]
+    # Only a prefix of a long document needs encoding
+    head = text[:budget * MAX_CHARS_PER_TOKEN]
+    tokens = encoding.encode(head, disallowed_special=())
+    if len(tokens) <= budget:
+        if len(head) == len(text):
+            return text
+        # Text with unusually long tokens (separator runs): encode all of it
+        tokens = encoding.encode(text, disallowed_special=())
+        if len(tokens) <= budget:
+            return text
+    # A cut inside a multi-byte character decodes to U+FFFD; drop it to keep a clean prefix
+    return encoding.decode(tokens[:budget]).rstrip("\ufffd")
+
+
+def split_chunks(text: str, model: str, size: Optional[int] = None) -> List[Tuple[str, int]]:
+    """Paragraph-aligned chunks of about `size` (default CONTEXT_CHUNK_TOKENS) tokens, with their sizes."""
+    size = size or settings.CONTEXT_CHUNK_TOKENS
+    chunks: List[Tuple[str, int]] = []
+    current: List[str] = []
+    current_tokens = 0
+    for paragraph in _PARAGRAPH_RE.split(text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        tokens = count_tokens(paragraph, model)
+        if current and current_tokens + tokens > size:
+            chunks.append(("\n\n".join(current), current_tokens))
+            current, current_tokens = [], 0
+        while tokens > size:
+            # A single oversized paragraph (a long table row dump) is cut hard
+            head = truncate_tokens(paragraph, size, model) or paragraph[:int(size * CHARS_PER_TOKEN)]
+            chunks.append((head, count_tokens(head, model)))
+            paragraph = paragraph[len(head):].strip()
+            tokens = count_tokens(paragraph, model)
+        if paragraph:
+            current.append(paragraph)
+            current_tokens += tokens
+    if current:
+        chunks.append(("\n\n".join(current), current_tokens))
+    return chunks
+
+
+def rank_chunks(chunks: List[str], query: str) -> List[int]:
+    """
+    Chunk indices, the head first and the rest by overlap with `query`;
+    chunks without a query term follow in document order.
+    """
+    terms = set(tokenize(query))
+    scores = []
+    for i, chunk in enumerate(chunks[1:], start=1):
+        tf = Counter(t for t in tokenize(chunk) if t in terms)
+        scores.append((sum(1.0 + math.log(n) for n in tf.values()), i))
+    return [0] + [i for _, i in sorted(scores, key=lambda s: (-s[0], s[1]))]
+
+
+def pack_chunks(text: str, query: str, budget: int, model: str) -> str:
+    """
+    Fit `text` into `budget` tokens, preferring the chunks most relevant to `query`.
+    The document head (title, object description) is always included.
+    """
+    if _surely_fits(text, budget) or count_tokens(text, model) <= budget:
+        return text
+    chunks = split_chunks(text, model)
+    if not chunks:
+        return ""
+
+    ranked = rank_chunks([chunk for chunk, _ in chunks], query)
+    gap_tokens = count_tokens(GAP, model)
+    selected, used = [], 0
+    for i in ranked:
+        cost = chunks[i][1] + gap_tokens
+        if used + cost <= budget:
+            selected.append(i)
+            used += cost
+    if not selected:
+        return truncate_tokens(chunks[0][0], budget, model)
+
+    selected.sort()
+    parts = [chunks[selected[0]][0]]
+    for prev, i in zip(selected, selected[1:]):
+        parts.append(("\n\n" if i == prev + 1 else GAP) + chunks[i][0])
+    return "".join(parts)
+
+
+def fit_history(history: list, budget: int, model: str) -> Tuple[List[Dict[str, str]], Optional[str]]:
+    """
+    Newest chat turns (ChatMessage-like objects) that fit into `budget` tokens,
+    and a note listing the questions of the dropped older turns (None if none were dropped).
+    """
+    def newest(limit: int) -> List[Dict[str, str]]:
+        kept, used = [], 0
+        for msg in reversed(history):
+            cost = MESSAGE_OVERHEAD + count_tokens(msg.content, model)
+            if used + cost > limit:
+                break
+            kept.append({"role": msg.role, "content": msg.content})
+            used += cost
+        kept.reverse()
+        return kept
+
+    kept = newest(budget)
+    if len(kept) == len(history):
+        return kept, None
+
+    note_budget = min(settings.CHAT_HISTORY_NOTE_TOKENS, budget // 2)
+    kept = newest(budget - note_budget)
+    dropped = history[:len(history) - len(kept)]
+    questions = [m.content for m in dropped if m.role == "user"]
+    lines, used = [], count_tokens("Ранее в диалоге обсуждалось:", model)
+    for question in reversed(questions):
+        line = "- " + truncate_tokens(" ".join(question.split()), 60, model)
+        cost = count_tokens(line, model) + 1
+        if used + cost > note_budget:
+            break
+        lines.append(line)
+        used += cost
+    if not lines:
+        return kept, None
+    return kept, "Ранее в диалоге обсуждалось:\n" + "\n".join(reversed(lines))
+
+
+class PromptMeter:
+    """Prompt tokens per call site (chat, extract, risks, ...)."""
+
+    def __init__(self):
+        self.routes: Dict[str, Dict[str, int]] = {}
+
+    def record(self, route: str, messages: List[Dict[str, str]], model: str) -> int:
+        tokens = message_tokens(messages, model)
+        entry = self.routes.setdefault(route, {"calls": 0, "prompt_tokens": 0, "max_prompt_tokens": 0})
+        entry["calls"] += 1
+        entry["prompt_tokens"] += tokens
+        entry["max_prompt_tokens"] = max(entry["max_prompt_tokens"], tokens)
+        logger.debug(f"LLM call {route} ({model}): {tokens} prompt tokens")
+        return tokens
+
+    def stats(self) -> dict:
+        return {route: dict(entry) for route, entry in self.routes.items()}
+
+
+prompt_meter = PromptMeter()
@@ -1,102 +1,319 @@
 import fitz  # PyMuPDF
 import pandas as pd
+import asyncio
 import io
-import re
-from typing import Dict, List, Any, Optional
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextvars import ContextVar
+from typing import Coroutine, Dict, List, Any, Optional
 from fastapi import UploadFile
+from app.core.config import settings
+from app.services.ai.keyword_scanner import SECTION_KEYWORDS, ScanResult, section_scanner
+
+logger = logging.getLogger(__name__)
+
+# Bump when extraction output changes, to invalidate cached parses
+PARSER_VERSION = "3"
+
+
+class ParserBusyError(Exception):
+    """Every parser process is busy and the wait queue is full."""
+
+
+class ParserTimeoutError(Exception):
+    """A document took longer than PARSER_TIMEOUT to parse."""
+
+
+# ── CPU-bound parsers ──
+# Module-level so they can be shipped to worker processes.
+
+def pdf_info(content: bytes) -> Dict[str, Any]:
+    doc = fitz.open(stream=content, filetype="pdf")
+    return {
+        "pages": len(doc),
+        "title": doc.metadata.get("title", ""),
+        "author": doc.metadata.get("author", "")
+    }
+
+
+def extract_pdf_pages(content: bytes, start: int, end: int, budget: int = 0) -> List[Dict[str, Any]]:
+    """
+    Text of pages [start, end). With a character budget, stops at the first page
+    where the budget is spent and every section family has been seen.
+    """
+    doc = fitz.open(stream=content, filetype="pdf")
+    pages = []
+    chars = 0
+    covered: set = set()
+    for page_num in range(start, min(end, len(doc))):
+        page = doc[page_num]
+        text = page.get_text("text")
+        pages.append({
+            "page": page_num + 1,
+            "text": text,
+            "tables": _extract_tables_from_page(page)
+        })
+        if budget:
+            chars += len(text)
+            covered |= _section_families(text)
+            if _budget_spent(chars, covered, budget):
+                break
+    return pages
+
+
+def parse_pdf(content: bytes, budget: int = 0) -> Dict[str, Any]:
+    """Single-process PDF parse (also used when no process pool is running)."""
+    metadata = pdf_info(content)
+    pages = extract_pdf_pages(content, 0, metadata["pages"], budget)
+    return assemble_pdf(pages, metadata)
+
+
+def assemble_pdf(pages: List[Dict[str, Any]], metadata: Dict[str, Any]) -> Dict[str, Any]:
+    # Join once through a list buffer instead of repeated concatenation
+    full_text = "".join(f"\n--- Page {p['page']} ---\n{p['text']}" for p in pages)
+    metadata = {**metadata, "pages_extracted": len(pages)}
+    if len(pages) < metadata["pages"]:
+        metadata["truncated"] = True
+
+    return {
+        "full_text": full_text,
+        "metadata": metadata,
+        # Basic section detection (on the extracted prefix in budgeted mode)
+        "sections": detect_sections(full_text),
+        "structured": pages
+    }
+
+
+def _section_families(text: str) -> set:
+    return section_scanner.scan(text).families()
+
+
+def _budget_spent(chars: int, covered: set, budget: int) -> bool:
+    if chars >= budget * settings.PDF_BUDGET_HARD_FACTOR:
+        return True
+    return chars >= budget and len(covered) == len(SECTION_KEYWORDS)
+
+
+def parse_excel(content: bytes) -> Dict[str, Any]:
+    # Using pandas for robust excel reading
+    excel_file = pd.ExcelFile(io.BytesIO(content))
+    sheets_data = {}
+    full_text = ""
+
+    for sheet_name in excel_file.sheet_names:
+        df = excel_file.parse(sheet_name)
+        sheet_text = df.to_string()
+        sheets_data[sheet_name] = df.to_dict(orient="records")
+        full_text += f"\n--- Sheet: {sheet_name} ---\n{sheet_text}"
+
+    return {
+        "full_text": full_text,
+        "sheets": sheets_data,
+        "metadata": {"sheets": excel_file.sheet_names, "type": "spreadsheet"}
+    }
+
+
+def _extract_tables_from_page(page) -> List[Any]:
+    # Placeholder for more advanced table extraction (e.g. using page.find_tables())
+    # PyMuPDF has basic table support we can leverage later
+    return []
+
+
+def detect_sections(text: str, scan: Optional[ScanResult] = None) -> Dict[str, str]:
+    scan = scan or section_scanner.scan(text)
+    results = {}
+    for section_name, keywords in SECTION_KEYWORDS.items():
+        for kw in keywords:
+            offsets = scan.offsets(section_name, kw)
+            if offsets:
+                # Context around the first occurrence, within its line
+                start, end = offsets[0], offsets[0] + len(kw)
+                line_start = text.rfind("\n", 0, start) + 1
+                line_end = text.find("\n", end)
+                if line_end == -1:
+                    line_end = len(text)
+                results[section_name] = text[max(line_start, start - 200):min(line_end, end + 1000)]
+                break
+    return results
+
+
+# Pool futures of the document being parsed (set per document by _parse_document)
+_document_tasks: ContextVar[Optional[set]] = ContextVar("_document_tasks", default=None)
+
+
+def _available_cores() -> int:
+    # Respect container CPU affinity where the platform exposes it
+    if hasattr(os, "sched_getaffinity"):
+        return max(1, len(os.sched_getaffinity(0)))
+    return os.cpu_count() or 1
+
 
 class DocumentProcessor:
     """
     High-fidelity document processor for geotechnical documentation.
     Extracts text, preserves structure, and identifies key technical sections.
+
+    PDF and Excel parsing is CPU-bound: once `start()` has been called (FastAPI
+    lifespan) it runs in a bounded process pool so a large document cannot
+    stall the event loop. Without a pool it runs inline.
+    Admission is per document (workers + PARSER_MAX_PENDING at a time); the
+    pool tasks of an admitted document queue on the executor.
     """
-    
+
     def __init__(self):
-        # Keywords for section identification
-        self.sections = {
-            "geology": ["инженерно-геологические", "грунты", "разрез", "геология"],
-            "construction": ["конструктивные решения", "ограждение", "шпунт", "сваи"],
-            "hydrology": ["гидрогеологические", "угв", "уровень вод", "подземные воды"],
-            "project_info": ["заказчик", "объект", "адрес", "местоположение"]
+        self.sections = SECTION_KEYWORDS
+        self.executor: Optional[ProcessPoolExecutor] = None
+        self.workers = 0
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._in_flight = 0
+        self._completed = 0
+        self._rejected = 0
+        self._timeouts = 0
+
+    def start(self):
+        self.workers = settings.PARSER_WORKERS or _available_cores()
+        # Not fork: by now this process has an event loop, connection pools and
+        # threads whose locks a forked child could inherit held
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload([__name__])
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+        # Running + waiting documents; beyond this new uploads are turned away
+        self._slots = asyncio.Semaphore(self.workers + settings.PARSER_MAX_PENDING)
+        logger.info(f"Document parser pool started with {self.workers} processes")
+
+    def stop(self):
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+            self._slots = None
+
+    def stats(self) -> Dict[str, Any]:
+        """Pool queue-depth metrics."""
+        return {
+            "mode": "process_pool" if self.executor else "inline",
+            "workers": self.workers,
+            "in_flight": self._in_flight,
+            "queued": max(0, self._in_flight - self.workers),
+            "max_pending": settings.PARSER_MAX_PENDING,
+            "completed": self._completed,
+            "rejected": self._rejected,
+            "timeouts": self._timeouts,
         }
 
     async def process_file(self, file: UploadFile) -> Dict[str, Any]:
         content = await file.read()
-        filename = file.filename.lower()
         await file.seek(0)
-        
+        return await self.process_bytes(content, file.filename)
+
+    async def process_bytes(self, content: bytes, filename: str) -> Dict[str, Any]:
+        """Same as process_file, for content already read (streams, background jobs)."""
+        filename = filename.lower()
         if filename.endswith(".pdf"):
-            return self._process_pdf(content)
+            if self.executor is None:
+                return parse_pdf(content, settings.PDF_TEXT_BUDGET)
+            return await self._parse_document(self._process_pdf_sharded(content))
         elif filename.endswith((".xlsx", ".xls")):
-            return self._process_excel(content)
+            return await self._parse_document(self._run(parse_excel, content))
         else:
             text = content.decode("utf-8", errors="ignore")
             return {"full_text": text, "metadata": {"filename": filename, "type": "text"}}
 
-    def _process_pdf(self, content: bytes) -> Dict[str, Any]:
-        doc = fitz.open(stream=content, filetype="pdf")
-        full_text = ""
-        structured_content = []
-        
-        for page_num, page in enumerate(doc):
-            text = page.get_text("text")
-            full_text += f"\n--- Page {page_num + 1} ---\n{text}"
-            structured_content.append({
-                "page": page_num + 1,
-                "text": text,
-                "tables": self._extract_tables_from_page(page)
-            })
-            
-        metadata = {
-            "pages": len(doc),
-            "title": doc.metadata.get("title", ""),
-            "author": doc.metadata.get("author", "")
-        }
-        
-        # Basic section detection in full text
-        detected_sections = self._detect_sections(full_text)
-        
-        return {
-            "full_text": full_text,
-            "metadata": metadata,
-            "sections": detected_sections,
-            "structured": structured_content
-        }
+    async def _process_pdf_sharded(self, content: bytes) -> Dict[str, Any]:
+        """
+        Split the page range across the pool and join the pages once, in a thread here.
+        In budgeted mode shards go out in waves of one per process, and no
+        further waves are sent once the prefix has enough text and coverage.
+        """
+        metadata = await self._run(pdf_info, content)
+        total = metadata["pages"]
+        budget = settings.PDF_TEXT_BUDGET
+        if total <= settings.PDF_SHARD_PAGES:
+            pages = await self._run(extract_pdf_pages, content, 0, total, budget)
+            return await asyncio.to_thread(assemble_pdf, pages, metadata)
 
-    def _process_excel(self, content: bytes) -> Dict[str, Any]:
-        # Using pandas for robust excel reading
-        excel_file = pd.ExcelFile(io.BytesIO(content))
-        sheets_data = {}
-        full_text = ""
-        
-        for sheet_name in excel_file.sheet_names:
-            df = excel_file.parse(sheet_name)
-            sheet_text = df.to_string()
-            sheets_data[sheet_name] = df.to_dict(orient="records")
-            full_text += f"\n--- Sheet: {sheet_name} ---\n{sheet_text}"
-            
-        return {
-            "full_text": full_text,
-            "sheets": sheets_data,
-            "metadata": {"sheets": excel_file.sheet_names, "type": "spreadsheet"}
-        }
+        shard = settings.PDF_SHARD_PAGES if budget else max(settings.PDF_SHARD_PAGES, -(-total // self.workers))
+        ranges = [(start, min(start + shard, total)) for start in range(0, total, shard)]
+        wave_size = self.workers if budget else len(ranges)
 
-    def _extract_tables_from_page(self, page) -> List[Any]:
-        # Placeholder for more advanced table extraction (e.g. using page.find_tables())
-        # PyMuPDF has basic table support we can leverage later
-        return []
-
-    def _detect_sections(self, text: str) -> Dict[str, str]:
-        results = {}
-        for section_name, keywords in self.sections.items():
-            for kw in keywords:
-                if kw.lower() in text.lower():
-                    # Attempt to extract context around the keyword
-                    match = re.search(f"(?i).{{0,200}}{kw}.{{0,1000}}", text)
-                    if match:
-                        results[section_name] = match.group(0)
+        pages: List[Dict[str, Any]] = []
+        chars = 0
+        covered: set = set()
+        for i in range(0, len(ranges), wave_size):
+            wave = ranges[i:i + wave_size]
+            results = await asyncio.gather(*[
+                self._run(extract_pdf_pages, content, start, end, budget) for start, end in wave
+            ])
+            for shard_pages in results:
+                for page in shard_pages:
+                    if budget and _budget_spent(chars, covered, budget):
                         break
-        return results
+                    pages.append(page)
+                    if budget:
+                        chars += len(page["text"])
+                        covered |= _section_families(page["text"])
+            if budget and _budget_spent(chars, covered, budget):
+                break
+
+        # Joining is cheap next to pickling every page to a process and the text back
+        return await asyncio.to_thread(assemble_pdf, pages, metadata)
+
+    async def _parse_document(self, parse: Coroutine[Any, Any, Dict[str, Any]]) -> Dict[str, Any]:
+        """One admission slot and one PARSER_TIMEOUT for the whole document, however many pool tasks it takes."""
+        if self.executor is None:
+            return await parse
+
+        slots = self._slots
+        try:
+            await asyncio.wait_for(slots.acquire(), timeout=settings.PARSER_QUEUE_WAIT)
+        except asyncio.TimeoutError:
+            parse.close()
+            self._rejected += 1
+            raise ParserBusyError("Document parser is overloaded, try again shortly")
+
+        self._in_flight += 1
+        tasks: set = set()
+        token = _document_tasks.set(tasks)
+        try:
+            async with asyncio.timeout(settings.PARSER_TIMEOUT):
+                return await parse
+        except TimeoutError:
+            self._timeouts += 1
+            raise ParserTimeoutError(f"Document parsing exceeded {settings.PARSER_TIMEOUT}s")
+        finally:
+            _document_tasks.reset(token)
+            self._release_after(slots, tasks)
+
+    def _release_after(self, slots: asyncio.Semaphore, tasks: set):
+        # A timed-out parse keeps its processes busy until its tasks really end,
+        # so the document's slot is only freed then
+        pending = {future for future in tasks if not future.done()}
+
+        def _release():
+            self._in_flight -= 1
+            self._completed += 1
+            slots.release()
+
+        def _on_done(future):
+            pending.discard(future)
+            if not pending:
+                _release()
+
+        if not pending:
+            _release()
+        for future in list(pending):
+            future.add_done_callback(_on_done)
+
+    async def _run(self, parser, *args) -> Any:
+        if self.executor is None:
+            return parser(*args)
+        future = asyncio.get_running_loop().run_in_executor(self.executor, parser, *args)
+        tasks = _document_tasks.get()
+        if tasks is not None:
+            tasks.add(future)
+        # Shielded: a document past its deadline stops waiting, the process finishes the task
+        return await asyncio.shield(future)
 
 # Singleton instance
 doc_processor = DocumentProcessor()
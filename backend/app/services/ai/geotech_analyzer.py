@@ -4,171 +4,574 @@ Coordinates document processing, RAG with standards, and engineering risk assess
 
 Quick Wins applied:
 - temperature=0.2 for deterministic technical output
-- Full RAG across all 8 standards (not just ГОСТ 25100)
+- Full RAG across all 8 standards (not just ГОСТ 25100), BM25-ranked
 - Smart confidence score based on field completeness
 - Improved prompts with role correction and structured output
 """
+import asyncio
 import json
 import logging
-from typing import Dict, Any, List, Tuple
-from openai import AsyncOpenAI
+import math
+import re
+from contextlib import aclosing
+from typing import Dict, Any, List, Tuple, Optional, Callable, Awaitable
 from app.core.config import settings
+from app.core.llm_gateway import llm_gateway
 from app.schemas.copilot import ParsedSpecSchema
+from app.services.ai.context_window import (
+    count_tokens, pack_chunks, prompt_meter, rank_chunks, split_chunks, truncate_tokens,
+)
 from app.services.ai.document_processor import DocumentProcessor
+from app.services.ai.stage_scheduler import Stage, StageScheduler
+from app.services.ai.stage_cache import stage_cache, fingerprint
+from app.services.ai.keyword_scanner import GEOTECH_KEYWORDS, KeywordScanner, ScanResult
+from app.services.ai.model_router import model_router
+from app.services.ai.spec_merge import Candidate, NUMERIC_FIELDS, merge_partials, to_number
+from app.services.ai.standards_index import StandardsIndex, tokenize
 
 logger = logging.getLogger(__name__)
 
 # ── Constants ──
+# Token counting only; each call's model comes from its model_router route
 AI_MODEL = "gpt-4o"
 AI_MODEL_CHEAP = "gpt-4o-mini"
 AI_TEMPERATURE = 0.2  # Low temperature for deterministic technical extraction
+RAG_PARAMETER_BOOST = 3.0  # query weight of extracted parameters vs. document terms
+RAG_MIN_STEM = 3  # shorter stems would match the start of too many unrelated words
+
+# Terms that mark the passages extraction needs (pile schedule, soils, groundwater, volumes)
+EXTRACTION_QUERY = (
+    "шпунт ларсен профиль марка сваи свая погружение вдавливание вибропогружение забивка бурение "
+    "глубина отметка длина грунт грунты суглинок супесь песок глина торф скальный "
+    "уровень грунтовых вод угв водоносный объем тонн количество котлован стесненность здания"
+)
+
+# ── System prompts ──
+# Stage cache entries are versioned by a hash of these, so editing a prompt
+# invalidates only its own stage.
+
+EXTRACTION_PROMPT = (
+    "Ты — старший инженер-геотехник с 20+ летним опытом проектирования "
+    "оснований и фундаментов. Твоя задача — ТОЧНО извлечь ключевые "
+    "технические параметры из проектной/сметной документации.\n\n"
+    "Верни строго JSON со следующими полями:\n"
+    "- work_type (str): Тип работ\n"
+    "- volume (float|null): Объем работ (в тоннах для шпунта, в метрах для бурения/вдавливания)\n"
+    "- soil_type (str|null): Тип грунта\n"
+    "- required_profile (str|null): Марка шпунта\n"
+    "- depth (float|null): Глубина погружения в метрах\n"
+    "- groundwater_level (float|null): УГВ в метрах\n"
+    "- special_conditions (list[str]): Особые условия\n"
+    "- complexity_coefficient (float): Оцени от 1.0 до 1.5 (1.5 — стесненность, здания рядом, болото)\n"
+    "- estimated_shifts (int): Оцени кол-во смен (исходя из объема и типа работ)\n\n"
+    "ВАЖНО: volume, depth, groundwater_level — ТОЛЬКО числа (float), "
+    "без единиц измерения. Complexity_coefficient — float, estimated_shifts — int. "
+    "Если данных нет — ставь null для числовых параметров или пустой список для условий."
+)
+
+MAP_EXTRACTION_PROMPT = (
+    "Ты — инженер-геотехник. Перед тобой ФРАГМЕНТ большого проектного документа. "
+    "Извлеки только те параметры, которые в этом фрагменте указаны явно; "
+    "ничего не додумывай по другим частям документа.\n\n"
+    "Верни строго JSON со следующими полями (null, если во фрагменте нет данных):\n"
+    "- work_type (str|null): Тип работ\n"
+    "- volume (float|null): Объем работ (в тоннах для шпунта, в метрах для бурения/вдавливания)\n"
+    "- soil_type (str|null): Тип грунта\n"
+    "- required_profile (str|null): Марка шпунта\n"
+    "- depth (float|null): Глубина погружения в метрах\n"
+    "- groundwater_level (float|null): УГВ в метрах\n"
+    "- special_conditions (list[str]): Особые условия (пустой список, если нет)\n"
+    "- complexity_coefficient (float|null): от 1.0 до 1.5, только если фрагмент описывает условия площадки\n"
+    "- estimated_shifts (int|null): только если во фрагменте есть объем работ\n"
+    "- evidence (object): для каждого найденного поля — короткая цитата из фрагмента (до 100 символов)\n\n"
+    "Числа — без единиц измерения."
+)
+
+RESOLVE_PROMPT = (
+    "Ты — старший инженер-геотехник. Параметры объекта извлекались по частям "
+    "большого документа, и для некоторых из них части документа дают разные значения.\n"
+    "Для каждого спорного параметра выбери верное значение по цитатам и страницам "
+    "(например, проектное значение вместо справочного; объем — итоговый по ведомости, "
+    "а не по отдельному участку). Оцени также complexity_coefficient (1.0–1.5) и "
+    "estimated_shifts (int) для объекта в целом.\n\n"
+    "Верни строго JSON только со спорными полями, complexity_coefficient и estimated_shifts. "
+    "Числа — float без единиц измерения, null — если определить нельзя; "
+    "work_type — всегда строка."
+)
+
+RISKS_PROMPT = (
+    "Ты — эксперт по геотехническим рискам. Проанализируй инженерные "
+    "риски объекта, используя приведённые нормативные документы.\n\n"
+    "Учитывай:\n"
+    "- Тип грунта и его особенности\n"
+    "- Глубину котлована / погружения\n"
+    "- Уровень грунтовых вод\n"
+    "- Близость к существующей застройке\n"
+    "- Метод производства работ (вибро, вдавливание, забивка)\n"
+    "- Нормативные требования из приведённых ГОСТ и СП\n\n"
+    "Верни JSON: {\"risks\": [{\"risk\": str, \"impact\": str}, ...]}\n"
+    "Каждый risk — конкретная инженерная угроза.\n"
+    "Каждый impact — уровень (Критический/Высокий/Средний) + последствия."
+)
+
+SUMMARY_PROMPT = (
+    "Ты — главный инженер-геотехник, составляющий экспертное заключение "
+    "для B2B клиента. Стиль: строгий, профессиональный, инженерный.\n\n"
+    "Структура заключения (Markdown):\n"
+    "## Анализ объекта\n"
+    "Краткое описание задачи, тип работ, ключевые параметры.\n\n"
+    "## Оценка сложности\n"
+    "Геология, гидрогеология, стесненность, специфические условия.\n\n"
+    "## Рекомендации\n"
+    "Метод работ, оборудование, технологические решения.\n\n"
+    "## Критические риски\n"
+    "Основные угрозы, ссылки на нормативы.\n\n"
+    "Используй ссылки на конкретные ГОСТ и СП из контекста."
+)
+
+VALIDATION_PROMPT = (
+    "Определи, является ли текст техническим заданием, "
+    "спецификацией или отчетом в области ГЕОТЕХНИКИ, "
+    "СТРОИТЕЛЬСТВА ФУНДАМЕНТОВ или ШПУНТОВЫХ ОГРАЖДЕНИЙ.\n"
+    "Ответь JSON: {\"is_geotech\": bool, \"reason\": str}"
+)
+
+QUESTIONS_PROMPT = (
+    "Ты — опытный главный инженер. Твоя задача — задать 3 коротких, "
+    "профессиональных вопроса заказчику, чтобы уточнить ТЗ.\n"
+    "Спрашивай только о том, чего не хватает для точного расчета (грунт, глубина, нагрузки).\n"
+    "Верни JSON: {\"questions\": [\"Вопрос 1?\", \"Вопрос 2?\", \"Вопрос 3?\"]}"
+)
+
+# Stage results forwarded to streaming consumers, keyed by stage name
+STREAMED_STAGE_EVENTS = {"extract": "parsed_data", "risks": "risks"}
+
+EventCallback = Callable[[str, Any], Awaitable[None]]
+
+
+# Values a document states that an extraction must not miss
+_EXPECTED_FIELDS = (
+    ("required_profile", re.compile(r"(?:\bл|\bl|ларсен\w*|larss?en\w*)\s*-?\s*\d", re.I)),
+    ("groundwater_level", re.compile(r"\bугв\b|грунтов\w* вод", re.I)),
+    ("depth", re.compile(r"глубин\w* (?:погружения|забивки|котлована)|длин\w* шпунт|отметк\w* (?:низа|острия)", re.I)),
+    ("volume", re.compile(r"\d\s*(?:т|тн|тонн\w*|п\.\s?м|м\.\s?п)\b", re.I)),
+)
+_SUMMARY_HEADINGS = ("## Анализ объекта", "## Оценка сложности", "## Рекомендации", "## Критические риски")
+_IMPACT_LEVELS = ("критич", "высок", "средн")
+
+
+def _check_extraction(data: ParsedSpecSchema, text: str) -> Optional[str]:
+    """Reason to escalate an extraction: a missed stated value or an implausible one."""
+    if not (data.work_type or "").strip():
+        return "no work_type"
+    if data.depth is not None and not 0 < data.depth <= 80:
+        return f"implausible depth {data.depth}"
+    if data.groundwater_level is not None and abs(data.groundwater_level) > 50:
+        return f"implausible groundwater level {data.groundwater_level}"
+    if data.volume is not None and data.volume <= 0:
+        return f"implausible volume {data.volume}"
+    missed = [name for name, pattern in _EXPECTED_FIELDS if getattr(data, name) is None and pattern.search(text)]
+    return f"missed {', '.join(missed)}" if missed else None
+
+
+def _check_risks(risks: Any) -> Optional[str]:
+    if not isinstance(risks, list) or len(risks) < 2:
+        return "fewer than 2 risks"
+    for item in risks:
+        if not isinstance(item, dict) or not item.get("risk") or not item.get("impact"):
+            return "malformed risk item"
+        if not any(level in str(item["impact"]).lower() for level in _IMPACT_LEVELS):
+            return "impact without a level"
+    return None
+
+
+def _check_summary(summary: str) -> Optional[str]:
+    missing = [h for h in _SUMMARY_HEADINGS if h not in (summary or "")]
+    if missing:
+        return f"missing sections {missing}"
+    if not re.search(r"ГОСТ|СП\s*\d", summary):
+        return "no normative references"
+    return None
+
+
+def _check_questions(questions: Any) -> Optional[str]:
+    if not isinstance(questions, list) or not questions:
+        return "no questions"
+    if not all(isinstance(q, str) and len(q) >= 15 and "?" in q for q in questions):
+        return "malformed question"
+    return None
+
+
+_PAGE_MARK_RE = re.compile(r"--- (Page|Sheet):? ([^-\n]+?) ---")
+
+
+def _chunk_labels(chunks: List[str]) -> List[str]:
+    """Where each chunk sits in the document ("стр. 40–41", "лист Ведомость")."""
+    labels, last = [], "начало документа"
+    for chunk in chunks:
+        marks = _PAGE_MARK_RE.findall(chunk)
+        if marks:
+            kind = "стр." if marks[0][0] == "Page" else "лист"
+            first, end = marks[0][1].strip(), marks[-1][1].strip()
+            label = f"{kind} {first}" if first == end else f"{kind} {first}–{end}"
+            # A chunk that starts mid-page continues the previous one
+            if not chunk.lstrip().startswith("---"):
+                label = f"{last}; {label}"
+            last = f"{kind} {end}"
+        else:
+            label = last
+        labels.append(label)
+    return labels
 
 
 class GeotechAnalyzer:
     """
     Expert system for geotechnical audit.
-    Pipeline: Pre-validate → Extract → RAG Risk Assessment → Summary.
+    Pipeline: (Pre-validate ∥ Extract) → RAG → Risk Assessment → (Summary ∥ Questions).
     """
 
     def __init__(self):
-        self.client = AsyncOpenAI(
-            api_key=settings.PROXY_API_KEY,
-            base_url=settings.PROXY_API_BASE_URL,
-        )
         self.standards_path = "app/data/standards/geotech_standards.json"
         try:
             with open(self.standards_path, "r", encoding="utf-8") as f:
                 self.standards = json.load(f)
         except Exception:
             self.standards = {}
+        self.standards_index = StandardsIndex(self.standards)
 
         # Heuristic keywords for quick validation
-        self.geotech_keywords = [
-            "шпунт", "сваи", "свая", "грунт", "геология", "котлован", "фундамент",
-            "бурение", "вдавливание", "статическое", "динамическое",
-            "уровень вод", "скважина", "разрез", "профиль", "основание",
-            "несущая способность", "осадка", "деформация", "испытание",
-        ]
+        self.geotech_keywords = GEOTECH_KEYWORDS
+        # Stems are word prefixes, so the corpus vocabulary is scanned as keywords too
+        self.scanner = KeywordScanner({
+            "geotech": self.geotech_keywords,
+            "standards": [term for term in self.standards_index.vocabulary if len(term) >= RAG_MIN_STEM],
+        })
+
+        # Stage cache versions: prompt + model + sampling (+ data the stage reads)
+        self.stage_versions = {
+            "validate": fingerprint(
+                VALIDATION_PROMPT, model_router.tiers("validate"), 0.0, self.geotech_keywords,
+            ),
+            "extract": fingerprint(
+                EXTRACTION_PROMPT, model_router.tiers("extract"), AI_TEMPERATURE,
+                MAP_EXTRACTION_PROMPT, model_router.tiers("extract_map"),
+                RESOLVE_PROMPT, model_router.tiers("extract_resolve"), settings.EXTRACT_MAP_CHUNK_TOKENS,
+            ),
+            "rag": fingerprint(self.standards, settings.RAG_TOP_K, RAG_PARAMETER_BOOST),
+            "risks": fingerprint(
+                RISKS_PROMPT, model_router.tiers("risks"), AI_TEMPERATURE, settings.RISKS_DOC_TOKENS,
+            ),
+            "summary": fingerprint(
+                SUMMARY_PROMPT, model_router.tiers("summary"), 0.35, settings.SUMMARY_GEOLOGY_TOKENS,
+            ),
+            "questions": fingerprint(QUESTIONS_PROMPT, model_router.tiers("questions"), 0.3),
+        }
 
     # ═══════════════════════════════════════════════
     # Public API
     # ═══════════════════════════════════════════════
 
-    async def analyze_project(self, processed_doc: Dict[str, Any]) -> Dict[str, Any]:
-        """Main entry point for professional audit."""
-        full_text = processed_doc.get("full_text", "")
-        sections = processed_doc.get("sections", {})
+    async def analyze_project(
+        self,
+        processed_doc: Dict[str, Any],
+        on_event: Optional[EventCallback] = None,
+        prior: Optional[Dict[str, Any]] = None,
+    ) -> Dict[str, Any]:
+        """
+        Main entry point for professional audit.
 
-        # 0. Pre-validation
-        is_valid, reason = await self._pre_validate_document(full_text)
-        if not is_valid:
-            raise ValueError(f"Not a geotechnical document: {reason}")
+        Stages run as a dependency graph: pre-validation overlaps extraction,
+        summary and clarifying questions overlap once risks are known.
+        A failed validation cancels every stage still in flight.
 
-        # 1. Extract technical parameters
-        technical_data = await self._extract_technical_parameters(full_text)
+        If `on_event(name, payload)` is given, it receives "parsed_data" and
+        "risks" as soon as they are ready, and "summary_delta" for every
+        streamed summary token.
 
-        # 2. Build RAG context from ALL standards
-        rag_context = self._build_rag_context(technical_data, full_text)
+        `prior` ({"parsed_data", "risks"}) reuses the extraction and risks of an
+        earlier near-identical audit; the remaining stages still run.
+        """
+        full_text = processed_doc.get("full_text", "")
+        sections = processed_doc.get("sections", {})
 
-        # 3. Risk assessment with full standards context
-        risks = await self._assess_engineering_risks(technical_data, full_text, rag_context)
+        text_hash = fingerprint(full_text)
+        versions = self.stage_versions
+        # One keyword pass feeds validation, RAG and the confidence score
+        scan = self.scanner.scan(full_text)
+
+        async def validate(_: Dict[str, Any]) -> str:
+            try:
+                is_valid, reason = await stage_cache.get_or_compute(
+                    "validate", versions["validate"], text_hash,
+                    lambda: self._pre_validate_document(full_text, scan),
+                )
+            except Exception as e:
+                # Applied outside the cache: a proxy blip must not pin a heuristic verdict
+                logger.warning(f"Validation failed, using keyword heuristic: {e}")
+                is_valid, reason = scan.distinct("geotech") >= 1, "Fallback heuristic"
+            if not is_valid:
+                raise ValueError(f"Not a geotechnical document: {reason}")
+            return reason
+
+        async def extract(_: Dict[str, Any]) -> ParsedSpecSchema:
+            too_long = settings.EXTRACT_MAP_REDUCE and (
+                await asyncio.to_thread(count_tokens, full_text, AI_MODEL) > settings.EXTRACT_DOC_TOKENS
+            )
+            if too_long:
+                # Too long for one prompt: every chunk is read by the cheap model
+                key, compute = ("map_reduce", text_hash), lambda: self._map_reduce_extract(full_text)
+            else:
+                # Keyed by the packed text the model actually sees
+                text = await asyncio.to_thread(
+                    pack_chunks, full_text, EXTRACTION_QUERY, settings.EXTRACT_DOC_TOKENS, AI_MODEL
+                )
+                key, compute = text, lambda: self._extract_technical_parameters(text)
+            return await stage_cache.get_or_compute(
+                "extract", versions["extract"], key, compute,
+                dump=lambda d: d.model_dump(), load=lambda d: ParsedSpecSchema(**d),
+            )
 
-        # 4. Expert summary
-        summary = await self._generate_professional_summary(
-            technical_data, risks, sections, rag_context
-        )
+        async def rag(r: Dict[str, Any]) -> str:
+            async def build() -> str:
+                return self._build_rag_context(r["extract"], scan)
+            return await stage_cache.get_or_compute(
+                "rag", versions["rag"], (r["extract"].model_dump(), text_hash), build,
+            )
 
-        # 5. Smart confidence
-        confidence = self._compute_confidence(technical_data, full_text)
+        async def assess(r: Dict[str, Any]) -> List[Dict[str, str]]:
+            return await stage_cache.get_or_compute(
+                "risks", versions["risks"], (r["extract"].model_dump(), r["rag"], text_hash),
+                lambda: self._assess_engineering_risks(r["extract"], full_text, r["rag"]),
+            )
 
-        # 6. Generate Clarifying Questions if needed
-        questions = []
-        if confidence < 0.8:
-            questions = await self._generate_clarifying_questions(technical_data, risks)
+        async def summarize(r: Dict[str, Any]) -> str:
+            async def emit_delta(token: str):
+                await on_event("summary_delta", token)
+
+            on_token = emit_delta if on_event else None
+            streamed = False
+
+            async def generate() -> str:
+                nonlocal streamed
+                streamed = True
+                return await self._generate_professional_summary(
+                    r["extract"], r["risks"], sections, r["rag"], on_token=on_token
+                )
+
+            inputs = (r["extract"].model_dump(), r["risks"], r["rag"], sections.get("geology"))
+            summary = await stage_cache.get_or_compute("summary", versions["summary"], inputs, generate)
+            if on_token and not streamed:
+                # Cached summaries are replayed to stream consumers in one piece
+                await on_token(summary)
+            return summary
+
+        async def ask(r: Dict[str, Any]) -> List[str]:
+            if self._compute_confidence(r["extract"], full_text, scan) >= 0.8:
+                return []
+            try:
+                return await stage_cache.get_or_compute(
+                    "questions", versions["questions"], (r["extract"].model_dump(), r["risks"]),
+                    lambda: self._generate_clarifying_questions(r["extract"], r["risks"]),
+                )
+            except Exception as e:
+                # Not cached, so the next run of this document asks again
+                logger.warning(f"Failed to generate questions: {e}")
+                return []
+
+        async def forward(stage_name: str, result: Any):
+            if on_event and stage_name in STREAMED_STAGE_EVENTS:
+                await on_event(STREAMED_STAGE_EVENTS[stage_name], result)
+
+        scheduler = StageScheduler([
+            Stage("validate", validate),
+            Stage("extract", extract),
+            Stage("rag", rag, depends_on=("validate", "extract")),
+            Stage("risks", assess, depends_on=("rag",)),
+            Stage("summary", summarize, depends_on=("rag", "risks")),
+            Stage("questions", ask, depends_on=("risks",)),
+        ], on_complete=forward)
+
+        initial: Dict[str, Any] = {}
+        if prior:
+            initial = {"extract": ParsedSpecSchema(**prior["parsed_data"]), "risks": prior["risks"]}
+            for stage_name, result in initial.items():
+                await forward(stage_name, result)
+        results = await scheduler.run(initial)
+        technical_data = results["extract"]
 
         return {
             "parsed_data": technical_data,
-            "risks": risks,
-            "technical_summary": summary,
-            "confidence_score": confidence,
-            "clarifying_questions": questions,
+            "risks": results["risks"],
+            "technical_summary": results["summary"],
+            "confidence_score": self._compute_confidence(technical_data, full_text, scan),
+            "clarifying_questions": results["questions"],
+            "stage_timings": scheduler.timings,
         }
 
+    async def _complete(self, route: str, model: str, messages: List[Dict[str, str]], **kwargs):
+        """One chat completion, with prompt size and token usage recorded under `route`."""
+        prompt_meter.record(route, messages, model)
+        response = await llm_gateway.complete(route, model=model, messages=messages, **kwargs)
+        model_router.record_usage(route, model, response.usage)
+        return response
+
     # ═══════════════════════════════════════════════
     # Step 1: Technical Parameter Extraction
     # ═══════════════════════════════════════════════
 
     async def _extract_technical_parameters(self, text: str) -> ParsedSpecSchema:
-        response = await self.client.chat.completions.create(
-            model=AI_MODEL,
-            temperature=AI_TEMPERATURE,
-            messages=[
-                {
-                    "role": "system",
-                    "content": (
-                        "Ты — старший инженер-геотехник с 20+ летним опытом проектирования "
-                        "оснований и фундаментов. Твоя задача — ТОЧНО извлечь ключевые "
-                        "технические параметры из проектной/сметной документации.\n\n"
-                        "Верни строго JSON со следующими полями:\n"
-                        "- work_type (str): Тип работ\n"
-                        "- volume (float|null): Объем работ (в тоннах для шпунта, в метрах для бурения/вдавливания)\n"
-                        "- soil_type (str|null): Тип грунта\n"
-                        "- required_profile (str|null): Марка шпунта\n"
-                        "- depth (float|null): Глубина погружения в метрах\n"
-                        "- groundwater_level (float|null): УГВ в метрах\n"
-                        "- special_conditions (list[str]): Особые условия\n"
-                        "- complexity_coefficient (float): Оцени от 1.0 до 1.5 (1.5 — стесненность, здания рядом, болото)\n"
-                        "- estimated_shifts (int): Оцени кол-во смен (исходя из объема и типа работ)\n\n"
-                        "ВАЖНО: volume, depth, groundwater_level — ТОЛЬКО числа (float), "
-                        "без единиц измерения. Complexity_coefficient — float, estimated_shifts — int. "
-                        "Если данных нет — ставь null для числовых параметров или пустой список для условий."
-                    ),
-                },
-                {"role": "user", "content": f"Извлеки параметры ТЗ:\n\n{text[:15000]}"},
-            ],
-            response_format={"type": "json_object"},
+        """`text` is the document already packed into EXTRACT_DOC_TOKENS."""
+        messages = [
+            {
+                "role": "system",
+                "content": EXTRACTION_PROMPT,
+            },
+            {"role": "user", "content": f"Извлеки параметры ТЗ:\n\n{text}"},
+        ]
+
+        async def call(model: str) -> ParsedSpecSchema:
+            response = await self._complete(
+                "extract", model, messages,
+                temperature=AI_TEMPERATURE,
+                response_format={"type": "json_object"},
+            )
+            return ParsedSpecSchema(**json.loads(response.choices[0].message.content))
+
+        return await model_router.run("extract", call, check=lambda data: _check_extraction(data, text))
+
+    async def _map_reduce_extract(self, text: str) -> ParsedSpecSchema:
+        """
+        Extraction for documents larger than EXTRACT_DOC_TOKENS: page/paragraph
+        aligned chunks are read concurrently by the cheap model, the partial
+        results merged locally, and only conflicting fields go to the extract_resolve tier.
+        """
+        def plan() -> Tuple[List[str], List[int]]:
+            chunks = [chunk for chunk, _ in split_chunks(text, AI_MODEL_CHEAP, settings.EXTRACT_MAP_CHUNK_TOKENS)]
+            selected = list(range(len(chunks)))
+            if len(chunks) > settings.EXTRACT_MAP_MAX_CHUNKS:
+                selected = sorted(rank_chunks(chunks, EXTRACTION_QUERY)[:settings.EXTRACT_MAP_MAX_CHUNKS])
+            return chunks, selected
+
+        chunks, selected = await asyncio.to_thread(plan)
+        labels = _chunk_labels(chunks)
+
+        semaphore = asyncio.Semaphore(settings.EXTRACT_MAP_CONCURRENCY)
+
+        async def read(i: int) -> Optional[Tuple[str, Dict[str, Any]]]:
+            async with semaphore:
+                try:
+                    return labels[i], await self._extract_chunk(chunks[i])
+                except Exception as e:
+                    # One unreadable chunk should not sink the whole extraction
+                    logger.warning(f"Chunk extraction failed ({labels[i]}): {e}")
+                    return None
+
+        partials = [p for p in await asyncio.gather(*(read(i) for i in selected)) if p]
+        if not partials:
+            raise RuntimeError("Extraction failed for every document chunk")
+
+        merged, ambiguous = merge_partials(partials)
+        logger.info(
+            f"Map-reduce extraction: {len(partials)}/{len(chunks)} chunks, "
+            f"ambiguous fields: {sorted(ambiguous) or 'none'}"
         )
-        data = json.loads(response.choices[0].message.content)
-        return ParsedSpecSchema(**data)
+        if ambiguous:
+            merged.update(await self._resolve_ambiguous(merged, ambiguous))
+        return ParsedSpecSchema(**merged)
+
+    async def _extract_chunk(self, chunk: str) -> Dict[str, Any]:
+        messages = [
+            {"role": "system", "content": MAP_EXTRACTION_PROMPT},
+            {"role": "user", "content": f"ФРАГМЕНТ ДОКУМЕНТА:\n\n{chunk}"},
+        ]
+
+        async def call(model: str) -> Dict[str, Any]:
+            response = await self._complete(
+                "extract_map", model, messages,
+                temperature=0.0,
+                response_format={"type": "json_object"},
+            )
+            return json.loads(response.choices[0].message.content)
+
+        return await model_router.run("extract_map", call)
+
+    async def _resolve_ambiguous(
+        self, merged: Dict[str, Any], ambiguous: Dict[str, List[Candidate]]
+    ) -> Dict[str, Any]:
+        """Settle conflicting (or missing) fields with the strong model, given each reading and its quote."""
+        lines = []
+        for name, candidates in ambiguous.items():
+            lines.append(f"- {name}:")
+            if not candidates:
+                lines.append("    значение не найдено ни в одной части")
+            for c in candidates:
+                lines.append(f"    {c.value} ({', '.join(c.sources[:3])}): «{c.evidence}»")
+        messages = [
+            {"role": "system", "content": RESOLVE_PROMPT},
+            {
+                "role": "user",
+                "content": (
+                    f"УСТАНОВЛЕННЫЕ ПАРАМЕТРЫ:\n{json.dumps(merged, ensure_ascii=False)}\n\n"
+                    f"СПОРНЫЕ ПАРАМЕТРЫ:\n" + "\n".join(lines)
+                ),
+            },
+        ]
+
+        async def call(model: str) -> Dict[str, Any]:
+            response = await self._complete(
+                "extract_resolve", model, messages,
+                temperature=AI_TEMPERATURE,
+                response_format={"type": "json_object"},
+            )
+            return json.loads(response.choices[0].message.content)
+
+        data = await model_router.run("extract_resolve", call)
+
+        resolved = {name: data.get(name) for name in ambiguous}
+        for name in NUMERIC_FIELDS:
+            if name in resolved:
+                resolved[name] = to_number(resolved[name])
+        for name, candidates in ambiguous.items():
+            if resolved[name] in (None, "") and candidates:
+                # No decision from the model (null): the reading most chunks agree on
+                resolved[name] = max(candidates, key=lambda c: len(c.sources)).value
+        if "work_type" in resolved and not resolved["work_type"]:
+            # Found nowhere and not named by the model; ParsedSpecSchema needs a string
+            resolved["work_type"] = ""
+        if (complexity := to_number(data.get("complexity_coefficient"))) is not None:
+            resolved["complexity_coefficient"] = max(1.0, min(complexity, 1.5))
+        if (shifts := to_number(data.get("estimated_shifts"))) is not None:
+            resolved["estimated_shifts"] = max(int(shifts), 1)
+        return resolved
 
     # ═══════════════════════════════════════════════
     # Step 2: RAG — Build context from ALL standards
     # ═══════════════════════════════════════════════
 
-    def _build_rag_context(self, data: ParsedSpecSchema, text: str) -> str:
+    def _build_rag_context(self, data: ParsedSpecSchema, scan: ScanResult) -> str:
         """
-        Build comprehensive normative context by matching ALL relevant standards.
-        Uses keyword matching across key_points, rules, and risks.
+        Build normative context from the top-k BM25-ranked clauses of ALL standards.
+        Query: extracted parameters (boosted) + document terms known to the corpus.
         """
-        context_parts: List[str] = []
-        text_lower = text.lower()
-        data_str = f"{data.work_type or ''} {data.soil_type or ''} {data.required_profile or ''}".lower()
-
-        for code, standard in self.standards.items():
-            title = standard.get("title", "")
-            matched_items: List[str] = []
-
-            # Match risks by soil_type and text keywords
-            for risk_key, risk_desc in standard.get("risks", {}).items():
-                if any(kw in data_str or kw in text_lower for kw in risk_key.lower().split()):
-                    matched_items.append(f"  ⚠ РИСК ({risk_key}): {risk_desc}")
-
-            # Match rules by text content
-            for rule in standard.get("rules", []):
-                # Check if rule keywords appear in document
-                rule_words = [w for w in rule.lower().split() if len(w) > 4][:3]
-                if any(w in text_lower for w in rule_words):
-                    matched_items.append(f"  📏 ПРАВИЛО: {rule}")
-
-            # Match key_points to provide context
-            for point in standard.get("key_points", []):
-                point_words = [w for w in point.lower().split() if len(w) > 4][:3]
-                if any(w in data_str for w in point_words):
-                    matched_items.append(f"  📋 {point}")
-
-            if matched_items:
-                header = f"\n### {code} — {title}"
-                context_parts.append(header + "\n" + "\n".join(matched_items[:6]))
+        hits = self.standards_index.search(self._rag_query(data, scan), settings.RAG_TOP_K)
+        logger.debug("RAG hits: %s", [(c.code, c.kind, score) for c, score in hits])
+
+        grouped: Dict[str, List[str]] = {}
+        titles: Dict[str, str] = {}
+        for clause, _score in hits:
+            titles[clause.code] = clause.title
+            if clause.kind == "risk":
+                item = f"  ⚠ РИСК ({clause.label}): {clause.text}"
+            elif clause.kind == "rule":
+                item = f"  📏 ПРАВИЛО: {clause.text}"
+            else:
+                item = f"  📋 {clause.text}"
+            grouped.setdefault(clause.code, []).append(item)
+
+        context_parts = [
+            f"\n### {code} — {titles[code]}\n" + "\n".join(items)
+            for code, items in grouped.items()
+        ]
 
         if not context_parts:
             # Fallback: include all risk sections as general context
@@ -180,6 +583,20 @@ class GeotechAnalyzer:
 
         return "\n".join(context_parts) if context_parts else "Нормативный контекст не найден."
 
+    def _rag_query(self, data: ParsedSpecSchema, scan: ScanResult) -> Dict[str, float]:
+        # Document terms: sublinear tf of the corpus stems found by the scan
+        query: Dict[str, float] = {
+            term: 1.0 + math.log(tf) for term, tf in scan.counts("standards").items()
+        }
+        # Extracted parameters weigh more than incidental document wording
+        data_str = " ".join([
+            data.work_type or "", data.soil_type or "", data.required_profile or "",
+            *data.special_conditions,
+        ])
+        for term in tokenize(data_str):
+            query[term] = query.get(term, 0.0) + RAG_PARAMETER_BOOST
+        return query
+
     # ═══════════════════════════════════════════════
     # Step 3: Risk Assessment with full RAG context
     # ═══════════════════════════════════════════════
@@ -187,40 +604,36 @@ class GeotechAnalyzer:
     async def _assess_engineering_risks(
         self, data: ParsedSpecSchema, text: str, rag_context: str
     ) -> List[Dict[str, str]]:
-        response = await self.client.chat.completions.create(
-            model=AI_MODEL,
-            temperature=AI_TEMPERATURE,
-            messages=[
-                {
-                    "role": "system",
-                    "content": (
-                        "Ты — эксперт по геотехническим рискам. Проанализируй инженерные "
-                        "риски объекта, используя приведённые нормативные документы.\n\n"
-                        "Учитывай:\n"
-                        "- Тип грунта и его особенности\n"
-                        "- Глубину котлована / погружения\n"
-                        "- Уровень грунтовых вод\n"
-                        "- Близость к существующей застройке\n"
-                        "- Метод производства работ (вибро, вдавливание, забивка)\n"
-                        "- Нормативные требования из приведённых ГОСТ и СП\n\n"
-                        "Верни JSON: {\"risks\": [{\"risk\": str, \"impact\": str}, ...]}\n"
-                        "Каждый risk — конкретная инженерная угроза.\n"
-                        "Каждый impact — уровень (Критический/Высокий/Средний) + последствия."
-                    ),
-                },
-                {
-                    "role": "user",
-                    "content": (
-                        f"ПАРАМЕТРЫ ОБЪЕКТА:\n{data.model_dump_json()}\n\n"
-                        f"НОРМАТИВНЫЙ КОНТЕКСТ:\n{rag_context}\n\n"
-                        f"ИСХОДНЫЙ ДОКУМЕНТ (начало):\n{text[:5000]}"
-                    ),
-                },
-            ],
-            response_format={"type": "json_object"},
-        )
-        result = json.loads(response.choices[0].message.content)
-        return result.get("risks", [])
+        # Document passages about the extracted parameters, not just its first pages
+        query = " ".join([
+            data.work_type or "", data.soil_type or "", data.required_profile or "",
+            *data.special_conditions,
+        ])
+        excerpt = await asyncio.to_thread(pack_chunks, text, query, settings.RISKS_DOC_TOKENS, AI_MODEL)
+        messages = [
+            {
+                "role": "system",
+                "content": RISKS_PROMPT,
+            },
+            {
+                "role": "user",
+                "content": (
+                    f"ПАРАМЕТРЫ ОБЪЕКТА:\n{data.model_dump_json()}\n\n"
+                    f"НОРМАТИВНЫЙ КОНТЕКСТ:\n{rag_context}\n\n"
+                    f"ИСХОДНЫЙ ДОКУМЕНТ (фрагменты):\n{excerpt}"
+                ),
+            },
+        ]
+
+        async def call(model: str) -> List[Dict[str, str]]:
+            response = await self._complete(
+                "risks", model, messages,
+                temperature=AI_TEMPERATURE,
+                response_format={"type": "json_object"},
+            )
+            return json.loads(response.choices[0].message.content).get("risks", [])
+
+        return await model_router.run("risks", call, check=_check_risks)
 
     # ═══════════════════════════════════════════════
     # Step 4: Expert Summary
@@ -232,46 +645,67 @@ class GeotechAnalyzer:
         risks: List[Any],
         sections: Dict[str, str],
         rag_context: str,
+        on_token: Optional[Callable[[str], Awaitable[None]]] = None,
     ) -> str:
-        response = await self.client.chat.completions.create(
-            model=AI_MODEL,
-            temperature=0.35,  # Slightly higher for natural language summary
-            messages=[
-                {
-                    "role": "system",
-                    "content": (
-                        "Ты — главный инженер-геотехник, составляющий экспертное заключение "
-                        "для B2B клиента. Стиль: строгий, профессиональный, инженерный.\n\n"
-                        "Структура заключения (Markdown):\n"
-                        "## Анализ объекта\n"
-                        "Краткое описание задачи, тип работ, ключевые параметры.\n\n"
-                        "## Оценка сложности\n"
-                        "Геология, гидрогеология, стесненность, специфические условия.\n\n"
-                        "## Рекомендации\n"
-                        "Метод работ, оборудование, технологические решения.\n\n"
-                        "## Критические риски\n"
-                        "Основные угрозы, ссылки на нормативы.\n\n"
-                        "Используй ссылки на конкретные ГОСТ и СП из контекста."
-                    ),
-                },
-                {
-                    "role": "user",
-                    "content": (
-                        f"Параметры: {data}\n"
-                        f"Риски: {risks}\n"
-                        f"Нормативный контекст:\n{rag_context}\n"
-                        f"Геология (контекст): {sections.get('geology', 'Нет данных')}"
-                    ),
-                },
-            ],
-        )
-        return response.choices[0].message.content
+        """
+        Markdown expert summary. Streams tokens to `on_token` when given
+        (streamed summaries are not escalated, see model_router).
+        """
+        geology = sections.get("geology")
+        geology = truncate_tokens(geology, settings.SUMMARY_GEOLOGY_TOKENS, AI_MODEL) if geology else "Нет данных"
+        messages = [
+            {
+                "role": "system",
+                "content": SUMMARY_PROMPT,
+            },
+            {
+                "role": "user",
+                "content": (
+                    f"Параметры: {data}\n"
+                    f"Риски: {risks}\n"
+                    f"Нормативный контекст:\n{rag_context}\n"
+                    f"Геология (контекст): {geology}"
+                ),
+            },
+        ]
+        if on_token is None:
+            async def call(model: str) -> str:
+                response = await self._complete(
+                    "summary", model, messages,
+                    temperature=0.35,  # Slightly higher for natural language summary
+                )
+                return response.choices[0].message.content
+
+            return await model_router.run("summary", call, check=_check_summary)
+
+        async def stream(model: str) -> str:
+            prompt_meter.record("summary", messages, model)
+            parts: List[str] = []
+            async with aclosing(llm_gateway.stream(
+                "summary",
+                model=model,
+                temperature=0.35,
+                messages=messages,
+                stream_options={"include_usage": True},
+            )) as chunks:
+                async for chunk in chunks:
+                    if chunk.usage:
+                        model_router.record_usage("summary", model, chunk.usage)
+                    if not chunk.choices:
+                        continue
+                    token = chunk.choices[0].delta.content
+                    if token:
+                        parts.append(token)
+                        await on_token(token)
+            return "".join(parts)
+
+        return await model_router.run("summary", stream, streamed=True)
 
     # ═══════════════════════════════════════════════
     # Step 5: Smart Confidence Score
     # ═══════════════════════════════════════════════
 
-    def _compute_confidence(self, data: ParsedSpecSchema, text: str) -> float:
+    def _compute_confidence(self, data: ParsedSpecSchema, text: str, scan: ScanResult) -> float:
         """
         Compute confidence as weighted sum based on field completeness
         and document quality signals.
@@ -304,8 +738,7 @@ class GeotechAnalyzer:
             score += 0.04
 
         # Keyword density — more geotech terms = more relevant document
-        text_lower = text.lower()
-        keyword_hits = sum(1 for kw in self.geotech_keywords if kw in text_lower)
+        keyword_hits = scan.distinct("geotech")
         if keyword_hits >= 5:
             score += 0.03
         if keyword_hits >= 10:
@@ -317,37 +750,34 @@ class GeotechAnalyzer:
     # Pre-validation
     # ═══════════════════════════════════════════════
 
-    async def _pre_validate_document(self, text: str) -> Tuple[bool, str]:
-        """Two-phase validation: heuristic keywords + cheap AI check."""
-        text_lower = text.lower()
-        keyword_hits = sum(1 for kw in self.geotech_keywords if kw in text_lower)
-
-        if keyword_hits >= 3:
+    async def _pre_validate_document(self, text: str, scan: ScanResult) -> Tuple[bool, str]:
+        """
+        Two-phase validation: heuristic keywords + cheap AI check.
+        Raises when the AI check fails; the caller falls back to keywords.
+        """
+        if scan.distinct("geotech") >= 3:
             return True, "Heuristic match"
 
         # Cheap AI validation
-        try:
-            response = await self.client.chat.completions.create(
-                model=AI_MODEL_CHEAP,
+        head = truncate_tokens(text, settings.VALIDATE_DOC_TOKENS, AI_MODEL_CHEAP)
+        messages = [
+            {
+                "role": "system",
+                "content": VALIDATION_PROMPT,
+            },
+            {"role": "user", "content": f"Текст документа (начало):\n{head}"},
+        ]
+
+        async def call(model: str) -> Dict[str, Any]:
+            response = await self._complete(
+                "validate", model, messages,
                 temperature=0.0,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": (
-                            "Определи, является ли текст техническим заданием, "
-                            "спецификацией или отчетом в области ГЕОТЕХНИКИ, "
-                            "СТРОИТЕЛЬСТВА ФУНДАМЕНТОВ или ШПУНТОВЫХ ОГРАЖДЕНИЙ.\n"
-                            "Ответь JSON: {\"is_geotech\": bool, \"reason\": str}"
-                        ),
-                    },
-                    {"role": "user", "content": f"Текст документа (начало):\n{text[:2000]}"},
-                ],
                 response_format={"type": "json_object"},
             )
-            result = json.loads(response.choices[0].message.content)
-            return result.get("is_geotech", False), result.get("reason", "No reason provided")
-        except Exception:
-            return keyword_hits >= 1, "Fallback heuristic"
+            return json.loads(response.choices[0].message.content)
+
+        result = await model_router.run("validate", call)
+        return result.get("is_geotech", False), result.get("reason", "No reason provided")
 
     # ═══════════════════════════════════════════════
     # Clarifying Questions
@@ -356,36 +786,30 @@ class GeotechAnalyzer:
     async def _generate_clarifying_questions(
         self, data: ParsedSpecSchema, risks: List[Dict[str, str]]
     ) -> List[str]:
-        """Generate 3 specific questions if data is missing or vague."""
-        try:
-            response = await self.client.chat.completions.create(
-                model=AI_MODEL,
+        """Generate 3 specific questions if data is missing or vague. Raises when the LLM call fails."""
+        messages = [
+            {
+                "role": "system",
+                "content": QUESTIONS_PROMPT,
+            },
+            {
+                "role": "user",
+                "content": (
+                    f"ТЕКУЩИЕ ДАННЫЕ:\n{data.model_dump_json()}\n"
+                    f"РИСКИ: {json.dumps(risks, ensure_ascii=False)}"
+                ),
+            },
+        ]
+
+        async def call(model: str) -> List[str]:
+            response = await self._complete(
+                "questions", model, messages,
                 temperature=0.3,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": (
-                            "Ты — опытный главный инженер. Твоя задача — задать 3 коротких, "
-                            "профессиональных вопроса заказчику, чтобы уточнить ТЗ.\n"
-                            "Спрашивай только о том, чего не хватает для точного расчета (грунт, глубина, нагрузки).\n"
-                            "Верни JSON: {\"questions\": [\"Вопрос 1?\", \"Вопрос 2?\", \"Вопрос 3?\"]}"
-                        ),
-                    },
-                    {
-                        "role": "user",
-                        "content": (
-                            f"ТЕКУЩИЕ ДАННЫЕ:\n{data.model_dump_json()}\n"
-                            f"РИСКИ: {json.dumps(risks, ensure_ascii=False)}"
-                        ),
-                    },
-                ],
                 response_format={"type": "json_object"},
             )
-            result = json.loads(response.choices[0].message.content)
-            return result.get("questions", [])[:3]
-        except Exception as e:
-            logger.warning(f"Failed to generate questions: {e}")
-            return []
+            return json.loads(response.choices[0].message.content).get("questions", [])[:3]
+
+        return await model_router.run("questions", call, check=_check_questions)
 
 
 # Singleton
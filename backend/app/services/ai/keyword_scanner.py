@@ -0,0 +1,83 @@
+"""
+Single-pass keyword scanning (Aho–Corasick) shared by the audit pipeline.
+
+Pre-validation, the confidence score, section detection and RAG used to test
+each keyword with `kw in text.lower()` — one full pass over the document per
+keyword. The automaton finds every keyword of every family in one pass and
+records where each one occurs.
+"""
+from collections import defaultdict
+from typing import Dict, Iterable, List, Set, Tuple
+import ahocorasick
+
+# Keywords for section identification
+SECTION_KEYWORDS = {
+    "geology": ["инженерно-геологические", "грунты", "разрез", "геология"],
+    "construction": ["конструктивные решения", "ограждение", "шпунт", "сваи"],
+    "hydrology": ["гидрогеологические", "угв", "уровень вод", "подземные воды"],
+    "project_info": ["заказчик", "объект", "адрес", "местоположение"]
+}
+
+# Heuristic keywords for quick validation and the confidence score
+GEOTECH_KEYWORDS = [
+    "шпунт", "сваи", "свая", "грунт", "геология", "котлован", "фундамент",
+    "бурение", "вдавливание", "статическое", "динамическое",
+    "уровень вод", "скважина", "разрез", "профиль", "основание",
+    "несущая способность", "осадка", "деформация", "испытание",
+]
+
+
+class ScanResult:
+    """Start offsets of every keyword found, grouped by family."""
+
+    def __init__(self, hits: Dict[str, Dict[str, List[int]]]):
+        self.hits = hits
+
+    def offsets(self, family: str, keyword: str) -> List[int]:
+        return self.hits.get(family, {}).get(keyword, [])
+
+    def counts(self, family: str) -> Dict[str, int]:
+        return {kw: len(offsets) for kw, offsets in self.hits.get(family, {}).items()}
+
+    def distinct(self, family: str) -> int:
+        """Number of different keywords of the family present in the text."""
+        return len(self.hits.get(family, {}))
+
+    def families(self) -> Set[str]:
+        return {family for family, keywords in self.hits.items() if keywords}
+
+
+class KeywordScanner:
+    """
+    Matches are case-insensitive and must start at a word boundary, so a
+    keyword also matches inflected forms ("шпунт" in "шпунтового").
+    """
+
+    def __init__(self, families: Dict[str, Iterable[str]]):
+        owners: Dict[str, List[Tuple[str, str]]] = defaultdict(list)
+        for family, keywords in families.items():
+            for kw in keywords:
+                owners[kw.lower()].append((family, kw))
+
+        self._automaton = ahocorasick.Automaton()
+        for kw, kw_owners in owners.items():
+            self._automaton.add_word(kw, (len(kw), tuple(kw_owners)))
+        self._empty = not owners
+        if not self._empty:
+            self._automaton.make_automaton()
+
+    def scan(self, text: str) -> ScanResult:
+        hits: Dict[str, Dict[str, List[int]]] = defaultdict(lambda: defaultdict(list))
+        if self._empty:
+            return ScanResult({})
+        text_lower = text.lower()
+        for end, (length, kw_owners) in self._automaton.iter(text_lower):
+            start = end - length + 1
+            if start and text_lower[start - 1].isalnum():
+                continue
+            for family, kw in kw_owners:
+                hits[family][kw].append(start)
+        return ScanResult({family: dict(keywords) for family, keywords in hits.items()})
+
+
+section_scanner = KeywordScanner(SECTION_KEYWORDS)
@@ -0,0 +1,145 @@
+"""
+Model-tier routing for analyzer LLM calls.
+
+Every call site (route) has a policy: the models to try, cheapest first.
+A route's call is made on the first tier and its result checked by the
+caller's `check`; a failed call or a rejected result escalates to the next
+tier, the last tier's answer is always accepted. Streamed calls cannot be
+taken back once tokens are out, so they go straight to the last tier.
+
+Defaults are in ROUTE_POLICIES and can be overridden per route with
+AI_MODEL_ROUTES (e.g. {"summary": ["gpt-4o"]}). Latency, token usage, cost
+and escalations are counted per route and model for /metrics.
+"""
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, TypeVar
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# USD per 1M tokens (input, output), list prices
+MODEL_PRICES = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+}
+
+ROUTE_POLICIES: Dict[str, Tuple[str, ...]] = {
+    "validate": ("gpt-4o-mini",),
+    "extract": ("gpt-4o-mini", "gpt-4o"),
+    "extract_map": ("gpt-4o-mini",),
+    "extract_resolve": ("gpt-4o",),
+    "risks": ("gpt-4o-mini", "gpt-4o"),
+    "summary": ("gpt-4o-mini", "gpt-4o"),
+    "questions": ("gpt-4o-mini", "gpt-4o"),
+}
+
+LATENCY_WINDOW = 200  # recent calls kept per route and model for percentiles
+
+
+class _ModelStats:
+
+    def __init__(self):
+        self.calls = 0
+        self.failures = 0
+        self.rejected = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost_usd = 0.0
+        self.latencies: deque = deque(maxlen=LATENCY_WINDOW)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+    def as_dict(self) -> dict:
+        p50, p95 = self.percentile(0.5), self.percentile(0.95)
+        return {
+            "calls": self.calls,
+            "failures": self.failures,
+            "rejected": self.rejected,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cost_usd": round(self.cost_usd, 4),
+            "p50_ms": round(p50 * 1000) if p50 is not None else None,
+            "p95_ms": round(p95 * 1000) if p95 is not None else None,
+        }
+
+
+class ModelRouter:
+
+    def __init__(self, policies: Dict[str, Tuple[str, ...]]):
+        self.policies = {**policies, **{route: tuple(models) for route, models in settings.AI_MODEL_ROUTES.items()}}
+        self._stats: Dict[Tuple[str, str], _ModelStats] = {}
+        self.served: Dict[str, Dict[str, int]] = {}
+
+    def tiers(self, route: str) -> Tuple[str, ...]:
+        return self.policies[route]
+
+    def _model_stats(self, route: str, model: str) -> _ModelStats:
+        return self._stats.setdefault((route, model), _ModelStats())
+
+    async def run(
+        self,
+        route: str,
+        call: Callable[[str], Awaitable[T]],
+        check: Optional[Callable[[T], Optional[str]]] = None,
+        streamed: bool = False,
+    ) -> T:
+        """
+        Run `call(model)` on the route's tiers until one is accepted.
+        `check(result)` returns None to accept, or the reason to escalate.
+        """
+        tiers = self.tiers(route)
+        if streamed:
+            tiers = tiers[-1:]
+        for i, model in enumerate(tiers):
+            last = i == len(tiers) - 1
+            stats = self._model_stats(route, model)
+            stats.calls += 1
+            started = time.perf_counter()
+            try:
+                result = await call(model)
+            except Exception as e:
+                stats.failures += 1
+                if last:
+                    raise
+                logger.warning(f"{route} on {model} failed, escalating to {tiers[i + 1]}: {e}")
+                continue
+            finally:
+                stats.latencies.append(time.perf_counter() - started)
+
+            reason = None if last or check is None else check(result)
+            if reason is None:
+                served = self.served.setdefault(route, {})
+                served[model] = served.get(model, 0) + 1
+                return result
+            stats.rejected += 1
+            logger.info(f"{route} answer of {model} rejected ({reason}), escalating to {tiers[i + 1]}")
+        raise RuntimeError(f"No model tiers configured for {route}")
+
+    def record_usage(self, route: str, model: str, usage: Any):
+        """Token usage of a completion (response.usage; None when the proxy omits it)."""
+        if usage is None:
+            return
+        stats = self._model_stats(route, model)
+        prompt, completion = usage.prompt_tokens or 0, usage.completion_tokens or 0
+        stats.prompt_tokens += prompt
+        stats.completion_tokens += completion
+        price_in, price_out = MODEL_PRICES.get(model, (0.0, 0.0))
+        stats.cost_usd += (prompt * price_in + completion * price_out) / 1_000_000
+
+    def stats(self) -> dict:
+        routes: Dict[str, Any] = {}
+        for (route, model), stats in self._stats.items():
+            entry = routes.setdefault(route, {"served": self.served.get(route, {}), "models": {}})
+            entry["models"][model] = stats.as_dict()
+        return routes
+
+
+model_router = ModelRouter(ROUTE_POLICIES)
@@ -0,0 +1,149 @@
+"""
+Near-duplicate audit index (MinHash + LSH over word shingles, stored in Redis).
+
+A client re-exporting the same specification with a new timestamp or a few
+edited lines gets a different file hash, so the exact-match caches miss. This
+index recognises such documents by the Jaccard similarity of their normalised
+text and lets the pipeline reuse the earlier extraction and risks.
+"""
+import asyncio
+import json
+import logging
+import re
+import time
+import zlib
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+import numpy as np
+from app.core.config import settings
+from app.core.redis import get_redis
+
+logger = logging.getLogger(__name__)
+
+NUM_PERM = 128
+BANDS = 32  # 32 bands × 4 rows: candidate pairs from roughly Jaccard 0.4 upwards
+ROWS = NUM_PERM // BANDS
+SHINGLE_SIZE = 5  # words
+MIN_SHINGLES = 20  # shorter texts are too small to compare reliably
+
+SIGNATURE_BLOCK = 4096  # shingles permuted per step; bounds memory to NUM_PERM × block
+
+# Largest prime below 2^32: with a, b, x < p every a·x + b fits in uint64, so
+# (a·x + b) mod p is exact and the permutations stay a universal hash family
+_PRIME = np.uint64((1 << 32) - 5)
+# Fixed seed: signatures are persisted and must stay comparable across processes
+_rng = np.random.RandomState(20260101)
+_PERM_A = _rng.randint(1, int(_PRIME), size=NUM_PERM, dtype=np.uint64)
+_PERM_B = _rng.randint(0, int(_PRIME), size=NUM_PERM, dtype=np.uint64)
+
+_PAGE_MARKER_RE = re.compile(r"--- (page|sheet):? [^\n]*---")
+_VOLATILE_RE = re.compile(
+    r"\d{1,2}[./-]\d{1,2}[./-]\d{2,4}"  # dates
+    r"|\d{1,2}:\d{2}(:\d{2})?"          # times
+)
+_WORD_RE = re.compile(r"\w+")
+
+
+def normalize_text(text: str) -> list:
+    """Lower-case word tokens without page markers, dates and times."""
+    text = _PAGE_MARKER_RE.sub(" ", text.lower())
+    text = _VOLATILE_RE.sub(" ", text)
+    return _WORD_RE.findall(text)
+
+
+def minhash_signature(text: str) -> Optional[np.ndarray]:
+    words = normalize_text(text)
+    if len(words) < SHINGLE_SIZE + MIN_SHINGLES:
+        return None
+    shingles = {
+        zlib.crc32(" ".join(words[i:i + SHINGLE_SIZE]).encode("utf-8"))
+        for i in range(len(words) - SHINGLE_SIZE + 1)
+    }
+    hashes = np.fromiter(shingles, dtype=np.uint64, count=len(shingles)) % _PRIME
+    signature = np.full(NUM_PERM, _PRIME, dtype=np.uint64)
+    # (a·x + b) mod p for every permutation, one block of shingles at a time
+    for start in range(0, len(hashes), SIGNATURE_BLOCK):
+        block = hashes[start:start + SIGNATURE_BLOCK]
+        permuted = (np.outer(_PERM_A, block) + _PERM_B[:, None]) % _PRIME
+        np.minimum(signature, permuted.min(axis=1), out=signature)
+    return signature.astype(np.uint32)
+
+
+def _band_keys(signature: np.ndarray) -> list:
+    return [
+        f"near_dup:band:{band}:{zlib.crc32(signature[band * ROWS:(band + 1) * ROWS].tobytes()):08x}"
+        for band in range(BANDS)
+    ]
+
+
+@dataclass
+class NearDuplicate:
+    audit_id: str
+    similarity: float
+    payload: Dict[str, Any]
+
+
+class NearDuplicateIndex:
+
+    async def find(self, text: str, exclude_id: Optional[str] = None) -> Optional[NearDuplicate]:
+        """Best earlier audit with estimated Jaccard ≥ NEAR_DUP_THRESHOLD, if any."""
+        try:
+            signature = await asyncio.to_thread(minhash_signature, text)
+            if signature is None:
+                return None
+            redis = get_redis()
+            async with redis.pipeline(transaction=False) as pipe:
+                for key in _band_keys(signature):
+                    pipe.smembers(key)
+                bands = await pipe.execute()
+            candidates = set().union(*bands) - {exclude_id}
+            if not candidates:
+                return None
+
+            candidates = list(candidates)
+            async with redis.pipeline(transaction=False) as pipe:
+                for audit_id in candidates:
+                    pipe.get(f"near_dup:sig:{audit_id}")
+                stored = await pipe.execute()
+
+            best_id, best_sim = None, 0.0
+            for audit_id, sig_hex in zip(candidates, stored):
+                if not sig_hex:
+                    continue
+                other = np.frombuffer(bytes.fromhex(sig_hex), dtype=np.uint32)
+                similarity = float(np.mean(other == signature))
+                if similarity > best_sim:
+                    best_id, best_sim = audit_id, similarity
+            if best_id is None or best_sim < settings.NEAR_DUP_THRESHOLD:
+                return None
+
+            payload = await redis.get(f"near_dup:payload:{best_id}")
+            if not payload:
+                return None
+            logger.info(f"Near-duplicate of audit {best_id} (Jaccard≈{best_sim:.2f})")
+            return NearDuplicate(best_id, round(best_sim, 3), json.loads(payload))
+        except Exception as e:
+            logger.warning(f"Near-duplicate lookup failed: {e}")
+            return None
+
+    async def add(self, audit_id: str, text: str, payload: Dict[str, Any]):
+        """Index a finished audit; payload holds what later matches may reuse."""
+        try:
+            signature = await asyncio.to_thread(minhash_signature, text)
+            if signature is None:
+                return
+            ttl = settings.NEAR_DUP_TTL
+            payload = {**payload, "indexed_at": time.time()}
+            async with get_redis().pipeline(transaction=False) as pipe:
+                pipe.setex(f"near_dup:sig:{audit_id}", ttl, signature.tobytes().hex())
+                pipe.setex(f"near_dup:payload:{audit_id}", ttl, json.dumps(payload, ensure_ascii=False, default=str))
+                for key in _band_keys(signature):
+                    pipe.sadd(key, audit_id)
+                    pipe.expire(key, ttl)
+                await pipe.execute()
+        except Exception as e:
+            logger.warning(f"Near-duplicate indexing failed for {audit_id}: {e}")
+
+
+# Singleton
+near_duplicate_index = NearDuplicateIndex()
@@ -0,0 +1,129 @@
+"""
+Merge of partial technical parameter extractions, one per document chunk.
+
+Agreeing values are merged locally:
+- numbers within NUMERIC_TOLERANCE of each other are one value (the most
+  frequent reading wins); only a missing value (None) means "not found",
+  a zero (water at the surface) is a reading;
+- sheet pile marks are compared in catalogue profile_key form ("Л5-УМ" = "L5UM");
+- soil descriptions from different boreholes / layers are combined;
+- special conditions are united, complexity is the highest estimate.
+Fields whose chunks disagree (two depths, two profiles, two work types) or that
+no chunk found (work_type) are returned as ambiguous, with one candidate per
+distinct reading, for the caller to resolve.
+"""
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from app.services.ai.standards_index import tokenize
+from app.services.catalogue import profile_key
+
+NUMERIC_FIELDS = ("volume", "depth", "groundwater_level")
+NUMERIC_TOLERANCE = 0.05
+MAX_SOILS = 4
+MAX_CONDITIONS = 10
+
+_NUMBER_RE = re.compile(r"-?\d+(?:[.,]\d+)?")
+
+
+@dataclass
+class Candidate:
+    value: Any
+    evidence: str = ""
+    sources: List[str] = field(default_factory=list)
+
+
+def to_number(value: Any) -> Optional[float]:
+    """Float from a model value ("12,5 м" → 12.5); None when there is no number."""
+    if isinstance(value, bool) or value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = _NUMBER_RE.search(str(value))
+    return float(match.group().replace(",", ".")) if match else None
+
+
+def _same_number(a: float, b: float) -> bool:
+    return abs(a - b) <= NUMERIC_TOLERANCE * max(abs(a), abs(b))
+
+
+def _same_terms(a: str, b: str) -> bool:
+    ta, tb = set(tokenize(a)), set(tokenize(b))
+    return bool(ta and tb) and (ta <= tb or tb <= ta)
+
+
+def _cluster(
+    readings: List[Tuple[Any, str, str]], same: Callable[[Any, Any], bool]
+) -> List[Tuple[Candidate, Counter]]:
+    """Group (value, evidence, source) readings that denote the same value."""
+    clusters: List[Tuple[Candidate, Counter]] = []
+    for value, evidence, source in readings:
+        for candidate, counts in clusters:
+            if same(candidate.value, value):
+                counts[value] += 1
+                candidate.sources.append(source)
+                break
+        else:
+            clusters.append((Candidate(value, evidence, [source]), Counter({value: 1})))
+    for candidate, counts in clusters:
+        # Most frequent reading (the longest among equals) represents the cluster
+        candidate.value = max(counts, key=lambda v: (counts[v], len(str(v))))
+    return clusters
+
+
+def merge_partials(
+    partials: List[Tuple[str, Dict[str, Any]]]
+) -> Tuple[Dict[str, Any], Dict[str, List[Candidate]]]:
+    """
+    Merge (source label, partial extraction) pairs.
+    Returns the merged fields and the ambiguous ones {field: candidates}.
+    """
+    def readings(name: str, convert: Callable[[Any], Any]) -> List[Tuple[Any, str, str]]:
+        result = []
+        for source, data in partials:
+            value = convert(data.get(name))
+            if value not in (None, ""):
+                quotes = data.get("evidence")
+                evidence = str(quotes.get(name) or "")[:200] if isinstance(quotes, dict) else ""
+                result.append((value, evidence, source))
+        return result
+
+    def text(value: Any) -> Optional[str]:
+        return " ".join(str(value).split()) if value else None
+
+    merged: Dict[str, Any] = {}
+    ambiguous: Dict[str, List[Candidate]] = {}
+
+    def settle(name: str, clusters: List[Tuple[Candidate, Counter]], required: bool = False):
+        if len(clusters) == 1:
+            merged[name] = clusters[0][0].value
+        elif clusters or required:
+            ambiguous[name] = [candidate for candidate, _ in clusters]
+
+    settle("work_type", _cluster(readings("work_type", text), _same_terms), required=True)
+    for name in NUMERIC_FIELDS:
+        settle(name, _cluster(readings(name, to_number), _same_number))
+    settle(
+        "required_profile",
+        _cluster(readings("required_profile", text), lambda a, b: profile_key(a) == profile_key(b)),
+    )
+
+    soils = _cluster(readings("soil_type", text), _same_terms)
+    if soils:
+        merged["soil_type"] = "; ".join(candidate.value for candidate, _ in soils[:MAX_SOILS])
+
+    conditions: Dict[str, str] = {}
+    for _, data in partials:
+        found = data.get("special_conditions") or []
+        for condition in [found] if isinstance(found, str) else found:
+            condition = text(condition)
+            if condition:
+                conditions.setdefault(condition.lower(), condition)
+    merged["special_conditions"] = list(conditions.values())[:MAX_CONDITIONS]
+
+    complexity = [c for _, data in partials if (c := to_number(data.get("complexity_coefficient")))]
+    merged["complexity_coefficient"] = max(1.0, min(max(complexity, default=1.0), 1.5))
+    shifts = [int(s) for _, data in partials if (s := to_number(data.get("estimated_shifts")))]
+    merged["estimated_shifts"] = max(max(shifts, default=1), 1)
+    return merged, ambiguous
@@ -0,0 +1,84 @@
+"""
+Content-addressed Redis cache for individual audit stages.
+
+An entry is keyed by the stage name, the stage version (hash of its prompt,
+model and sampling settings) and a hash of the exact inputs the stage sees.
+Re-running a known document therefore skips every LLM call whose inputs and
+prompt are unchanged, while editing one prompt only invalidates that stage.
+Cache errors never fail an audit — the stage is simply computed.
+"""
+import hashlib
+import json
+import logging
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Dict, Optional
+from app.core.config import settings
+from app.core.redis import get_redis
+
+logger = logging.getLogger(__name__)
+
+
+def fingerprint(*parts: Any) -> str:
+    """Stable short hash of JSON-serialisable parts (pydantic models via default=str)."""
+    raw = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:24]
+
+
+class StageCache:
+
+    def __init__(self):
+        self.hits: Dict[str, int] = defaultdict(int)
+        self.misses: Dict[str, int] = defaultdict(int)
+
+    def _key(self, stage: str, version: str, inputs: Any) -> str:
+        return f"stage_cache:{stage}:{version}:{fingerprint(inputs)}"
+
+    async def get_or_compute(
+        self,
+        stage: str,
+        version: str,
+        inputs: Any,
+        compute: Callable[[], Awaitable[Any]],
+        dump: Callable[[Any], Any] = lambda v: v,
+        load: Callable[[Any], Any] = lambda v: v,
+    ) -> Any:
+        """
+        Return the cached value for (stage, version, inputs) or compute and store it.
+        `dump`/`load` convert between the stage result and its JSON form.
+        A failing `compute` stores nothing: stages apply degraded fallbacks
+        outside this call, so they are never cached.
+        """
+        key = self._key(stage, version, inputs)
+        cached = await self._get(key)
+        if cached is not None:
+            self.hits[stage] += 1
+            return load(cached)
+
+        self.misses[stage] += 1
+        value = await compute()
+        await self._set(key, dump(value))
+        return value
+
+    async def _get(self, key: str) -> Optional[Any]:
+        try:
+            raw = await get_redis().get(key)
+            return json.loads(raw) if raw is not None else None
+        except Exception as e:
+            logger.warning(f"Stage cache read failed for {key}: {e}")
+            return None
+
+    async def _set(self, key: str, value: Any):
+        try:
+            await get_redis().setex(
+                key, settings.STAGE_CACHE_TTL, json.dumps(value, ensure_ascii=False, default=str)
+            )
+        except Exception as e:
+            logger.warning(f"Stage cache write failed for {key}: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        stages = sorted(set(self.hits) | set(self.misses))
+        return {stage: {"hits": self.hits[stage], "misses": self.misses[stage]} for stage in stages}
+
+
+# Singleton
+stage_cache = StageCache()
@@ -0,0 +1,87 @@
+"""
+Dependency-aware async stage scheduler for the audit pipeline.
+
+Each stage declares the stages it depends on and starts as soon as all of them
+have finished, so independent LLM calls overlap instead of running serially.
+A failing stage cancels everything still in flight.
+"""
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+StageFn = Callable[[Dict[str, Any]], Awaitable[Any]]
+CompletionCallback = Callable[[str, Any], Awaitable[None]]
+
+
+@dataclass
+class Stage:
+    name: str
+    fn: StageFn
+    depends_on: Sequence[str] = field(default_factory=tuple)
+
+
+class StageScheduler:
+    """
+    Runs a DAG of async stages.
+
+    A stage receives the dict of results produced so far (at least all of its
+    dependencies) and returns its own result. Results and per-stage timings
+    (seconds, wall clock) are available after `run()`. The optional
+    `on_complete(name, result)` hook is awaited as each stage finishes.
+    """
+
+    def __init__(self, stages: List[Stage], on_complete: Optional[CompletionCallback] = None):
+        names = {s.name for s in stages}
+        if len(names) != len(stages):
+            raise ValueError("Duplicate stage names")
+        for s in stages:
+            missing = set(s.depends_on) - names
+            if missing:
+                raise ValueError(f"Stage '{s.name}' depends on unknown stages: {missing}")
+        self.stages = stages
+        self.on_complete = on_complete
+        self.results: Dict[str, Any] = {}
+        self.timings: Dict[str, float] = {}
+
+    async def run(self, initial: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        self.results = dict(initial or {})
+        self.timings = {}
+        pending = [s for s in self.stages if s.name not in self.results]
+        running: Dict[asyncio.Task, Stage] = {}
+        started_at: Dict[str, float] = {}
+
+        def _launch_ready():
+            for stage in list(pending):
+                if all(dep in self.results for dep in stage.depends_on):
+                    pending.remove(stage)
+                    started_at[stage.name] = time.perf_counter()
+                    task = asyncio.create_task(stage.fn(self.results), name=f"stage:{stage.name}")
+                    running[task] = stage
+
+        try:
+            _launch_ready()
+            while running:
+                done, _ = await asyncio.wait(running.keys(), return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    stage = running.pop(task)
+                    self.timings[stage.name] = round(time.perf_counter() - started_at[stage.name], 3)
+                    # Re-raises the stage error; the finally block cancels the rest
+                    self.results[stage.name] = task.result()
+                    if self.on_complete:
+                        await self.on_complete(stage.name, self.results[stage.name])
+                _launch_ready()
+        finally:
+            for task in running:
+                task.cancel()
+            if running:
+                await asyncio.gather(*running.keys(), return_exceptions=True)
+
+        if pending:
+            raise RuntimeError(f"Unresolvable stage dependencies: {[s.name for s in pending]}")
+
+        logger.info("Stage timings: %s", self.timings)
+        return self.results
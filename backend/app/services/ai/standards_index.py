@@ -0,0 +1,96 @@
+"""
+BM25 retrieval over the normative corpus (geotech_standards.json).
+
+Every risk, rule and key point of every standard is indexed once as a clause,
+with Russian Snowball-stemmed tokens, so a query costs one lookup per query
+term instead of a scan of the whole corpus against the whole document.
+"""
+import math
+import re
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, Iterable, List, Tuple
+import snowballstemmer
+
+_TOKEN_RE = re.compile(r"[а-яёa-z0-9]+")
+_STOPWORDS = frozenset(
+    "или для при без под над что это как его она они так также если "
+    "все всех более менее должны должен должна быть может могут не на по от до из".split()
+)
+_stemmer = snowballstemmer.stemmer("russian")
+
+# BM25 parameters
+K1 = 1.5
+B = 0.75
+
+
+@lru_cache(maxsize=65536)
+def _stem(word: str) -> str:
+    return _stemmer.stemWord(word)
+
+
+def tokenize(text: str) -> List[str]:
+    """Lower-cased, stop-word-filtered, stemmed tokens."""
+    return [
+        _stem(word) for word in _TOKEN_RE.findall(text.lower().replace("ё", "е"))
+        if len(word) > 2 and word not in _STOPWORDS
+    ]
+
+
+@dataclass(frozen=True)
+class Clause:
+    code: str
+    title: str
+    kind: str  # risk | rule | key_point
+    text: str
+    label: str = ""  # risk key for risks
+
+
+class StandardsIndex:
+
+    def __init__(self, standards: Dict[str, dict]):
+        self.clauses: List[Clause] = []
+        for code, standard in standards.items():
+            title = standard.get("title", "")
+            for risk_key, risk_desc in standard.get("risks", {}).items():
+                self.clauses.append(Clause(code, title, "risk", risk_desc, risk_key))
+            for rule in standard.get("rules", []):
+                self.clauses.append(Clause(code, title, "rule", rule))
+            for point in standard.get("key_points", []):
+                self.clauses.append(Clause(code, title, "key_point", point))
+
+        self.postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        self.lengths: List[int] = []
+        for idx, clause in enumerate(self.clauses):
+            tokens = tokenize(f"{clause.label} {clause.text}")
+            self.lengths.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                self.postings[term].append((idx, tf))
+
+        n = len(self.clauses)
+        self.avg_length = (sum(self.lengths) / n) if n else 0.0
+        self.idf = {
+            term: math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, docs in self.postings.items()
+        }
+
+    @property
+    def vocabulary(self) -> Iterable[str]:
+        return self.postings.keys()
+
+    def search(self, query: Dict[str, float], k: int) -> List[Tuple[Clause, float]]:
+        """
+        Top-k clauses for a weighted bag of stemmed query terms.
+        Terms outside the corpus vocabulary are ignored.
+        """
+        scores: Dict[int, float] = defaultdict(float)
+        for term, weight in query.items():
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for idx, tf in self.postings[term]:
+                norm = K1 * (1 - B + B * self.lengths[idx] / self.avg_length)
+                scores[idx] += weight * idf * tf * (K1 + 1) / (tf + norm)
+        top = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(self.clauses[idx], round(score, 3)) for idx, score in top]
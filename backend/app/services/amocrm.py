@@ -1,6 +1,7 @@
+import asyncio
 import httpx
 import logging
-from typing import Dict, Any
+from typing import Dict, Any, List
 from app.core.config import settings
 
 logger = logging.getLogger(__name__)
@@ -10,18 +11,24 @@ class AmoCRMService:
         # In a real scenario, we would use settings for domain, client_id, secret, etc.
         self.enabled = False 
         
-    async def create_lead(self, name: str, phone: str, email: str = None, company: str = None, audit_data: Dict = None) -> str:
+    async def create_leads(self, leads: List[Dict[str, Any]]) -> List[str]:
         """
-        Creates a lead in AmoCRM with technical audit details.
+        Creates leads in AmoCRM with technical audit details, one API call per batch
+        (the complex-leads endpoint accepts up to 50). Raises on failure so the
+        outbox can retry the batch.
+        Each lead: {"name", "phone", "email", "company", "audit_data"}.
         """
         if not self.enabled:
-            logger.info(f"MOCK AmoCRM: Creating lead for {name} ({phone}). Audit attached: {bool(audit_data)}")
-            # Simulate network delay
-            import asyncio
+            for lead in leads:
+                logger.info(
+                    f"MOCK AmoCRM: Creating lead for {lead.get('name')} ({lead.get('phone')}). "
+                    f"Audit attached: {bool(lead.get('audit_data'))}"
+                )
+            # Simulate network delay (once per batch, like the real call)
             await asyncio.sleep(0.5)
-            return "mock_lead_12345"
+            return [f"mock_lead_{12345 + i}" for i in range(len(leads))]
 
         # Implementation would go here
-        return "not_implemented"
+        return ["not_implemented"] * len(leads)
 
 amocrm_service = AmoCRMService()
@@ -0,0 +1,276 @@
+"""
+Redis-backed audit job queue.
+
+Jobs are submitted by the API (`POST /ai/audits`) and executed by the worker
+pool (`python -m app.worker`). Delivery is at-least-once:
+- a claimed job sits in an in-flight set with a visibility deadline; workers
+  extend it while running, and expired jobs are put back on the queue;
+- each claim gets a token (its attempt number); heartbeats, completion and
+  failure only apply while the job is running under that token, so a worker
+  that outlived its visibility timeout cannot touch a redelivered attempt;
+- failed attempts are retried with exponential backoff up to a max attempt count;
+- each client may only have a limited number of unfinished jobs.
+"""
+import base64
+import json
+import logging
+import time
+import uuid
+from typing import Any, Dict, Optional
+from app.core.config import settings
+from app.core.redis import RedisScript, get_redis
+
+logger = logging.getLogger(__name__)
+
+PENDING_KEY = "audit_jobs:pending"      # list, LPUSH / RPOP
+INFLIGHT_KEY = "audit_jobs:inflight"    # zset, score = visibility deadline
+DELAYED_KEY = "audit_jobs:delayed"      # zset, score = retry time
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+JOB_KEY_PREFIX = "audit_job:"
+CLIENT_KEY_PREFIX = "audit_jobs:active:"
+
+# Atomically pop the next job, mark it in flight and start a new attempt, so a
+# crash between the steps cannot lose it. Ids of jobs already finished (by a
+# worker that outlived its visibility timeout) or expired are dropped.
+# Returns {job_id, attempt}, the attempt being the claim token.
+_CLAIM_LUA = """
+while true do
+    local job_id = redis.call('RPOP', KEYS[1])
+    if not job_id then
+        return nil
+    end
+    local job_key = ARGV[3] .. job_id
+    local status = redis.call('HGET', job_key, 'status')
+    if status == 'queued' or status == 'running' then
+        redis.call('ZADD', KEYS[2], ARGV[1], job_id)
+        local attempt = redis.call('HINCRBY', job_key, 'attempts', 1)
+        redis.call('HSET', job_key, 'status', 'running', 'updated_at', ARGV[2])
+        return {job_id, attempt}
+    end
+end
+"""
+
+# Shared guard: KEYS[2] is the job hash, ARGV[1] the claim token
+_OWNED_LUA = """
+if redis.call('HGET', KEYS[2], 'status') ~= 'running'
+        or redis.call('HGET', KEYS[2], 'attempts') ~= ARGV[1] then
+    return 0
+end
+"""
+
+# KEYS: inflight, job, file; ARGV: token, job_id, client key prefix, hash fields...
+_FINISH_LUA = _OWNED_LUA + """
+redis.call('ZREM', KEYS[1], ARGV[2])
+redis.call('HSET', KEYS[2], unpack(ARGV, 4))
+redis.call('DEL', KEYS[3])
+local client_key = redis.call('HGET', KEYS[2], 'client_key')
+if client_key and client_key ~= '' then
+    redis.call('DECR', ARGV[3] .. client_key)
+end
+return 1
+"""
+
+# KEYS: inflight, job, delayed; ARGV: token, job_id, retry time, error, updated_at
+_RETRY_LUA = _OWNED_LUA + """
+redis.call('ZREM', KEYS[1], ARGV[2])
+redis.call('HSET', KEYS[2], 'status', 'queued', 'error', ARGV[4], 'updated_at', ARGV[5])
+redis.call('ZADD', KEYS[3], ARGV[3], ARGV[2])
+return 1
+"""
+
+# KEYS: inflight, job; ARGV: token, job_id, visibility deadline
+_EXTEND_LUA = _OWNED_LUA + """
+return redis.call('ZADD', KEYS[1], 'XX', 'CH', ARGV[3], ARGV[2])
+"""
+
+# Move every member whose score is due from a zset back onto the pending list
+# (shared with the lead outbox)
+REQUEUE_DUE_LUA = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, 100)
+for _, job_id in ipairs(due) do
+    redis.call('ZREM', KEYS[1], job_id)
+    redis.call('LPUSH', KEYS[2], job_id)
+end
+return #due
+"""
+
+requeue_due = RedisScript(REQUEUE_DUE_LUA)
+_claim = RedisScript(_CLAIM_LUA)
+_finish_owned = RedisScript(_FINISH_LUA)
+_retry_owned = RedisScript(_RETRY_LUA)
+_extend_owned = RedisScript(_EXTEND_LUA)
+
+
+def _job_key(job_id: str) -> str:
+    return f"{JOB_KEY_PREFIX}{job_id}"
+
+
+def _file_key(job_id: str) -> str:
+    return f"audit_job:{job_id}:file"
+
+
+def _client_key(client_key: str) -> str:
+    return f"{CLIENT_KEY_PREFIX}{client_key}"
+
+
+class QueueFullError(Exception):
+    """The client already has the maximum number of unfinished jobs."""
+
+
+async def submit_job(
+    content: bytes,
+    filename: str,
+    client_key: str,
+    client_code: Optional[str] = None,
+    cache_key: Optional[str] = None,
+) -> str:
+    """Store the upload and enqueue a job. Raises QueueFullError over the per-client limit."""
+    redis = get_redis()
+    active_key = _client_key(client_key)
+    active = await redis.incr(active_key)
+    await redis.expire(active_key, settings.AUDIT_JOB_TTL)
+    if active > settings.AUDIT_JOB_CLIENT_CONCURRENCY:
+        await redis.decr(active_key)
+        raise QueueFullError(
+            f"Too many audits in progress (max {settings.AUDIT_JOB_CLIENT_CONCURRENCY})"
+        )
+
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    pipe = redis.pipeline()
+    # decode_responses=True on the shared client, so the file travels as base64
+    pipe.setex(_file_key(job_id), settings.AUDIT_JOB_TTL, base64.b64encode(content).decode("ascii"))
+    pipe.hset(_job_key(job_id), mapping={
+        "status": STATUS_QUEUED,
+        "filename": filename,
+        "client_key": client_key,
+        "client_code": client_code or "",
+        "cache_key": cache_key or "",
+        "attempts": 0,
+        "created_at": now,
+        "updated_at": now,
+    })
+    pipe.expire(_job_key(job_id), settings.AUDIT_JOB_TTL)
+    pipe.lpush(PENDING_KEY, job_id)
+    await pipe.execute()
+    logger.info(f"Audit job {job_id} queued for {client_key} ({filename})")
+    return job_id
+
+
+async def complete_cached(result_json: str, filename: str) -> str:
+    """Record an already-finished job (cache hit) without touching the queue."""
+    redis = get_redis()
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    await redis.hset(_job_key(job_id), mapping={
+        "status": STATUS_DONE,
+        "filename": filename,
+        "attempts": 0,
+        "result": result_json,
+        "created_at": now,
+        "updated_at": now,
+    })
+    await redis.expire(_job_key(job_id), settings.AUDIT_JOB_TTL)
+    return job_id
+
+
+async def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+    data = await get_redis().hgetall(_job_key(job_id))
+    if not data:
+        return None
+    return {
+        "job_id": job_id,
+        "status": data.get("status"),
+        "filename": data.get("filename"),
+        "attempts": int(data.get("attempts", 0)),
+        "error": data.get("error") or None,
+        "result": json.loads(data["result"]) if data.get("result") else None,
+    }
+
+
+async def claim_job() -> Optional[Dict[str, Any]]:
+    """
+    Take the next job off the queue, or None if the queue is empty.
+    The returned `attempts` is the claim token for extend/complete/fail.
+    """
+    redis = get_redis()
+    now = time.time()
+    # Jobs whose worker died (visibility expired) and retries whose backoff elapsed
+    expired = await requeue_due(keys=[INFLIGHT_KEY, PENDING_KEY], args=[now])
+    if expired:
+        logger.warning(f"Requeued {expired} audit jobs after visibility timeout")
+    await requeue_due(keys=[DELAYED_KEY, PENDING_KEY], args=[now])
+
+    claimed = await _claim(
+        keys=[PENDING_KEY, INFLIGHT_KEY],
+        args=[now + settings.AUDIT_JOB_VISIBILITY_TIMEOUT, now, JOB_KEY_PREFIX],
+    )
+    if not claimed:
+        return None
+
+    job_id, attempts = claimed[0], int(claimed[1])
+    if attempts > settings.AUDIT_JOB_MAX_ATTEMPTS:
+        # Only reachable through repeated visibility timeouts (worker crashes)
+        await fail_job(job_id, attempts, "Worker lost the job too many times", retry=False)
+        return None
+    data = await redis.hgetall(_job_key(job_id))
+    encoded = await redis.get(_file_key(job_id))
+    if encoded is None:
+        await fail_job(job_id, attempts, "Uploaded file expired before processing", retry=False)
+        return None
+    return {
+        "job_id": job_id,
+        "attempts": attempts,
+        "filename": data.get("filename", "unknown"),
+        "client_code": data.get("client_code") or None,
+        "cache_key": data.get("cache_key") or None,
+        "content": base64.b64decode(encoded),
+    }
+
+
+async def extend_visibility(job_id: str, token: int) -> bool:
+    """Heartbeat: push the visibility deadline of a running job forward. False once the claim is lost."""
+    return bool(await _extend_owned(
+        keys=[INFLIGHT_KEY, _job_key(job_id)],
+        args=[token, job_id, time.time() + settings.AUDIT_JOB_VISIBILITY_TIMEOUT],
+    ))
+
+
+async def _finish(job_id: str, token: int, mapping: Dict[str, Any]) -> bool:
+    fields = [item for pair in {**mapping, "updated_at": time.time()}.items() for item in pair]
+    finished = await _finish_owned(
+        keys=[INFLIGHT_KEY, _job_key(job_id), _file_key(job_id)],
+        args=[token, job_id, CLIENT_KEY_PREFIX, *fields],
+    )
+    if not finished:
+        logger.warning(f"Audit job {job_id} attempt {token} was redelivered or finished elsewhere; result dropped")
+    return bool(finished)
+
+
+async def complete_job(job_id: str, token: int, result_json: str) -> bool:
+    """Store the result; False if this claim was lost (the job was redelivered or already finished)."""
+    return await _finish(job_id, token, {"status": STATUS_DONE, "result": result_json, "error": ""})
+
+
+async def fail_job(job_id: str, token: int, error: str, retry: bool = True):
+    """Schedule a retry with backoff, or mark the job failed once attempts are exhausted."""
+    attempts = token
+    if retry and attempts < settings.AUDIT_JOB_MAX_ATTEMPTS:
+        delay = settings.AUDIT_JOB_RETRY_BACKOFF * (2 ** (attempts - 1))
+        now = time.time()
+        retried = await _retry_owned(
+            keys=[INFLIGHT_KEY, _job_key(job_id), DELAYED_KEY],
+            args=[token, job_id, now + delay, error, now],
+        )
+        if retried:
+            logger.warning(f"Audit job {job_id} attempt {attempts} failed, retry in {delay}s: {error}")
+        else:
+            logger.warning(f"Audit job {job_id} attempt {token} was redelivered or finished elsewhere; failure dropped")
+        return
+    if await _finish(job_id, token, {"status": STATUS_FAILED, "error": error}):
+        logger.error(f"Audit job {job_id} failed after {attempts} attempts: {error}")
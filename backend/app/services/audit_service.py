@@ -0,0 +1,196 @@
+"""
+Audit service: the full document → analysis → pricing pipeline and its persistence.
+Shared by the synchronous/streaming endpoints and the background job workers.
+"""
+import hashlib
+import logging
+import os
+from typing import Any, Dict, Optional
+from app.core.config import settings
+from app.core.http_client import directus_client
+from app.core.llm_gateway import CircuitOpenError
+from app.schemas.copilot import DraftProposalResponse, NearDuplicateMatch
+from app.services.ai.document_processor import (
+    doc_processor, ParserBusyError, ParserTimeoutError, PARSER_VERSION, SECTION_KEYWORDS,
+)
+from app.services.ai.stage_cache import stage_cache, fingerprint
+from app.services.ai.near_duplicate import near_duplicate_index
+from app.services.ai.geotech_analyzer import geotech_analyzer
+from app.services.dashboard_cache import invalidate_client
+from app.services.directus import fetch_matching_data
+from app.services.estimator import calculate_estimate
+
+logger = logging.getLogger(__name__)
+
+
+class AuditError(Exception):
+    """Audit could not be produced; carries the HTTP status the API should report."""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def analysis_error(e: Exception) -> AuditError:
+    # If it's a validation error (not a geotech doc), we don't count it towards rate limit
+    if "not a geotechnical" in str(e).lower():
+        return AuditError(422, str(e))
+    if isinstance(e, CircuitOpenError):
+        return AuditError(503, str(e))
+    return AuditError(500, f"Professional audit failed: {str(e)}")
+
+
+def _cacheable_document(processed_doc: Dict[str, Any]) -> Dict[str, Any]:
+    # The analyzer only reads these; per-page and per-sheet payloads stay out of Redis
+    return {key: processed_doc[key] for key in ("full_text", "metadata", "sections") if key in processed_doc}
+
+
+async def process_document(content: bytes, filename: str) -> Dict[str, Any]:
+    """Parse an upload, reusing the cached parse of identical content. Raises AuditError."""
+    inputs = (
+        hashlib.sha256(content).hexdigest(),
+        os.path.splitext(filename.lower())[1],
+        settings.PDF_TEXT_BUDGET,
+    )
+    try:
+        return await stage_cache.get_or_compute(
+            "document", fingerprint(PARSER_VERSION, SECTION_KEYWORDS), inputs,
+            lambda: doc_processor.process_bytes(content, filename),
+            dump=_cacheable_document,
+        )
+    except ParserBusyError as e:
+        raise AuditError(503, str(e))
+    except ParserTimeoutError as e:
+        raise AuditError(422, str(e))
+    except Exception as e:
+        raise AuditError(400, f"Error processing document: {str(e)}")
+
+
+async def analyze_document(
+    processed_doc: Dict[str, Any],
+    audit_id: str,
+    filename: str,
+    on_event=None,
+) -> Dict[str, Any]:
+    """
+    Run the analyzer, reusing extraction and risks of a near-identical earlier
+    audit when one is indexed, then index this audit for future matches.
+    Adds `near_duplicate` (NearDuplicateMatch or None) to the analysis result.
+    Raises AuditError.
+    """
+    full_text = processed_doc.get("full_text", "")
+    match = await near_duplicate_index.find(full_text, exclude_id=audit_id)
+    try:
+        analysis_result = await geotech_analyzer.analyze_project(
+            processed_doc, on_event=on_event, prior=match.payload if match else None
+        )
+    except Exception as e:
+        raise analysis_error(e)
+
+    analysis_result["near_duplicate"] = None
+    if match:
+        analysis_result["near_duplicate"] = NearDuplicateMatch(
+            audit_id=match.audit_id,
+            filename=match.payload.get("filename"),
+            similarity=match.similarity,
+        )
+    else:
+        await near_duplicate_index.add(audit_id, full_text, {
+            "filename": filename,
+            "parsed_data": analysis_result["parsed_data"].model_dump(),
+            "risks": analysis_result["risks"],
+        })
+    return analysis_result
+
+
+async def run_audit(content: bytes, filename: str) -> DraftProposalResponse:
+    """Parse, analyze, match and price a document. Raises AuditError on failure."""
+    # 1. High-fidelity Processing
+    processed_doc = await process_document(content, filename)
+
+    # 2. Expert Engineering Analysis (with pre-validation)
+    analysis_result = await analyze_document(
+        processed_doc, hashlib.sha256(content).hexdigest(), filename
+    )
+
+    parsed_data = analysis_result["parsed_data"]
+
+    # 3. Directus Lookup
+    shpunts, machinery = await fetch_matching_data(
+        work_type=parsed_data.work_type,
+        required_profile=parsed_data.required_profile
+    )
+
+    # 4. Professional Estimate Calculation
+    estimated_total = await calculate_estimate(parsed_data, shpunts, machinery)
+
+    return DraftProposalResponse(
+        parsed_data=parsed_data,
+        technical_summary=analysis_result["technical_summary"],
+        risks=analysis_result["risks"],
+        matched_shpunts=shpunts,
+        recommended_machinery=machinery,
+        estimated_total=estimated_total,
+        confidence_score=analysis_result["confidence_score"],
+        clarifying_questions=analysis_result.get("clarifying_questions", []),
+        near_duplicate_of=analysis_result["near_duplicate"],
+    )
+
+
+async def save_audit_to_directus(
+    filename: str, result_data: dict, client_access_code: Optional[str] = None
+):
+    """Background task / worker step: persist audit results to Directus audit_history + send email."""
+    try:
+        client_id = None
+        client_email = None
+        company_name = "Клиент"
+        if client_access_code:
+            res = await directus_client.get("/items/clients", params={
+                "filter[access_code][_eq]": client_access_code,
+                "fields": "id,email,company_name",
+                "limit": 1,
+            })
+            if res.status_code == 200:
+                data = res.json().get("data", [])
+                if data:
+                    client_id = data[0]["id"]
+                    client_email = data[0].get("email")
+                    company_name = data[0].get("company_name", "Клиент")
+
+        parsed = result_data.get("parsed_data", {})
+        record = {
+            "filename": filename,
+            "work_type": parsed.get("work_type"),
+            "soil_type": parsed.get("soil_type"),
+            "volume": parsed.get("volume"),
+            "depth": parsed.get("depth"),
+            "confidence_score": result_data.get("confidence_score"),
+            "risks_count": len(result_data.get("risks", [])),
+            "estimated_total": result_data.get("estimated_total"),
+            "technical_summary": result_data.get("technical_summary"),
+            "full_result": result_data,
+        }
+        if client_id:
+            record["client_id"] = client_id
+
+        await directus_client.post("/items/audit_history", json=record)
+        logger.info(f"Audit saved to Directus: {filename}")
+        if client_id:
+            await invalidate_client(client_id)
+
+        # Email notification
+        if client_email:
+            from app.services.email_service import email_service
+            email_service.send_audit_completed(
+                to_email=client_email,
+                company_name=company_name,
+                filename=filename,
+                work_type=parsed.get("work_type"),
+                risks_count=len(result_data.get("risks", [])),
+                confidence=result_data.get("confidence_score"),
+                estimated_total=result_data.get("estimated_total"),
+            )
+    except Exception as e:
+        logger.error(f"Failed to save audit to Directus: {e}")
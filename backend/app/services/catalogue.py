@@ -0,0 +1,242 @@
+"""
+In-memory mirror of the Directus `shpunts` and `machinery` collections.
+
+Each process loads both collections once, refreshes them every
+CATALOGUE_REFRESH_INTERVAL seconds and immediately on the catalogue webhook
+(published over CATALOGUE_INVALIDATION_CHANNEL). Matching is local:
+- sheet pile marks are normalised across Cyrillic and Latin spelling
+  ("Шпунт Ларсена Л5-УМ", "L5-UM", "Larssen 5 UM" all become "l5um") and matched
+  exactly, by prefix/containment, by mark tokens and finally fuzzily;
+- machinery is matched on stemmed name and category tokens of the work type.
+Results are ranked by match score, then availability, then price.
+"""
+import asyncio
+import logging
+import re
+from dataclasses import dataclass
+from difflib import SequenceMatcher
+from typing import Dict, List, Optional, Tuple
+from app.core.config import settings
+from app.core.http_client import directus_client
+from app.core.redis import get_redis, listen_channel
+from app.schemas.copilot import MachineryInfo, ShpuntInfo
+from app.services.ai.standards_index import tokenize
+
+logger = logging.getLogger(__name__)
+
+_TRANSLIT = str.maketrans({
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ж": "zh", "з": "z",
+    "и": "i", "й": "y", "к": "k", "л": "l", "м": "m", "н": "n", "о": "o", "п": "p",
+    "р": "r", "с": "s", "т": "t", "у": "u", "ф": "f", "х": "h", "ц": "ts", "ч": "ch",
+    "ш": "sh", "щ": "sch", "ъ": "", "ы": "y", "ь": "", "э": "e", "ю": "yu", "я": "ya",
+})
+# "Ларсен 5" is the same series as "Л5"
+_LARSSEN_RE = re.compile(r"\b(?:ларсен\w*|larss?en\w*)\s*(?=\d)")
+_NOISE_RE = re.compile(r"\b(?:шпунт\w*|ларсен\w*|larss?en\w*|sheet|piles?|профил\w*|марк\w*)\b")
+_MARK_TOKEN_RE = re.compile(r"[a-z]+|\d+")
+
+# Work-type stems that imply a machinery category the name may not share
+_WORK_CATEGORY_HINTS = {
+    "погружен": ("копров", "вибропогружател"),
+    "забивк": ("копров",),
+    "вибропогружен": ("вибропогружател",),
+    "вдавливан": ("вдавлив", "копров"),
+    "бурен": ("буров",),
+    "извлечен": ("вибропогружател",),
+}
+
+_AVAILABLE_STATUSES = {"available", "свободна", "доступна", "в наличии"}
+
+
+def profile_key(text: str) -> str:
+    """Canonical Latin, separator-free form of a sheet pile mark."""
+    text = text.lower().replace("ё", "е")
+    text = _LARSSEN_RE.sub("l", text)
+    text = _NOISE_RE.sub(" ", text)
+    return re.sub(r"[^a-z0-9]", "", text.translate(_TRANSLIT))
+
+
+@dataclass(frozen=True)
+class _Entry:
+    key: str
+    tokens: frozenset
+    available: bool
+    price: float
+
+
+class CatalogueIndex:
+
+    def __init__(self, shpunts: List[dict], machinery: List[dict]):
+        self.shpunts: List[Tuple[_Entry, ShpuntInfo]] = []
+        self.by_key: Dict[str, List[int]] = {}
+        for item in shpunts:
+            info = ShpuntInfo(
+                name=item.get("name") or "",
+                price=float(item.get("price") or 0),
+                stock=float(item.get("stock_quantity") or 0),
+            )
+            key = profile_key(info.name)
+            if not key:
+                continue
+            entry = _Entry(key, frozenset(_MARK_TOKEN_RE.findall(key)), info.stock > 0, info.price)
+            self.by_key.setdefault(key, []).append(len(self.shpunts))
+            self.shpunts.append((entry, info))
+
+        self.machinery: List[Tuple[_Entry, frozenset, MachineryInfo]] = []
+        for m in machinery:
+            info = MachineryInfo(
+                id=str(m.get("id")),
+                name=m.get("name") or "",
+                description=m.get("status"),
+                category=m.get("category") or "Спецтехника",
+                price_per_shift=float(m.get("price_per_shift") or 0),
+            )
+            available = (m.get("status") or "").strip().lower() in _AVAILABLE_STATUSES
+            entry = _Entry("", frozenset(tokenize(info.name)), available, info.price_per_shift)
+            self.machinery.append((entry, frozenset(tokenize(info.category)), info))
+
+    def _shpunt_score(self, query: str, qtokens: frozenset, entry: _Entry) -> float:
+        if entry.key == query:
+            return 1.0
+        if entry.key.startswith(query) or query in entry.key:
+            return 0.85
+        score = 0.0
+        if qtokens and entry.tokens:
+            # Every number in the query (series, width) must be present
+            if {t for t in qtokens if t.isdigit()} <= entry.tokens:
+                score = 0.75 * len(qtokens & entry.tokens) / len(qtokens | entry.tokens)
+        ratio = SequenceMatcher(None, query, entry.key).ratio()
+        if ratio >= 0.8:
+            score = max(score, 0.7 * ratio)
+        return score
+
+    def match_shpunts(self, profile: str, limit: int) -> List[ShpuntInfo]:
+        query = profile_key(profile)
+        if not query:
+            return []
+        exact = self.by_key.get(query)
+        if exact:
+            scored = [(1.0, *self.shpunts[i]) for i in exact]
+        else:
+            qtokens = frozenset(_MARK_TOKEN_RE.findall(query))
+            scored = [
+                (score, entry, info) for entry, info in self.shpunts
+                if (score := self._shpunt_score(query, qtokens, entry)) >= settings.CATALOGUE_MIN_SCORE
+            ]
+        scored.sort(key=lambda s: (-s[0], not s[1].available, s[1].price <= 0, s[1].price))
+        return [info for _, _, info in scored[:limit]]
+
+    @staticmethod
+    def _term_score(term: str, tokens: frozenset) -> float:
+        if term in tokens:
+            return 1.0
+        # Compound names: "погруж" inside "вибропогружател"
+        if len(term) >= 4 and any(term in t or (len(t) >= 4 and t in term) for t in tokens):
+            return 0.6
+        return 0.0
+
+    def match_machinery(self, work_type: str, limit: int) -> List[MachineryInfo]:
+        terms = tokenize(work_type or "")
+        if not terms:
+            return []
+        hints = {h for term in terms for stem, hs in _WORK_CATEGORY_HINTS.items() if term.startswith(stem) for h in hs}
+        scored = []
+        for entry, category_tokens, info in self.machinery:
+            score = sum(
+                max(self._term_score(t, entry.tokens), 0.8 * self._term_score(t, category_tokens))
+                for t in terms
+            ) / len(terms)
+            if hints and any(h in t for h in hints for t in category_tokens | entry.tokens):
+                score += 0.5
+            if score >= settings.CATALOGUE_MIN_SCORE:
+                scored.append((score, entry, info))
+        scored.sort(key=lambda s: (-s[0], not s[1].available, s[1].price <= 0, s[1].price))
+        return [info for _, _, info in scored[:limit]]
+
+
+class CatalogueMirror:
+
+    def __init__(self):
+        self.index: Optional[CatalogueIndex] = None
+        self._refresh: Optional[asyncio.Task] = None
+        self._dirty = False
+        self._tasks: List[asyncio.Task] = []
+        self.refreshes = 0
+        self.failures = 0
+
+    async def _load(self) -> CatalogueIndex:
+        shpunts_res, machinery_res = await asyncio.gather(
+            directus_client.get("/items/shpunts", params={"fields": "name,price,stock_quantity", "limit": -1}),
+            directus_client.get(
+                "/items/machinery", params={"fields": "id,name,status,category,price_per_shift", "limit": -1}
+            ),
+        )
+        shpunts_res.raise_for_status()
+        machinery_res.raise_for_status()
+        return CatalogueIndex(shpunts_res.json().get("data") or [], machinery_res.json().get("data") or [])
+
+    async def _do_refresh(self):
+        while True:
+            self._dirty = False
+            try:
+                self.index = await self._load()
+                self.refreshes += 1
+                logger.info(
+                    f"Catalogue mirrored: {len(self.index.shpunts)} shpunts, {len(self.index.machinery)} machines"
+                )
+            except Exception as e:
+                # Keep serving the previous copy
+                self.failures += 1
+                logger.warning(f"Catalogue refresh failed: {e}")
+            if not self._dirty:
+                return
+
+    def refresh(self) -> asyncio.Task:
+        """Start a refresh unless one is already running (single-flight)."""
+        if self._refresh is None or self._refresh.done():
+            self._refresh = asyncio.create_task(self._do_refresh())
+        else:
+            # The running load may already have read the old rows: load once more after it
+            self._dirty = True
+        return self._refresh
+
+    async def get_index(self) -> Optional[CatalogueIndex]:
+        if self.index is None:
+            # Not loaded yet (startup, or Directus was down): wait for one attempt
+            await asyncio.shield(self.refresh())
+        return self.index
+
+    async def _refresh_loop(self):
+        while True:
+            await self.refresh()
+            await asyncio.sleep(settings.CATALOGUE_REFRESH_INTERVAL)
+
+    def start(self):
+        """Load the catalogue and keep it fresh (called from the lifespan / worker start)."""
+        if not self._tasks:
+            self._tasks = [
+                asyncio.create_task(self._refresh_loop()),
+                asyncio.create_task(listen_channel(
+                    settings.CATALOGUE_INVALIDATION_CHANNEL, on_message=lambda _: self.refresh()
+                )),
+            ]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def publish_invalidation(self):
+        await get_redis().publish(settings.CATALOGUE_INVALIDATION_CHANNEL, "refresh")
+
+    def stats(self) -> dict:
+        return {
+            "shpunts": len(self.index.shpunts) if self.index else 0,
+            "machinery": len(self.index.machinery) if self.index else 0,
+            "refreshes": self.refreshes,
+            "failures": self.failures,
+        }
+
+
+catalogue = CatalogueMirror()
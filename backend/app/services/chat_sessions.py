@@ -0,0 +1,54 @@
+"""
+Server-side chat history for /ai/chat/stream.
+
+A session keeps the document context (sent once, on the first turn) and the
+last CHAT_HISTORY_MAX_MESSAGES messages in Redis, so each turn only carries the
+new message. Both keys expire CHAT_SESSION_TTL seconds after the last turn.
+"""
+import json
+import uuid
+from typing import List, Optional, Tuple
+from app.core.config import settings
+from app.core.redis import get_redis
+from app.schemas.copilot import ChatMessage
+
+
+def _context_key(session_id: str) -> str:
+    return f"chat:{session_id}:context"
+
+
+def _history_key(session_id: str) -> str:
+    return f"chat:{session_id}:history"
+
+
+async def create(context: Optional[str]) -> str:
+    session_id = uuid.uuid4().hex
+    # The context key doubles as the session marker, so it exists even without a document
+    await get_redis().setex(_context_key(session_id), settings.CHAT_SESSION_TTL, context or "")
+    return session_id
+
+
+async def load(session_id: str) -> Optional[Tuple[Optional[str], List[ChatMessage]]]:
+    """(context, history) of a live session, or None if it is unknown or expired."""
+    async with get_redis().pipeline(transaction=False) as pipe:
+        pipe.get(_context_key(session_id))
+        pipe.lrange(_history_key(session_id), 0, -1)
+        context, history = await pipe.execute()
+    if context is None:
+        return None
+    return context or None, [ChatMessage(**json.loads(m)) for m in history]
+
+
+async def append_turn(session_id: str, message: str, answer: str):
+    """Store a finished exchange, keep the newest messages and extend the session TTL."""
+    history_key = _history_key(session_id)
+    async with get_redis().pipeline(transaction=True) as pipe:
+        pipe.rpush(
+            history_key,
+            json.dumps({"role": "user", "content": message}, ensure_ascii=False),
+            json.dumps({"role": "assistant", "content": answer}, ensure_ascii=False),
+        )
+        pipe.ltrim(history_key, -settings.CHAT_HISTORY_MAX_MESSAGES, -1)
+        pipe.expire(history_key, settings.CHAT_SESSION_TTL)
+        pipe.expire(_context_key(session_id), settings.CHAT_SESSION_TTL)
+        await pipe.execute()
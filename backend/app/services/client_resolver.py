@@ -0,0 +1,79 @@
+"""
+access_code → client_id resolution for dashboard requests.
+
+Results (including "no such active client") are kept in a per-process LRU for
+CLIENT_RESOLVE_TTL seconds, so a dashboard page load resolves its token once
+instead of once per endpoint. Only clients with `active = true` resolve, so
+switching the flag off in Directus revokes access within the TTL.
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from app.core.config import settings
+from app.core.http_client import directus_client
+
+logger = logging.getLogger(__name__)
+
+
+class ClientResolver:
+
+    def __init__(self):
+        self._cache: "OrderedDict[str, Tuple[float, Optional[int]]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def resolve(self, access_code: str) -> Optional[int]:
+        entry = self._cache.get(access_code)
+        if entry is not None and entry[0] > time.monotonic():
+            self._cache.move_to_end(access_code)
+            self.hits += 1
+            return entry[1]
+
+        # Parallel dashboard calls for the same token share one lookup
+        task = self._inflight.get(access_code)
+        if task is None:
+            self.misses += 1
+            task = asyncio.create_task(self._lookup(access_code))
+            self._inflight[access_code] = task
+            task.add_done_callback(lambda _: self._inflight.pop(access_code, None))
+        return await asyncio.shield(task)
+
+    async def _lookup(self, access_code: str) -> Optional[int]:
+        res = await directus_client.get("/items/clients", params={
+            "filter[access_code][_eq]": access_code,
+            "filter[active][_eq]": True,
+            "fields": "id",
+            "limit": 1,
+        })
+        if res.status_code != 200:
+            # Not cached: a Directus hiccup must not lock the client out for the TTL
+            logger.warning(f"Directus GET /items/clients returned {res.status_code}: {res.text[:200]}")
+            return None
+
+        data = res.json().get("data")
+        client_id = data[0].get("id") if data else None
+        if client_id is None:
+            logger.warning(f"Failed to resolve access_code {access_code} to an active client_id in Directus")
+        else:
+            logger.info(f"Resolved access_code {access_code} to client_id {client_id}")
+
+        self._cache[access_code] = (time.monotonic() + settings.CLIENT_RESOLVE_TTL, client_id)
+        self._cache.move_to_end(access_code)
+        while len(self._cache) > settings.CLIENT_RESOLVE_MAX_ENTRIES:
+            self._cache.popitem(last=False)
+        return client_id
+
+    def invalidate(self, access_code: Optional[str] = None):
+        if access_code is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(access_code, None)
+
+    def stats(self) -> dict:
+        return {"entries": len(self._cache), "hits": self.hits, "misses": self.misses}
+
+
+client_resolver = ClientResolver()
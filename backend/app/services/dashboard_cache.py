@@ -0,0 +1,64 @@
+"""
+Short-lived, per-client Redis cache for dashboard responses.
+
+Each entry holds the serialised JSON body together with its ETag (a hash of the
+body), so a repeated poll is answered from Redis — with a 304 when the client
+already has that ETag — without a Directus query or re-serialisation.
+Entries live for DASHBOARD_CACHE_TTL seconds and are keyed by a per-client
+generation number; bumping it (a new audit saved by a worker, a profile update)
+drops every cached view of that client in all processes at once.
+Cache errors are logged and treated as misses.
+"""
+import hashlib
+import json
+import logging
+from typing import Any, Optional, Tuple
+from app.core.config import settings
+from app.core.redis import get_redis
+
+logger = logging.getLogger(__name__)
+
+
+def _generation_key(client_id: int) -> str:
+    return f"dashboard_gen:{client_id}"
+
+
+def serialise(payload: Any) -> Tuple[bytes, str]:
+    """JSON body and its (strong) ETag."""
+    body = json.dumps(payload, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+    return body, f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+
+
+async def _entry_key(client_id: int, view: str) -> str:
+    generation = await get_redis().get(_generation_key(client_id)) or 0
+    return f"dashboard:{client_id}:{generation}:{view}"
+
+
+async def get_entry(client_id: int, view: str) -> Optional[Tuple[bytes, str]]:
+    """Cached (body, etag) of a client's view, or None."""
+    try:
+        raw = await get_redis().get(await _entry_key(client_id, view))
+    except Exception as e:
+        logger.warning(f"Dashboard cache read failed for {client_id}/{view}: {e}")
+        return None
+    if not raw:
+        return None
+    etag, _, body = raw.partition("\n")
+    return body.encode("utf-8"), etag
+
+
+async def set_entry(client_id: int, view: str, body: bytes, etag: str):
+    try:
+        await get_redis().setex(
+            await _entry_key(client_id, view), settings.DASHBOARD_CACHE_TTL, f"{etag}\n{body.decode('utf-8')}"
+        )
+    except Exception as e:
+        logger.warning(f"Dashboard cache write failed for {client_id}/{view}: {e}")
+
+
+async def invalidate_client(client_id: int):
+    """Drop every cached dashboard view of the client (new audit saved, profile updated)."""
+    try:
+        await get_redis().incr(_generation_key(client_id))
+    except Exception as e:
+        logger.warning(f"Failed to invalidate dashboard cache for client {client_id}: {e}")
@@ -1,92 +1,66 @@
-import httpx
 import logging
 from typing import List
 from app.core.config import settings
+from app.core.http_client import directus_client
 from app.schemas.copilot import ShpuntInfo, MachineryInfo
+from app.services.catalogue import catalogue
+from app.services.settings_cache import SettingsCache
 
 logger = logging.getLogger(__name__)
 
 async def fetch_matching_data(work_type: str, required_profile: str = None):
-    """Fetch matching equipment from Directus. Returns empty lists on failure (no fake data)."""
-    shpunts = []
-    machinery = []
-    
-    async with httpx.AsyncClient(base_url=settings.DIRECTUS_URL, timeout=10.0) as client:
-        # 1. Search for Shpunts
-        if required_profile:
-            try:
-                # Use a more flexible search for the mark
-                params = {
-                    "filter[name][_contains]": required_profile,
-                    "fields": "name,price,stock_quantity"
-                }
-                res = await client.get("/items/shpunts", params=params)
-                if res.status_code == 200:
-                    items = res.json().get("data", [])
-                    for item in items:
-                        shpunts.append(ShpuntInfo(
-                            name=item.get("name"),
-                            price=float(item.get("price") or 0),
-                            stock=float(item.get("stock_quantity") or 0)
-                        ))
-            except Exception as e:
-                logger.warning(f"Shpunt lookup failed: {e}")
+    """Match equipment against the local catalogue mirror. Returns empty lists when it is unavailable (no fake data)."""
+    shpunts: List[ShpuntInfo] = []
+    machinery: List[MachineryInfo] = []
 
-        # 2. Search for Machinery
-        try:
-            m_params = {
-                "filter[_or]": [
-                    {"name": {"_contains": work_type}},
-                    {"category": {"_contains": work_type}}
-                ],
-                "fields": "id,name,status,category,price_per_shift",
-                "limit": 3
-            }
-            m_res = await client.get("/items/machinery", params=m_params)
-            if m_res.status_code == 200:
-                m_items = m_res.json().get("data", [])
-                for m in m_items:
-                    machinery.append(MachineryInfo(
-                        id=str(m.get("id")),
-                        name=m.get("name"),
-                        description=m.get("status"),
-                        category=m.get("category") or "Спецтехника",
-                        price_per_shift=float(m.get("price_per_shift") or 0)
-                    ))
-        except Exception as e:
-            logger.warning(f"Machinery lookup failed: {e}")
+    index = await catalogue.get_index()
+    if index is None:
+        logger.warning("Catalogue mirror is not loaded, skipping equipment matching")
+        return shpunts, machinery
+
+    if required_profile:
+        shpunts = index.match_shpunts(required_profile, limit=settings.CATALOGUE_SHPUNT_LIMIT)
+    machinery = index.match_machinery(work_type, limit=settings.CATALOGUE_MACHINERY_LIMIT)
 
     if not shpunts:
         logger.info("No shpunts found in Directus for profile: %s", required_profile)
     if not machinery:
         logger.info("No machinery found in Directus for work_type: %s", work_type)
-            
+
     return shpunts, machinery
 
 
+DEFAULT_RATES = {
+    "rate_piling": 25000.0,
+    "rate_vibration": 35000.0,
+    "rate_drilling": 4500.0,
+    "rate_extraction": 10000.0,
+    "rate_excavation": 10000.0
+}
+
+
+async def _load_global_settings():
+    """Read the labor rates from Directus, merged over the defaults. Raises on failure."""
+    rates = dict(DEFAULT_RATES)
+    res = await directus_client.get("/items/site_settings", timeout=5.0)
+    res.raise_for_status()
+    data = res.json().get("data")
+    if data:
+        # Merge data override defaults
+        for key in rates.keys():
+            if key in data and data[key] is not None:
+                rates[key] = float(data[key])
+    logger.info("Global settings fetched from Directus")
+    return rates
+
+
+global_settings_cache = SettingsCache(_load_global_settings)
+
+
 async def fetch_global_settings():
-    """Fetch global calculator settings (labor rates) from Directus."""
-    # Default rates as fallback
-    defaults = {
-        "rate_piling": 25000.0,
-        "rate_vibration": 35000.0,
-        "rate_drilling": 4500.0,
-        "rate_extraction": 10000.0,
-        "rate_excavation": 10000.0
-    }
+    """Global calculator settings (labor rates), served from the in-process cache."""
     try:
-        async with httpx.AsyncClient(base_url=settings.DIRECTUS_URL, timeout=5.0) as client:
-            res = await client.get("/items/site_settings")
-            if res.status_code == 200:
-                data = res.json().get("data")
-                if data:
-                    # Merge data override defaults
-                    for key in defaults.keys():
-                        if key in data and data[key] is not None:
-                            defaults[key] = float(data[key])
-                    logger.info("Global settings fetched from Directus")
+        return await global_settings_cache.get()
     except Exception as e:
         logger.warning(f"Failed to fetch global settings, using defaults: {e}")
-    
-    return defaults
-
+        return dict(DEFAULT_RATES)
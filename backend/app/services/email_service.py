@@ -1,15 +1,15 @@
 """
 Email notification service.
-Sends SMTP emails on audit completion and other events.
+Queues emails on audit completion and other events on the shared async mail
+transport (delivery happens in the background, never on the caller's path).
 Gracefully disabled when SMTP credentials are not configured.
 """
 import logging
-import smtplib
-import ssl
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from typing import Optional
 from app.core.config import settings
+from app.services.mail_transport import mail_transport
 
 logger = logging.getLogger(__name__)
 
@@ -18,14 +18,10 @@ class EmailService:
 
     @property
     def enabled(self) -> bool:
-        return (
-            settings.EMAIL_ENABLED
-            and settings.SMTP_USER is not None
-            and settings.SMTP_PASSWORD is not None
-        )
+        return mail_transport.configured
 
     def _send(self, to_email: str, subject: str, html_body: str) -> bool:
-        """Low-level: send email via SMTP SSL."""
+        """Low-level: queue an email on the mail transport. Returns False when email is disabled."""
         if not self.enabled:
             logger.debug("Email disabled, skipping send to %s", to_email)
             return False
@@ -36,16 +32,9 @@ class EmailService:
         msg["Subject"] = subject
         msg.attach(MIMEText(html_body, "html", "utf-8"))
 
-        try:
-            ctx = ssl.create_default_context()
-            with smtplib.SMTP_SSL(settings.SMTP_HOST, settings.SMTP_PORT, context=ctx) as server:
-                server.login(settings.SMTP_USER, settings.SMTP_PASSWORD)
-                server.send_message(msg)
-            logger.info("Email sent to %s: %s", to_email, subject)
-            return True
-        except Exception as e:
-            logger.error("Failed to send email to %s: %s", to_email, e)
-            return False
+        # Fire and forget: the transport logs delivery errors, the callback just consumes them
+        mail_transport.submit(msg).add_done_callback(lambda f: f.cancelled() or f.exception())
+        return True
 
     def send_audit_completed(
         self,
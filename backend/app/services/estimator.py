@@ -0,0 +1,67 @@
+"""
+Professional estimate calculation for AI audits.
+Итого = (Материалы + Работы + Аренда техники) * Коэффициент сложности
+"""
+import logging
+from typing import List, Optional
+from app.schemas.copilot import ParsedSpecSchema, ShpuntInfo, MachineryInfo
+from app.services.directus import fetch_global_settings
+
+logger = logging.getLogger(__name__)
+
+
+async def calculate_estimate(
+    parsed_data: ParsedSpecSchema,
+    shpunts: List[ShpuntInfo],
+    machinery: List[MachineryInfo],
+) -> Optional[float]:
+    """Returns the weighted estimate, or None when there is no volume to price."""
+    if not parsed_data.volume:
+        return None
+
+    # Fetch rates from Directus (with fallbacks)
+    rates = await fetch_global_settings()
+
+    WORK_RATES_MAP = {
+        "погружение": rates["rate_piling"],
+        "вдавливание": rates["rate_vibration"],
+        "бурение": rates["rate_drilling"],
+        "выемка": rates["rate_excavation"],
+        "извлечение": rates["rate_extraction"]
+    }
+
+    # Determine work unit price based on work_type
+    work_type_lower = (parsed_data.work_type or "").lower()
+    work_unit_price = 0
+    for key, rate in WORK_RATES_MAP.items():
+        if key in work_type_lower:
+            work_unit_price = rate
+            break
+    if work_unit_price == 0:
+        work_unit_price = rates["rate_piling"] # Default to piling if unknown
+
+    # 1. Material Cost (Shpunts)
+    material_cost = 0
+    if shpunts:
+        material_cost = shpunts[0].price * parsed_data.volume
+
+    # 2. Field Work Cost
+    field_work_total = work_unit_price * parsed_data.volume
+
+    # 3. Machinery Rental Cost
+    machinery_rental_total = 0
+    if machinery and parsed_data.estimated_shifts:
+        # Sum up all recommended machinery for the estimate
+        shifts = parsed_data.estimated_shifts
+        machinery_rental_total = sum(m.price_per_shift for m in machinery) * shifts
+
+    # Final weighted total with complexity coefficient
+    base_total = material_cost + field_work_total + machinery_rental_total
+    complexity = parsed_data.complexity_coefficient or 1.0
+    estimated_total = base_total * complexity
+
+    logger.info(
+        f"PROF CALC: (Mat:{material_cost} + Work:{field_work_total} + Mach:{machinery_rental_total}) "
+        f"* Complex:{complexity} = {estimated_total}"
+    )
+    return estimated_total if estimated_total > 0 else None
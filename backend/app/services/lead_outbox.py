@@ -0,0 +1,130 @@
+"""
+Redis-backed outbox for lead side effects (AmoCRM sync, manager e-mail).
+
+The API persists a lead in Directus, enqueues its side effects here and answers
+immediately; the worker pool (`python -m app.worker`) drains the outbox.
+Delivery is at-least-once, as in the audit job queue:
+- events are claimed in batches into an in-flight set with a visibility
+  deadline, so a crashed worker's batch is redelivered;
+- CRM events of one batch are sent to AmoCRM in a single call;
+- failures are retried with exponential backoff, and events that exhaust
+  LEAD_OUTBOX_MAX_ATTEMPTS are moved to a dead-letter list for inspection.
+"""
+import json
+import logging
+import time
+import uuid
+from typing import Any, Dict, List
+from app.core.config import settings
+from app.core.redis import RedisScript, get_redis
+from app.services.audit_queue import requeue_due
+
+logger = logging.getLogger(__name__)
+
+PENDING_KEY = "lead_outbox:pending"     # list, LPUSH / RPOP
+INFLIGHT_KEY = "lead_outbox:inflight"   # zset, score = visibility deadline
+DELAYED_KEY = "lead_outbox:delayed"     # zset, score = retry time
+DEAD_KEY = "lead_outbox:dead"           # list of event ids that exhausted their attempts
+
+KIND_CRM = "crm"
+KIND_MAIL = "mail"
+
+# Atomically pop up to ARGV[2] events and mark them in flight
+_CLAIM_BATCH_LUA = """
+local ids = {}
+for i = 1, tonumber(ARGV[2]) do
+    local event_id = redis.call('RPOP', KEYS[1])
+    if not event_id then break end
+    redis.call('ZADD', KEYS[2], ARGV[1], event_id)
+    ids[#ids + 1] = event_id
+end
+return ids
+"""
+_claim_batch = RedisScript(_CLAIM_BATCH_LUA)
+
+
+def _event_key(event_id: str) -> str:
+    return f"lead_outbox:event:{event_id}"
+
+
+async def enqueue(events: List[Dict[str, Any]]):
+    """Enqueue side-effect events, each {"kind": KIND_*, "payload": {...}}, in one round trip."""
+    if not events:
+        return
+    pipe = get_redis().pipeline()
+    for event in events:
+        event_id = uuid.uuid4().hex
+        pipe.hset(_event_key(event_id), mapping={
+            "kind": event["kind"],
+            "payload": json.dumps(event["payload"], ensure_ascii=False, default=str),
+            "attempts": 0,
+            "created_at": time.time(),
+        })
+        pipe.lpush(PENDING_KEY, event_id)
+    await pipe.execute()
+
+
+async def claim_batch(limit: int) -> List[Dict[str, Any]]:
+    """Take up to `limit` events off the outbox (empty list when there is nothing to do)."""
+    redis = get_redis()
+    now = time.time()
+    expired = await requeue_due(keys=[INFLIGHT_KEY, PENDING_KEY], args=[now])
+    if expired:
+        logger.warning(f"Requeued {expired} lead outbox events after visibility timeout")
+    await requeue_due(keys=[DELAYED_KEY, PENDING_KEY], args=[now])
+
+    event_ids = await _claim_batch(
+        keys=[PENDING_KEY, INFLIGHT_KEY], args=[now + settings.LEAD_OUTBOX_VISIBILITY_TIMEOUT, limit]
+    )
+    if not event_ids:
+        return []
+
+    pipe = redis.pipeline()
+    for event_id in event_ids:
+        pipe.hincrby(_event_key(event_id), "attempts", 1)
+        pipe.hgetall(_event_key(event_id))
+    results = await pipe.execute()
+
+    events = []
+    for event_id, attempts, data in zip(event_ids, results[::2], results[1::2]):
+        if not data.get("kind"):
+            # Hash lost (manual cleanup); nothing left to deliver
+            await redis.zrem(INFLIGHT_KEY, event_id)
+            continue
+        events.append({
+            "event_id": event_id,
+            "kind": data["kind"],
+            "payload": json.loads(data["payload"]),
+            "attempts": attempts,
+        })
+    return events
+
+
+async def ack(event_ids: List[str]):
+    if not event_ids:
+        return
+    pipe = get_redis().pipeline()
+    pipe.zrem(INFLIGHT_KEY, *event_ids)
+    for event_id in event_ids:
+        pipe.delete(_event_key(event_id))
+    await pipe.execute()
+
+
+async def fail(events: List[Dict[str, Any]], error: str):
+    """Schedule retries with backoff, dead-lettering events that ran out of attempts."""
+    if not events:
+        return
+    now = time.time()
+    pipe = get_redis().pipeline()
+    for event in events:
+        event_id, attempts = event["event_id"], event["attempts"]
+        pipe.zrem(INFLIGHT_KEY, event_id)
+        pipe.hset(_event_key(event_id), "error", error)
+        if attempts < settings.LEAD_OUTBOX_MAX_ATTEMPTS:
+            delay = min(settings.LEAD_OUTBOX_RETRY_BACKOFF * (2 ** (attempts - 1)), 3600)
+            pipe.zadd(DELAYED_KEY, {event_id: now + delay})
+        else:
+            pipe.lpush(DEAD_KEY, event_id)
+            logger.error(f"Lead outbox event {event_id} ({event['kind']}) dead-lettered: {error}")
+    await pipe.execute()
+    logger.warning(f"{len(events)} lead outbox events failed: {error}")
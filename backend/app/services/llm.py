@@ -2,14 +2,15 @@
 LLM service — Chat AI for interactive geotechnical consultation.
 Structured parsing is handled by geotech_analyzer.py (single source of truth).
 """
+import asyncio
 import json
-from openai import AsyncOpenAI
+from contextlib import aclosing
+from typing import AsyncIterator, Optional
 from app.core.config import settings
+from app.core.llm_gateway import llm_gateway
+from app.services.ai.context_window import fit_history, message_tokens, pack_chunks, prompt_meter
 
-client = AsyncOpenAI(
-    api_key=settings.PROXY_API_KEY,
-    base_url=settings.PROXY_API_BASE_URL,
-)
+CHAT_MODEL = "gpt-4o"
 
 CHAT_SYSTEM_PROMPT = """\
 Ты — старший инженер-геотехник компании "Terra Expert" с 20+ летним опытом.
@@ -19,28 +20,62 @@ CHAT_SYSTEM_PROMPT = """\
 """
 
 
-async def chat_with_ai(message: str, history: list, context: str = None) -> str:
+def _chat_messages(message: str, history: list, context: Optional[str]) -> list:
     """
-    Interactive chat with the AI Senior Geotechnical Engineer.
-    Used by the /api/v1/ai/chat endpoint.
+    Prompt within CHAT_CONTEXT_TOKENS: the context is packed to the parts most
+    relevant to the question, and the oldest turns give way to a short note.
     """
     messages = [{"role": "system", "content": CHAT_SYSTEM_PROMPT}]
 
     if context:
+        context = pack_chunks(context, message, settings.CHAT_DOC_CONTEXT_TOKENS, CHAT_MODEL)
         messages.append({
             "role": "system",
             "content": f"КОНТЕКСТ ОБЪЕКТА (ТЗ):\n{context}",
         })
 
-    for msg in history:
-        messages.append({"role": msg.role, "content": msg.content})
+    question = {"role": "user", "content": message}
+    budget = settings.CHAT_CONTEXT_TOKENS - message_tokens([*messages, question], CHAT_MODEL)
+    turns, note = fit_history(history, max(budget, 0), CHAT_MODEL)
+    if note:
+        messages.append({"role": "system", "content": note})
+    messages.extend(turns)
+    messages.append(question)
+
+    prompt_meter.record("chat", messages, CHAT_MODEL)
+    return messages
 
-    messages.append({"role": "user", "content": message})
 
-    response = await client.chat.completions.create(
-        model="gpt-4o",
+async def chat_with_ai(message: str, history: list, context: str = None) -> str:
+    """
+    Interactive chat with the AI Senior Geotechnical Engineer.
+    Used by the /api/v1/ai/chat endpoint.
+    """
+    # Packing a long context tokenizes it: kept off the event loop
+    messages = await asyncio.to_thread(_chat_messages, message, history, context)
+    response = await llm_gateway.complete(
+        "chat",
+        model=CHAT_MODEL,
         temperature=0.3,
         messages=messages,
     )
 
     return response.choices[0].message.content
+
+
+async def stream_chat(message: str, history: list, context: str = None) -> AsyncIterator[str]:
+    """
+    Same as chat_with_ai, but yields the answer in text deltas as the model produces them.
+    Used by the /api/v1/ai/chat/stream endpoint.
+    """
+    messages = await asyncio.to_thread(_chat_messages, message, history, context)
+    # Client went away mid-answer: aclosing closes the upstream stream too
+    async with aclosing(llm_gateway.stream(
+        "chat",
+        model=CHAT_MODEL,
+        temperature=0.3,
+        messages=messages,
+    )) as stream:
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
@@ -1,31 +1,26 @@
-import smtplib
 import logging
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from typing import Optional, Dict, Any
 from app.core.config import settings
+from app.services.mail_transport import mail_transport
 
 logger = logging.getLogger(__name__)
 
 class MailService:
     def __init__(self):
-        self.enabled = settings.EMAIL_ENABLED
-        self.host = settings.SMTP_HOST
-        self.port = settings.SMTP_PORT
-        self.user = settings.SMTP_USER
-        self.password = settings.SMTP_PASSWORD
         self.from_name = settings.SMTP_FROM_NAME
         self.from_email = settings.SMTP_FROM_EMAIL
         self.admin_email = settings.ADMIN_EMAIL
 
     async def send_lead_notification(self, lead_data: Dict[str, Any]):
-        """Sends an email notification to the manager about a new lead."""
-        if not self.enabled:
+        """Sends an email notification to the manager about a new lead. Raises on SMTP failure."""
+        if not mail_transport.configured:
             logger.info("Email notifications are disabled. Skipping lead email.")
             return
 
-        if not all([self.user, self.password, self.admin_email]):
-            logger.warning("SMTP credentials or ADMIN_EMAIL missing. Cannot send lead email.")
+        if not self.admin_email:
+            logger.warning("ADMIN_EMAIL missing. Cannot send lead email.")
             return
 
         subject = f"🔔 Новый лид: {lead_data.get('name', 'Без имени')} ({lead_data.get('company', 'Без компании')})"
@@ -95,12 +90,7 @@ class MailService:
         message.attach(MIMEText(text_content, "plain"))
         message.attach(MIMEText(html_content, "html"))
 
-        try:
-            with smtplib.SMTP_SSL(self.host, self.port) as server:
-                server.login(self.user, self.password)
-                server.sendmail(self.from_email, self.admin_email, message.as_string())
-            logger.info(f"Lead notification email sent to {self.admin_email}")
-        except Exception as e:
-            logger.error(f"Failed to send email notification: {e}")
+        await mail_transport.send(message)
+        logger.info(f"Lead notification email sent to {self.admin_email}")
 
 mail_service = MailService()
@@ -0,0 +1,174 @@
+"""
+Asynchronous mail transport shared by MailService and EmailService.
+
+Messages are put on an in-process queue and delivered by SMTP_POOL_SIZE sender
+tasks, each holding one persistent, authenticated aiosmtplib connection:
+- a sender drains up to SMTP_BATCH_SIZE queued messages per wake-up and sends
+  them over the same session (no reconnect / login per message);
+- a dropped connection is re-opened once per message before giving up;
+- idle connections are closed after SMTP_IDLE_TIMEOUT seconds.
+With MAIL_BACKEND = "file" messages are appended to the MAIL_SINK_PATH mbox
+instead, for local runs and tests. Nothing here blocks the event loop.
+"""
+import asyncio
+import logging
+import mailbox
+from email.message import Message
+from typing import List, Optional, Tuple
+import aiosmtplib
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+_Item = Tuple[Message, asyncio.Future]
+
+
+class MailTransport:
+
+    def __init__(self):
+        self._queue: Optional[asyncio.Queue] = None
+        self._senders: List[asyncio.Task] = []
+        self.sent = 0
+        self.failed = 0
+        self.connections_opened = 0
+
+    @property
+    def configured(self) -> bool:
+        if settings.MAIL_BACKEND == "file":
+            return True
+        return bool(settings.EMAIL_ENABLED and settings.SMTP_USER and settings.SMTP_PASSWORD)
+
+    def start(self):
+        if self._senders:
+            return
+        self._queue = asyncio.Queue()
+        self._senders = [
+            asyncio.create_task(self._sender(), name=f"smtp-sender-{i}")
+            for i in range(max(settings.SMTP_POOL_SIZE, 1))
+        ]
+
+    async def stop(self):
+        """Flush queued messages (bounded wait), then close every connection."""
+        if not self._senders:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=settings.SMTP_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning(f"Mail transport stopped with {self._queue.qsize()} undelivered messages")
+        for task in self._senders:
+            task.cancel()
+        await asyncio.gather(*self._senders, return_exceptions=True)
+        self._senders = []
+
+    def submit(self, message: Message) -> asyncio.Future:
+        """Queue a message; the returned future resolves when it is delivered (or fails)."""
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((message, future))
+        return future
+
+    async def send(self, message: Message):
+        """Queue a message and wait for delivery. Raises on failure."""
+        await self.submit(message)
+
+    # --- senders -----------------------------------------------------------
+
+    async def _sender(self):
+        smtp: Optional[aiosmtplib.SMTP] = None
+        batch: List[_Item] = []
+        try:
+            while True:
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout=settings.SMTP_IDLE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    smtp = await self._close(smtp)
+                    continue
+                batch = [item]
+                while len(batch) < settings.SMTP_BATCH_SIZE and not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+
+                for message, future in batch:
+                    smtp = await self._deliver(smtp, message, future)
+                    self._queue.task_done()
+                batch = []
+        finally:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(RuntimeError("Mail transport stopped"))
+            await self._close(smtp)
+
+    async def _deliver(
+        self, smtp: Optional[aiosmtplib.SMTP], message: Message, future: asyncio.Future
+    ) -> Optional[aiosmtplib.SMTP]:
+        try:
+            if settings.MAIL_BACKEND == "file":
+                await asyncio.to_thread(self._write_mbox, message)
+            else:
+                for attempt in range(2):
+                    try:
+                        if smtp is None or not smtp.is_connected:
+                            smtp = await self._connect()
+                        await smtp.send_message(message)
+                        break
+                    except (aiosmtplib.SMTPServerDisconnected, ConnectionError):
+                        # Server dropped an idle pooled connection: reconnect once
+                        smtp = await self._close(smtp)
+                        if attempt:
+                            raise
+            self.sent += 1
+            logger.info(f"Email sent to {message['To']}: {message['Subject']}")
+            if not future.done():
+                future.set_result(None)
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"Failed to send email to {message['To']}: {e}")
+            if not future.done():
+                future.set_exception(e)
+            if isinstance(e, aiosmtplib.SMTPException):
+                smtp = await self._close(smtp)
+        return smtp
+
+    async def _connect(self) -> aiosmtplib.SMTP:
+        smtp = aiosmtplib.SMTP(
+            hostname=settings.SMTP_HOST,
+            port=settings.SMTP_PORT,
+            use_tls=settings.SMTP_PORT == 465,
+            start_tls=None if settings.SMTP_PORT != 465 else False,
+            timeout=settings.SMTP_TIMEOUT,
+        )
+        await smtp.connect()
+        await smtp.login(settings.SMTP_USER, settings.SMTP_PASSWORD)
+        self.connections_opened += 1
+        return smtp
+
+    @staticmethod
+    async def _close(smtp: Optional[aiosmtplib.SMTP]) -> None:
+        if smtp is not None and smtp.is_connected:
+            try:
+                await smtp.quit()
+            except Exception:
+                smtp.close()
+        return None
+
+    @staticmethod
+    def _write_mbox(message: Message):
+        box = mailbox.mbox(settings.MAIL_SINK_PATH)
+        try:
+            box.lock()
+            box.add(message)
+            box.flush()
+        finally:
+            box.unlock()
+            box.close()
+
+    def stats(self) -> dict:
+        return {
+            "backend": settings.MAIL_BACKEND,
+            "queued": self._queue.qsize() if self._queue else 0,
+            "sent": self.sent,
+            "failed": self.failed,
+            "connections_opened": self.connections_opened,
+        }
+
+
+mail_transport = MailTransport()
@@ -1,11 +1,26 @@
 """
 PDF Generator v2 — Branded multi-page audit report.
 Uses PyMuPDF (fitz) with Cyrillic font support.
+
+Fonts are resolved once per process and embedded once into a template document
+that already carries the static brand header and footer; each report starts
+from a copy of that template. Finished reports are cached in Redis by a hash
+of the proposal, so repeat downloads skip rendering entirely.
 """
+import asyncio
+import base64
+import logging
+import os
+import threading
 import fitz
-import io
 from datetime import datetime
-from typing import Dict, Any, List, Optional
+from functools import lru_cache
+from typing import Dict, Any, List, Optional, Tuple
+from app.core.config import settings
+from app.core.redis import get_redis
+from app.services.ai.stage_cache import fingerprint
+
+logger = logging.getLogger(__name__)
 
 # Brand colors (RGB 0-1)
 BRAND_ORANGE = (0.976, 0.451, 0.086)   # #F97316
@@ -18,6 +33,39 @@ GREEN_OK      = (0.20, 0.75, 0.35)
 LINE_GRAY     = (0.88, 0.88, 0.90)
 WHITE         = (1, 1, 1)
 
+# Bump when the layout changes so cached reports are re-rendered
+REPORT_VERSION = "2.1"
+# Cover + up to three continuation pages (risk overflow, equipment, summary overflow)
+TEMPLATE_PAGES = 4
+
+
+class _Canvas:
+    """
+    Page-like drawing surface that buffers into one Shape and writes the page
+    content stream once (page.insert_text/draw_* re-parse the page per call).
+    Text is layered above graphics, which is how every report element is drawn.
+    """
+
+    def __init__(self, page):
+        self.shape = page.new_shape()
+
+    def insert_text(self, point, text, **kwargs):
+        self.shape.insert_text(point, text, **kwargs)
+
+    def insert_textbox(self, rect, text, **kwargs):
+        return self.shape.insert_textbox(rect, text, **kwargs)
+
+    def draw_rect(self, rect, color=None, fill=None):
+        self.shape.draw_rect(rect)
+        self.shape.finish(color=color, fill=fill)
+
+    def draw_line(self, p1, p2, color=None, width=1):
+        self.shape.draw_line(p1, p2)
+        self.shape.finish(color=color, width=width)
+
+    def commit(self):
+        self.shape.commit()
+
 
 class PDFGeneratorService:
 
@@ -33,9 +81,13 @@ class PDFGeneratorService:
         "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
     ]
 
-    def _find_font(self, candidates: list) -> Optional[str]:
-        """Find first available font file from candidate list."""
-        import os
+    _template_lock = threading.Lock()
+    _template: Optional[Tuple[bytes, list]] = None
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def _find_font(candidates: Tuple[str, ...]) -> Optional[str]:
+        """Find first available font file from candidate list (probed once per process)."""
         for path in candidates:
             if os.path.exists(path):
                 return path
@@ -43,8 +95,8 @@ class PDFGeneratorService:
 
     def _setup_fonts(self, page):
         """Register Cyrillic-capable fonts on a page. Returns (regular_name, bold_name)."""
-        reg_path = self._find_font(self.FONT_REGULAR_CANDIDATES)
-        bold_path = self._find_font(self.FONT_BOLD_CANDIDATES)
+        reg_path = self._find_font(tuple(self.FONT_REGULAR_CANDIDATES))
+        bold_path = self._find_font(tuple(self.FONT_BOLD_CANDIDATES))
 
         fr = "F1"
         fb = "F2"
@@ -61,12 +113,82 @@ class PDFGeneratorService:
 
         return fr, fb
 
+    def _draw_static(self, page, cover: bool):
+        """Brand elements that are identical in every report."""
+        fr, fb = self._setup_fonts(page)
+        if cover:
+            page.draw_rect(fitz.Rect(0, 0, 595, 90), fill=DARK_BG)
+            page.insert_text(
+                (40, 35), "TERRA EXPERT",
+                fontname=fb, fontsize=20, color=BRAND_ORANGE,
+            )
+            page.insert_text(
+                (40, 55), "Экспертный AI-аудит инженерно-геологической документации",
+                fontname=fr, fontsize=9, color=(0.7, 0.7, 0.75),
+            )
+        y = 810
+        page.draw_line((40, y), (555, y), color=LINE_GRAY, width=0.5)
+        page.insert_text(
+            (40, y + 14), "Terra Expert  •  geotech-hub.ru",
+            fontname=fr, fontsize=7, color=TEXT_LIGHT,
+        )
+        return fr, fb
+
+    def _open_template(self) -> fitz.Document:
+        """
+        Copy of the pre-rendered template: fonts embedded and static brand elements
+        drawn once per process.
+        """
+        if PDFGeneratorService._template is None:
+            with self._template_lock:
+                if PDFGeneratorService._template is None:
+                    doc = fitz.open()
+                    for i in range(TEMPLATE_PAGES):
+                        self._draw_static(doc.new_page(width=595, height=842), cover=i == 0)
+                    # garbage=1 keeps xref numbers, so the font metrics below stay valid
+                    PDFGeneratorService._template = (
+                        doc.tobytes(garbage=1, deflate=True),
+                        [list(info) for info in doc.FontInfos],
+                    )
+                    doc.close()
+        template, font_infos = PDFGeneratorService._template
+        doc = fitz.open("pdf", template)
+        # Without the metrics PyMuPDF would re-parse the embedded fonts on first use
+        doc.FontInfos.extend(font_infos)
+        return doc
+
+    def _fonts(self) -> Tuple[str, str]:
+        fr = "F1" if self._find_font(tuple(self.FONT_REGULAR_CANDIDATES)) else "helv"
+        fb = "F2" if self._find_font(tuple(self.FONT_BOLD_CANDIDATES)) else "hebo"
+        return fr, fb
+
+    async def get_audit_report(self, proposal_data: Dict[str, Any]) -> bytes:
+        """
+        Cached report for the proposal: served from Redis when the same proposal was
+        rendered before, otherwise rendered in a worker thread and stored.
+        """
+        key = f"audit_report:{REPORT_VERSION}:{fingerprint(proposal_data)}"
+        try:
+            cached = await get_redis().get(key)
+            if cached:
+                return base64.b64decode(cached)
+        except Exception as e:
+            logger.warning(f"Report cache read failed: {e}")
+
+        pdf_bytes = await asyncio.to_thread(self.generate_audit_report, proposal_data)
+        try:
+            # decode_responses=True on the shared client, so the PDF travels as base64
+            await get_redis().setex(key, settings.REPORT_CACHE_TTL, base64.b64encode(pdf_bytes).decode("ascii"))
+        except Exception as e:
+            logger.warning(f"Report cache write failed: {e}")
+        return pdf_bytes
+
     def generate_audit_report(self, proposal_data: Dict[str, Any]) -> bytes:
         """
         Generates a professional branded engineering audit report in PDF format.
         Multi-page: cover, specs, risks, equipment, summary.
         """
-        doc = fitz.open()
+        doc = self._open_template()
         parsed = proposal_data.get("parsed_data", {})
         risks = proposal_data.get("risks", [])
         shpunts = proposal_data.get("matched_shpunts", [])
@@ -76,27 +198,28 @@ class PDFGeneratorService:
         estimated = proposal_data.get("estimated_total")
         now = datetime.now()
 
-        # ─── Font names (set per page via _setup_fonts) ───
-        self._fr = "helv"  # regular
-        self._fb = "hebo"  # bold
+        # ─── Font names (registered on every template page) ───
+        fr, fb = self._fonts()
+        pages_used = 0
 
         def new_page():
+            nonlocal pages_used
+            pages_used += 1
+            if pages_used <= TEMPLATE_PAGES:
+                return _Canvas(doc[pages_used - 1])
+            # More pages than the template holds: draw the static parts on the spot
             page = doc.new_page(width=595, height=842)  # A4
-            self._fr, self._fb = self._setup_fonts(page)
-            return page
+            self._draw_static(page, cover=False)
+            return _Canvas(page)
 
         def add_footer(page):
-            """Add branded footer to every page."""
+            """Add the dated part of the branded footer (the rest is in the template) and finish the page."""
             y = 810
-            page.draw_line((40, y), (555, y), color=LINE_GRAY, width=0.5)
-            page.insert_text(
-                (40, y + 14), "Terra Expert  •  geotech-hub.ru",
-                fontname=self._fr, fontsize=7, color=TEXT_LIGHT,
-            )
             page.insert_text(
                 (430, y + 14), f"Отчет от {now.strftime('%d.%m.%Y %H:%M')}",
-                fontname=self._fr, fontsize=7, color=TEXT_LIGHT,
+                fontname=fr, fontsize=7, color=TEXT_LIGHT,
             )
+            page.commit()
 
         def draw_section_title(page, y: float, title: str) -> float:
             """Draw section header with orange accent line."""
@@ -105,7 +228,7 @@ class PDFGeneratorService:
             page.draw_rect(fitz.Rect(40, y - 2, 44, y + 12), color=BRAND_ORANGE, fill=BRAND_ORANGE)
             page.insert_text(
                 (52, y + 10), title.upper(),
-                fontname=self._fb, fontsize=11, color=TEXT_BLACK,
+                fontname=fb, fontsize=11, color=TEXT_BLACK,
             )
             return y + 30
 
@@ -114,26 +237,16 @@ class PDFGeneratorService:
         # ═══════════════════════════════════════
         p1 = new_page()
 
-        # Top brand bar
-        p1.draw_rect(fitz.Rect(0, 0, 595, 90), fill=DARK_BG)
-        p1.insert_text(
-            (40, 35), "TERRA EXPERT",
-            fontname=self._fb, fontsize=20, color=BRAND_ORANGE,
-        )
-        p1.insert_text(
-            (40, 55), "Экспертный AI-аудит инженерно-геологической документации",
-            fontname=self._fr, fontsize=9, color=(0.7, 0.7, 0.75),
-        )
-        # Date + confidence badge
+        # Top brand bar comes from the template; date + confidence badge
         p1.insert_text(
             (400, 35), now.strftime("%d %B %Y"),
-            fontname=self._fr, fontsize=9, color=(0.7, 0.7, 0.75),
+            fontname=fr, fontsize=9, color=(0.7, 0.7, 0.75),
         )
         conf_pct = f"{confidence * 100:.0f}%" if confidence else "—"
         conf_color = GREEN_OK if confidence and confidence >= 0.7 else RED_RISK
         p1.insert_text(
             (400, 55), f"Уверенность: {conf_pct}",
-            fontname=self._fb, fontsize=9, color=conf_color,
+            fontname=fb, fontsize=9, color=conf_color,
         )
 
         # ── Section 1: Project Specifications ──
@@ -151,19 +264,19 @@ class PDFGeneratorService:
 
         for label, value in spec_items:
             # Label
-            p1.insert_text((52, y + 10), label + ":", fontname=self._fr, fontsize=9, color=TEXT_GRAY)
+            p1.insert_text((52, y + 10), label + ":", fontname=fr, fontsize=9, color=TEXT_GRAY)
             # Value
-            p1.insert_text((200, y + 10), value, fontname=self._fb, fontsize=9, color=TEXT_BLACK)
+            p1.insert_text((200, y + 10), value, fontname=fb, fontsize=9, color=TEXT_BLACK)
             y += 20
 
         # Special conditions
         specials = parsed.get("special_conditions", [])
         if specials:
             y += 5
-            p1.insert_text((52, y + 10), "Особые условия:", fontname=self._fr, fontsize=9, color=TEXT_GRAY)
+            p1.insert_text((52, y + 10), "Особые условия:", fontname=fr, fontsize=9, color=TEXT_GRAY)
             y += 18
             for cond in specials[:5]:
-                p1.insert_text((70, y + 10), f"• {cond}", fontname=self._fr, fontsize=8, color=TEXT_BLACK)
+                p1.insert_text((70, y + 10), f"• {cond}", fontname=fr, fontsize=8, color=TEXT_BLACK)
                 y += 14
 
         # Estimated total
@@ -173,11 +286,11 @@ class PDFGeneratorService:
             p1.draw_rect(fitz.Rect(40, y, 44, y + 40), fill=GREEN_OK)
             p1.insert_text(
                 (55, y + 15), "ПРЕДВАРИТЕЛЬНАЯ СМЕТА",
-                fontname=self._fr, fontsize=8, color=TEXT_GRAY,
+                fontname=fr, fontsize=8, color=TEXT_GRAY,
             )
             p1.insert_text(
                 (55, y + 30), f"{estimated:,.0f} ₽".replace(",", " "),
-                fontname=self._fb, fontsize=14, color=GREEN_OK,
+                fontname=fb, fontsize=14, color=GREEN_OK,
             )
             y += 50
 
@@ -199,19 +312,19 @@ class PDFGeneratorService:
                 # Number
                 p1.insert_text(
                     (52, y + 14), f"R{i + 1}",
-                    fontname=self._fb, fontsize=8, color=RED_RISK,
+                    fontname=fb, fontsize=8, color=RED_RISK,
                 )
                 # Title
                 risk_text = str(risk.get("risk", ""))[:80]
                 p1.insert_text(
                     (75, y + 14), risk_text,
-                    fontname=self._fb, fontsize=8, color=TEXT_BLACK,
+                    fontname=fb, fontsize=8, color=TEXT_BLACK,
                 )
                 # Impact
                 impact_text = str(risk.get("impact", ""))[:100]
                 p1.insert_text(
                     (75, y + 30), impact_text,
-                    fontname=self._fr, fontsize=7, color=TEXT_GRAY,
+                    fontname=fr, fontsize=7, color=TEXT_GRAY,
                 )
                 y += 48
 
@@ -228,42 +341,42 @@ class PDFGeneratorService:
             y = draw_section_title(p2, y, "Подобранное оборудование")
 
             if shpunts:
-                p2.insert_text((52, y + 10), "Шпунт:", fontname=self._fb, fontsize=9, color=TEXT_BLACK)
+                p2.insert_text((52, y + 10), "Шпунт:", fontname=fb, fontsize=9, color=TEXT_BLACK)
                 y += 22
 
                 # Table header
                 p2.draw_rect(fitz.Rect(52, y, 540, y + 18), fill=(0.95, 0.95, 0.97))
-                p2.insert_text((60, y + 12), "Название", fontname=self._fb, fontsize=7, color=TEXT_GRAY)
-                p2.insert_text((300, y + 12), "Цена", fontname=self._fb, fontsize=7, color=TEXT_GRAY)
-                p2.insert_text((420, y + 12), "На складе", fontname=self._fb, fontsize=7, color=TEXT_GRAY)
+                p2.insert_text((60, y + 12), "Название", fontname=fb, fontsize=7, color=TEXT_GRAY)
+                p2.insert_text((300, y + 12), "Цена", fontname=fb, fontsize=7, color=TEXT_GRAY)
+                p2.insert_text((420, y + 12), "На складе", fontname=fb, fontsize=7, color=TEXT_GRAY)
                 y += 20
 
                 for s in shpunts[:8]:
                     name = str(s.get("name", "—"))[:40]
                     price = s.get("price", 0)
                     stock = s.get("stock", 0)
-                    p2.insert_text((60, y + 12), name, fontname=self._fr, fontsize=8, color=TEXT_BLACK)
-                    p2.insert_text((300, y + 12), f"{price:,.0f} ₽".replace(",", " "), fontname=self._fr, fontsize=8, color=TEXT_BLACK)
-                    p2.insert_text((420, y + 12), f"{stock} шт", fontname=self._fr, fontsize=8, color=TEXT_BLACK)
+                    p2.insert_text((60, y + 12), name, fontname=fr, fontsize=8, color=TEXT_BLACK)
+                    p2.insert_text((300, y + 12), f"{price:,.0f} ₽".replace(",", " "), fontname=fr, fontsize=8, color=TEXT_BLACK)
+                    p2.insert_text((420, y + 12), f"{stock} шт", fontname=fr, fontsize=8, color=TEXT_BLACK)
                     p2.draw_line((52, y + 18), (540, y + 18), color=LINE_GRAY, width=0.3)
                     y += 22
 
                 y += 10
 
             if machinery:
-                p2.insert_text((52, y + 10), "Рекомендуемая техника:", fontname=self._fb, fontsize=9, color=TEXT_BLACK)
+                p2.insert_text((52, y + 10), "Рекомендуемая техника:", fontname=fb, fontsize=9, color=TEXT_BLACK)
                 y += 22
 
                 p2.draw_rect(fitz.Rect(52, y, 540, y + 18), fill=(0.95, 0.95, 0.97))
-                p2.insert_text((60, y + 12), "Техника", fontname=self._fb, fontsize=7, color=TEXT_GRAY)
-                p2.insert_text((350, y + 12), "Категория", fontname=self._fb, fontsize=7, color=TEXT_GRAY)
+                p2.insert_text((60, y + 12), "Техника", fontname=fb, fontsize=7, color=TEXT_GRAY)
+                p2.insert_text((350, y + 12), "Категория", fontname=fb, fontsize=7, color=TEXT_GRAY)
                 y += 20
 
                 for m in machinery[:8]:
                     name = str(m.get("name", "—"))[:45]
                     cat = str(m.get("category", "—"))[:30]
-                    p2.insert_text((60, y + 12), name, fontname=self._fr, fontsize=8, color=TEXT_BLACK)
-                    p2.insert_text((350, y + 12), cat, fontname=self._fr, fontsize=8, color=TEXT_BLACK)
+                    p2.insert_text((60, y + 12), name, fontname=fr, fontsize=8, color=TEXT_BLACK)
+                    p2.insert_text((350, y + 12), cat, fontname=fr, fontsize=8, color=TEXT_BLACK)
                     p2.draw_line((52, y + 18), (540, y + 18), color=LINE_GRAY, width=0.3)
                     y += 22
 
@@ -283,7 +396,7 @@ class PDFGeneratorService:
             p2.insert_textbox(
                 rect,
                 summary_text[:3000],
-                fontname=self._fr,
+                fontname=fr,
                 fontsize=8.5,
                 color=TEXT_BLACK,
                 align=fitz.TEXT_ALIGN_LEFT,
@@ -304,7 +417,9 @@ class PDFGeneratorService:
             "creationDate": now.strftime("D:%Y%m%d%H%M%S"),
         })
 
-        pdf_bytes = doc.write()
+        if pages_used < doc.page_count:
+            doc.delete_pages(from_page=pages_used, to_page=doc.page_count - 1)
+        pdf_bytes = doc.tobytes(garbage=1, deflate=True)
         doc.close()
         return pdf_bytes
 
@@ -0,0 +1,110 @@
+"""
+In-process TTL cache for the calculator settings (labor rates) from Directus.
+
+Rates change a few times a year, so each process keeps one copy:
+- fresh for SETTINGS_CACHE_TTL seconds;
+- after that the stale copy is still served for up to SETTINGS_CACHE_STALE seconds
+  while a single background task refreshes it (stale-while-revalidate);
+- concurrent cold misses share one Directus request (single-flight).
+Invalidation is pushed over the SETTINGS_INVALIDATION_CHANNEL Redis channel
+(published by the Directus webhook, see api/v1/endpoints/webhooks.py), so every
+API and worker process drops its copy at the same time and prices stay consistent.
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+from app.core.config import settings
+from app.core.redis import get_redis, listen_channel
+
+logger = logging.getLogger(__name__)
+
+
+class SettingsCache:
+
+    def __init__(self, loader: Callable[[], Awaitable[Dict[str, Any]]]):
+        self._loader = loader
+        self._value: Optional[Dict[str, Any]] = None
+        self._loaded_at = 0.0
+        self._refresh: Optional[asyncio.Task] = None
+        self._listener: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.stale_hits = 0
+        self.loads = 0
+        self.invalidations = 0
+
+    async def get(self) -> Dict[str, Any]:
+        age = time.monotonic() - self._loaded_at
+        if self._value is not None and age < settings.SETTINGS_CACHE_TTL:
+            self.hits += 1
+            return dict(self._value)
+        if self._value is not None and age < settings.SETTINGS_CACHE_TTL + settings.SETTINGS_CACHE_STALE:
+            self.stale_hits += 1
+            self._start_refresh()
+            return dict(self._value)
+        # Cold or too stale: wait for the (shared) refresh
+        return dict(await asyncio.shield(self._start_refresh()))
+
+    def invalidate(self):
+        self._value = None
+        self._loaded_at = 0.0
+        self.invalidations += 1
+        # A refresh started before the change may carry old rates
+        if self._refresh is not None and not self._refresh.done():
+            self._refresh = None
+
+    def _start_refresh(self) -> asyncio.Task:
+        if self._refresh is None or self._refresh.done():
+            self._refresh = asyncio.create_task(self._do_refresh())
+            self._refresh.add_done_callback(self._log_failure)
+        return self._refresh
+
+    @staticmethod
+    def _log_failure(task: asyncio.Task):
+        # The stale copy keeps being served; the next request retries
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"Global settings refresh failed: {task.exception()}")
+
+    async def _do_refresh(self) -> Dict[str, Any]:
+        me = asyncio.current_task()
+        self.loads += 1
+        value = await self._loader()
+        if self._refresh is me:
+            self._value = value
+            self._loaded_at = time.monotonic()
+        return value
+
+    # --- push invalidation -------------------------------------------------
+
+    def start(self):
+        """Subscribe to the invalidation channel (called from the lifespan / worker start)."""
+        if self._listener is None:
+            self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._listener:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+
+    async def _listen(self):
+        await listen_channel(
+            settings.SETTINGS_INVALIDATION_CHANNEL,
+            on_message=lambda _: self.invalidate(),
+            on_subscribe=self.invalidate,
+        )
+
+    async def publish_invalidation(self):
+        await get_redis().publish(settings.SETTINGS_INVALIDATION_CHANNEL, "invalidate")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "loads": self.loads,
+            "invalidations": self.invalidations,
+            "age_seconds": round(time.monotonic() - self._loaded_at, 1) if self._value is not None else None,
+        }
@@ -0,0 +1,176 @@
+"""
+Audit worker pool.
+Run with `python -m app.worker`; starts settings.AUDIT_WORKERS processes that
+consume the Redis audit job queue (see app/services/audit_queue.py) and drain
+the lead outbox (see app/services/lead_outbox.py).
+"""
+import asyncio
+import logging
+import multiprocessing
+import signal
+from app.core.config import settings
+from app.core.http_client import directus_client
+from app.core.llm_gateway import llm_gateway
+from app.core.redis import get_redis, redis_manager
+from app.services import audit_queue, lead_outbox
+from app.services.amocrm import amocrm_service
+from app.services.mail import mail_service
+from app.services.mail_transport import mail_transport
+from app.services.catalogue import catalogue
+from app.services.ai.document_processor import doc_processor
+from app.services.directus import global_settings_cache
+from app.services.audit_service import AuditError, run_audit, save_audit_to_directus
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL = 1.0  # seconds between polls of an empty queue
+
+
+async def _heartbeat(job_id: str, token: int):
+    while True:
+        await asyncio.sleep(settings.AUDIT_JOB_VISIBILITY_TIMEOUT / 3)
+        try:
+            if not await audit_queue.extend_visibility(job_id, token):
+                logger.warning(f"Audit job {job_id} attempt {token} lost its claim")
+                return
+        except Exception as e:
+            logger.warning(f"Audit job {job_id} heartbeat failed: {e}")
+
+
+async def process_job(job: dict):
+    job_id, token = job["job_id"], job["attempts"]
+    heartbeat = asyncio.create_task(_heartbeat(job_id, token))
+    try:
+        response_data = await run_audit(job["content"], job["filename"])
+    except AuditError as e:
+        # 4xx outcomes (bad file, not a geotech document) will not improve on retry
+        await audit_queue.fail_job(job_id, token, e.detail, retry=e.status_code >= 500)
+        return
+    except Exception as e:
+        await audit_queue.fail_job(job_id, token, str(e))
+        return
+    finally:
+        heartbeat.cancel()
+
+    result_json = response_data.model_dump_json()
+    if not await audit_queue.complete_job(job_id, token, result_json):
+        # Another worker owns this job now; it records its own result
+        return
+    if job["cache_key"]:
+        try:
+            await get_redis().setex(job["cache_key"], 86400, result_json) # 24 hour cache
+        except Exception as e:
+            logger.warning(f"Audit result cache write failed: {e}")
+    await save_audit_to_directus(job["filename"], response_data.model_dump(), job["client_code"])
+    logger.info(f"Audit job {job_id} done (attempt {job['attempts']})")
+
+
+async def run_worker(stop: asyncio.Event):
+    while not stop.is_set():
+        try:
+            job = await audit_queue.claim_job()
+        except Exception as e:
+            logger.warning(f"Audit job claim failed: {e}")
+            job = None
+        if job is None:
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            continue
+        try:
+            await process_job(job)
+        except Exception as e:
+            # Left in flight: redelivered once its visibility timeout expires
+            logger.error(f"Audit job {job['job_id']} could not be recorded: {e}")
+
+
+async def process_lead_events(events: list):
+    crm = [e for e in events if e["kind"] == lead_outbox.KIND_CRM]
+    if crm:
+        try:
+            crm_ids = await amocrm_service.create_leads([e["payload"] for e in crm])
+        except Exception as e:
+            await lead_outbox.fail(crm, f"AmoCRM: {e}")
+        else:
+            await lead_outbox.ack([e["event_id"] for e in crm])
+            for event, crm_id in zip(crm, crm_ids):
+                logger.info(f"Lead {event['payload'].get('directus_id')} synced to AmoCRM as {crm_id}")
+
+    for event in events:
+        if event["kind"] != lead_outbox.KIND_MAIL:
+            continue
+        try:
+            await mail_service.send_lead_notification(event["payload"])
+        except Exception as e:
+            await lead_outbox.fail([event], f"SMTP: {e}")
+        else:
+            await lead_outbox.ack([event["event_id"]])
+
+
+async def run_lead_outbox(stop: asyncio.Event):
+    while not stop.is_set():
+        try:
+            events = await lead_outbox.claim_batch(settings.LEAD_OUTBOX_BATCH)
+        except Exception as e:
+            logger.warning(f"Lead outbox claim failed: {e}")
+            events = []
+        if not events:
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            continue
+        await process_lead_events(events)
+
+
+def _worker_main(index: int):
+    logging.basicConfig(level=logging.INFO, format=f"[worker-{index}] %(levelname)s %(name)s: %(message)s")
+
+    async def main():
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, stop.set)
+        redis_manager.start()
+        directus_client.start()
+        llm_gateway.start()
+        # Keeps PDF/Excel parsing off this loop, so heartbeats and the outbox keep running
+        doc_processor.start()
+        global_settings_cache.start()
+        catalogue.start()
+        try:
+            await asyncio.gather(run_worker(stop), run_lead_outbox(stop))
+        finally:
+            await mail_transport.stop()
+            await catalogue.stop()
+            await global_settings_cache.stop()
+            doc_processor.stop()
+            await llm_gateway.stop()
+            await directus_client.stop()
+            await redis_manager.stop()
+
+    asyncio.run(main())
+
+
+def main():
+    processes = [
+        multiprocessing.Process(target=_worker_main, args=(i,), name=f"audit-worker-{i}")
+        for i in range(settings.AUDIT_WORKERS)
+    ]
+    for p in processes:
+        p.start()
+
+    def _forward(signum, _frame):
+        # Children finish their current job, then exit
+        for p in processes:
+            if p.is_alive():
+                p.terminate()
+
+    signal.signal(signal.SIGTERM, _forward)
+    for p in processes:
+        p.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,18 @@
+import fakeredis
+import pytest
+from app.core.redis import redis_manager
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+async def redis():
+    """In-memory Redis (with Lua) installed as the shared client."""
+    client = fakeredis.FakeAsyncRedis(decode_responses=True)
+    redis_manager.client = client
+    yield client
+    redis_manager.client = None
+    await client.aclose()
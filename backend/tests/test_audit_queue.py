@@ -0,0 +1,159 @@
+import time
+import pytest
+from app.core.config import settings
+from app.services import audit_queue
+from app.services.audit_queue import (
+    DELAYED_KEY,
+    INFLIGHT_KEY,
+    PENDING_KEY,
+    QueueFullError,
+    claim_job,
+    complete_job,
+    extend_visibility,
+    fail_job,
+    get_job,
+    submit_job,
+)
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture(autouse=True)
+def queue_settings(monkeypatch):
+    monkeypatch.setattr(settings, "AUDIT_JOB_MAX_ATTEMPTS", 3)
+    monkeypatch.setattr(settings, "AUDIT_JOB_VISIBILITY_TIMEOUT", 300)
+    monkeypatch.setattr(settings, "AUDIT_JOB_RETRY_BACKOFF", 10)
+    monkeypatch.setattr(settings, "AUDIT_JOB_CLIENT_CONCURRENCY", 2)
+
+
+def _advance(monkeypatch, seconds: float):
+    """Move the queue's clock forward."""
+    now = time.time() + seconds
+    monkeypatch.setattr(audit_queue.time, "time", lambda: now)
+
+
+async def _expire_visibility(redis, job_id):
+    await redis.zadd(INFLIGHT_KEY, {job_id: 0})
+
+
+async def test_claim_and_complete(redis):
+    job_id = await submit_job(b"%PDF-1.4", "spec.pdf", "client-1")
+    assert (await get_job(job_id))["status"] == "queued"
+
+    job = await claim_job()
+    assert job["job_id"] == job_id
+    assert job["attempts"] == 1
+    assert job["content"] == b"%PDF-1.4"
+    assert (await get_job(job_id))["status"] == "running"
+    assert await redis.zscore(INFLIGHT_KEY, job_id) is not None
+
+    assert await complete_job(job_id, job["attempts"], '{"ok": true}')
+    stored = await get_job(job_id)
+    assert stored["status"] == "done"
+    assert stored["result"] == {"ok": True}
+    assert await redis.zscore(INFLIGHT_KEY, job_id) is None
+    assert not await redis.exists(audit_queue._file_key(job_id))
+    assert await redis.get(audit_queue._client_key("client-1")) == "0"
+    assert await claim_job() is None
+
+
+async def test_client_limit(redis):
+    await submit_job(b"1", "a.pdf", "client-1")
+    await submit_job(b"2", "b.pdf", "client-1")
+    with pytest.raises(QueueFullError):
+        await submit_job(b"3", "c.pdf", "client-1")
+    # The rejected submit does not hold a slot, and other clients are unaffected
+    assert await redis.get(audit_queue._client_key("client-1")) == "2"
+    await submit_job(b"4", "d.pdf", "client-2")
+
+    # Finishing a job frees its slot
+    job = await claim_job()
+    assert job["filename"] == "a.pdf"
+    await complete_job(job["job_id"], job["attempts"], "{}")
+    await submit_job(b"5", "e.pdf", "client-1")
+
+
+async def test_stale_worker_cannot_finish_redelivered_job(redis):
+    job_id = await submit_job(b"data", "spec.pdf", "client-1")
+    stale = await claim_job()
+
+    await _expire_visibility(redis, job_id)
+    fresh = await claim_job()
+    assert fresh["job_id"] == job_id
+    assert fresh["attempts"] == stale["attempts"] + 1
+
+    # The first worker wakes up after its visibility timeout
+    assert not await extend_visibility(job_id, stale["attempts"])
+    assert not await complete_job(job_id, stale["attempts"], '{"stale": true}')
+    await fail_job(job_id, stale["attempts"], "late failure")
+    stored = await get_job(job_id)
+    assert stored["status"] == "running"
+    assert stored["result"] is None
+    assert await redis.zscore(INFLIGHT_KEY, job_id) is not None
+    assert await redis.zscore(DELAYED_KEY, job_id) is None
+
+    assert await extend_visibility(job_id, fresh["attempts"])
+    assert await complete_job(job_id, fresh["attempts"], '{"fresh": true}')
+    assert (await get_job(job_id))["result"] == {"fresh": True}
+    # Finished once, so the client counter is released once
+    assert await redis.get(audit_queue._client_key("client-1")) == "0"
+    assert not await complete_job(job_id, fresh["attempts"], '{"again": true}')
+    assert await redis.get(audit_queue._client_key("client-1")) == "0"
+
+
+async def test_finished_job_left_in_pending_is_dropped(redis):
+    job_id = await submit_job(b"data", "spec.pdf", "client-1")
+    job = await claim_job()
+    # Redelivered, then completed by the original worker before anyone claims it again
+    await redis.zrem(INFLIGHT_KEY, job_id)
+    await redis.lpush(PENDING_KEY, job_id)
+    assert await complete_job(job_id, job["attempts"], "{}")
+
+    assert await claim_job() is None
+    assert (await get_job(job_id))["attempts"] == 1
+
+
+async def test_failed_attempt_is_retried_with_backoff(redis, monkeypatch):
+    job_id = await submit_job(b"data", "spec.pdf", "client-1")
+    job = await claim_job()
+
+    await fail_job(job_id, job["attempts"], "LLM unavailable")
+    stored = await get_job(job_id)
+    assert stored["status"] == "queued"
+    assert stored["error"] == "LLM unavailable"
+    assert await redis.zscore(INFLIGHT_KEY, job_id) is None
+    assert await redis.zscore(DELAYED_KEY, job_id) is not None
+
+    # Not due before the backoff ends
+    assert await claim_job() is None
+    _advance(monkeypatch, settings.AUDIT_JOB_RETRY_BACKOFF + 1)
+    retry = await claim_job()
+    assert retry["job_id"] == job_id
+    assert retry["attempts"] == 2
+
+
+async def test_job_fails_once_attempts_are_exhausted(redis, monkeypatch):
+    monkeypatch.setattr(settings, "AUDIT_JOB_RETRY_BACKOFF", 0)
+    job_id = await submit_job(b"data", "spec.pdf", "client-1")
+    for attempt in range(1, settings.AUDIT_JOB_MAX_ATTEMPTS + 1):
+        job = await claim_job()
+        assert job["attempts"] == attempt
+        await fail_job(job_id, job["attempts"], f"error {attempt}")
+
+    stored = await get_job(job_id)
+    assert stored["status"] == "failed"
+    assert stored["error"] == f"error {settings.AUDIT_JOB_MAX_ATTEMPTS}"
+    assert await claim_job() is None
+    assert await redis.get(audit_queue._client_key("client-1")) == "0"
+
+
+async def test_job_lost_too_often_is_failed_on_claim(redis):
+    job_id = await submit_job(b"data", "spec.pdf", "client-1")
+    for _ in range(settings.AUDIT_JOB_MAX_ATTEMPTS):
+        assert await claim_job()
+        await _expire_visibility(redis, job_id)
+
+    assert await claim_job() is None
+    stored = await get_job(job_id)
+    assert stored["status"] == "failed"
+    assert stored["attempts"] == settings.AUDIT_JOB_MAX_ATTEMPTS + 1
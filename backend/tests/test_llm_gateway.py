@@ -0,0 +1,237 @@
+import asyncio
+from types import SimpleNamespace
+import httpx
+import openai
+import pytest
+from app.core.config import settings
+from app.core.llm_gateway import CircuitOpenError, LLMGateway
+
+pytestmark = pytest.mark.anyio
+
+
+def _connection_error():
+    return openai.APIConnectionError(request=httpx.Request("POST", "http://proxy/v1/chat/completions"))
+
+
+class FakeStream:
+    def __init__(self, chunks, stall=False):
+        self.chunks = list(chunks)
+        self.stall = stall
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.chunks:
+            return self.chunks.pop(0)
+        if self.stall:
+            await asyncio.sleep(10)
+        raise StopAsyncIteration
+
+    async def close(self):
+        self.closed = True
+
+
+class FakeClient:
+    """Stands in for AsyncOpenAI: each create() call runs the next queued behaviour."""
+
+    def __init__(self):
+        self.behaviours = []
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    async def _create(self, **kwargs):
+        self.calls += 1
+        behaviour = self.behaviours.pop(0) if len(self.behaviours) > 1 else self.behaviours[0]
+        return await behaviour(**kwargs)
+
+    async def close(self):
+        pass
+
+
+def _returns(value, delay=0.0):
+    async def behaviour(**kwargs):
+        await asyncio.sleep(delay)
+        return value
+    return behaviour
+
+
+def _raises(error_factory):
+    async def behaviour(**kwargs):
+        raise error_factory()
+    return behaviour
+
+
+@pytest.fixture
+async def gateway(monkeypatch):
+    monkeypatch.setattr(settings, "PROXY_API_KEY", "test")
+    monkeypatch.setattr(settings, "LLM_MAX_CONCURRENCY", 2)
+    monkeypatch.setattr(settings, "LLM_TIMEOUT", 1.0)
+    monkeypatch.setattr(settings, "LLM_DEADLINE", 5.0)
+    monkeypatch.setattr(settings, "LLM_STREAM_IDLE_TIMEOUT", 0.05)
+    monkeypatch.setattr(settings, "LLM_MAX_RETRIES", 0)
+    monkeypatch.setattr(settings, "LLM_RETRY_BACKOFF", 0.0)
+    monkeypatch.setattr(settings, "LLM_HEDGE", False)
+    monkeypatch.setattr(settings, "LLM_BREAKER_FAILURES", 2)
+    monkeypatch.setattr(settings, "LLM_BREAKER_COOLDOWN", 0.05)
+    gw = LLMGateway()
+    gw.start()
+    await gw.client.close()
+    gw.client = FakeClient()
+    yield gw
+    await gw.stop()
+
+
+def _free_slots(gw):
+    return gw._semaphore._value
+
+
+# --- circuit breaker -------------------------------------------------------
+
+async def test_breaker_opens_and_fails_fast(gateway):
+    gateway.client.behaviours = [_raises(_connection_error)]
+    for _ in range(settings.LLM_BREAKER_FAILURES):
+        with pytest.raises(openai.APIConnectionError):
+            await gateway.complete("test", model="m")
+    assert gateway.stats()["breaker"] == "open"
+    assert gateway.breaker_trips == 1
+
+    calls = gateway.client.calls
+    with pytest.raises(CircuitOpenError):
+        await gateway.complete("test", model="m")
+    assert gateway.client.calls == calls
+    assert gateway.rejected == 1
+
+
+async def test_successful_probe_closes_breaker(gateway):
+    gateway.client.behaviours = [_raises(_connection_error)] * settings.LLM_BREAKER_FAILURES + [_returns("ok")]
+    for _ in range(settings.LLM_BREAKER_FAILURES):
+        with pytest.raises(openai.APIConnectionError):
+            await gateway.complete("test", model="m")
+
+    await asyncio.sleep(settings.LLM_BREAKER_COOLDOWN)
+    assert await gateway.complete("test", model="m") == "ok"
+    assert gateway.stats()["breaker"] == "closed"
+    assert await gateway.complete("test", model="m") == "ok"
+
+
+async def test_failed_probe_reopens_breaker(gateway):
+    gateway.client.behaviours = [_raises(_connection_error)]
+    for _ in range(settings.LLM_BREAKER_FAILURES):
+        with pytest.raises(openai.APIConnectionError):
+            await gateway.complete("test", model="m")
+
+    await asyncio.sleep(settings.LLM_BREAKER_COOLDOWN)
+    with pytest.raises(openai.APIConnectionError):
+        await gateway.complete("test", model="m")
+    assert gateway.breaker_trips == 2
+    with pytest.raises(CircuitOpenError):
+        await gateway.complete("test", model="m")
+
+
+async def test_single_probe_while_half_open(gateway):
+    gateway.client.behaviours = [_raises(_connection_error)] * settings.LLM_BREAKER_FAILURES + [_returns("ok", delay=0.05)]
+    for _ in range(settings.LLM_BREAKER_FAILURES):
+        with pytest.raises(openai.APIConnectionError):
+            await gateway.complete("test", model="m")
+
+    await asyncio.sleep(settings.LLM_BREAKER_COOLDOWN)
+    probe = asyncio.create_task(gateway.complete("test", model="m"))
+    await asyncio.sleep(0)
+    with pytest.raises(CircuitOpenError):
+        await gateway.complete("test", model="m")
+    assert await probe == "ok"
+    assert gateway.stats()["breaker"] == "closed"
+
+
+async def test_client_errors_do_not_trip_breaker(gateway, monkeypatch):
+    monkeypatch.setattr(settings, "LLM_MAX_RETRIES", 2)
+    gateway.client.behaviours = [_raises(lambda: ValueError("bad request"))]
+    for _ in range(settings.LLM_BREAKER_FAILURES + 1):
+        with pytest.raises(ValueError):
+            await gateway.complete("test", model="m")
+    # Not transient: neither retried nor counted against the proxy
+    assert gateway.client.calls == settings.LLM_BREAKER_FAILURES + 1
+    assert gateway.stats()["breaker"] == "closed"
+
+
+# --- retries and hedging ---------------------------------------------------
+
+async def test_transient_errors_are_retried(gateway, monkeypatch):
+    monkeypatch.setattr(settings, "LLM_MAX_RETRIES", 2)
+    gateway.client.behaviours = [_raises(_connection_error), _raises(_connection_error), _returns("ok")]
+    assert await gateway.complete("test", model="m") == "ok"
+    assert gateway.retries == 2
+    assert gateway.failures == 0
+    assert gateway.in_flight == 0
+    assert _free_slots(gateway) == settings.LLM_MAX_CONCURRENCY
+
+
+async def test_slow_call_is_hedged_per_model(gateway, monkeypatch):
+    monkeypatch.setattr(settings, "LLM_HEDGE", True)
+    monkeypatch.setattr(settings, "LLM_HEDGE_MIN_SAMPLES", 1)
+    monkeypatch.setattr(settings, "LLM_HEDGE_MIN_DELAY", 0.01)
+    gateway.client.behaviours = [_returns("warm-up")]
+    await gateway.complete("test", model="cheap")
+
+    gateway.client.behaviours = [_returns("slow", delay=0.5), _returns("hedge")]
+    assert await gateway.complete("test", model="cheap") == "hedge"
+    assert gateway.hedges == 1 and gateway.hedge_wins == 1
+    # Another model on the same route has no latencies yet, so no hedge
+    gateway.client.behaviours = [_returns("escalated", delay=0.05)]
+    assert await gateway.complete("test", model="strong") == "escalated"
+    assert gateway.hedges == 1
+
+    await asyncio.sleep(0)
+    assert gateway.in_flight == 0
+    assert _free_slots(gateway) == settings.LLM_MAX_CONCURRENCY
+
+
+# --- streaming -------------------------------------------------------------
+
+async def test_stream_holds_slot_until_exhausted(gateway):
+    stream = FakeStream(["a", "b"])
+    gateway.client.behaviours = [_returns(stream)]
+    chunks = []
+    async for chunk in gateway.stream("chat", model="m"):
+        chunks.append(chunk)
+        assert _free_slots(gateway) == settings.LLM_MAX_CONCURRENCY - 1
+    assert chunks == ["a", "b"]
+    assert stream.closed
+    assert gateway.in_flight == 0
+    assert _free_slots(gateway) == settings.LLM_MAX_CONCURRENCY
+
+
+async def test_stream_slot_released_when_consumer_leaves(gateway):
+    stream = FakeStream(["a", "b", "c"])
+    gateway.client.behaviours = [_returns(stream)]
+    chunks = gateway.stream("chat", model="m")
+    assert await chunks.__anext__() == "a"
+    await chunks.aclose()
+    assert stream.closed
+    assert gateway.in_flight == 0
+    assert _free_slots(gateway) == settings.LLM_MAX_CONCURRENCY
+
+
+async def test_stream_slot_released_on_idle_timeout(gateway):
+    stream = FakeStream(["a"], stall=True)
+    gateway.client.behaviours = [_returns(stream)]
+    with pytest.raises(TimeoutError):
+        async for _ in gateway.stream("chat", model="m"):
+            pass
+    assert stream.closed
+    assert gateway.failures == 1
+    assert _free_slots(gateway) == settings.LLM_MAX_CONCURRENCY
+
+
+async def test_failed_stream_attempts_release_their_slots(gateway, monkeypatch):
+    monkeypatch.setattr(settings, "LLM_MAX_RETRIES", 3)
+    gateway.client.behaviours = [_raises(_connection_error)]
+    with pytest.raises(openai.APIConnectionError):
+        async for _ in gateway.stream("chat", model="m"):
+            pass
+    # More attempts than slots: each attempt gave its slot back
+    assert gateway.client.calls == settings.LLM_MAX_RETRIES + 1
+    assert gateway.in_flight == 0
+    assert _free_slots(gateway) == settings.LLM_MAX_CONCURRENCY
@@ -0,0 +1,118 @@
+import asyncio
+import pytest
+from app.services.ai.stage_scheduler import Stage, StageScheduler
+
+pytestmark = pytest.mark.anyio
+
+
+def _const(value):
+    async def fn(results):
+        return value
+    return fn
+
+
+async def test_dependent_stage_sees_its_dependencies():
+    async def total(results):
+        return results["a"] + results["b"]
+
+    scheduler = StageScheduler([
+        Stage("total", total, depends_on=("a", "b")),
+        Stage("a", _const(1)),
+        Stage("b", _const(2)),
+    ])
+    results = await scheduler.run()
+    assert results == {"a": 1, "b": 2, "total": 3}
+    assert set(scheduler.timings) == {"a", "b", "total"}
+
+
+async def test_independent_stages_overlap():
+    # Each stage waits for the other to start: a serial run would deadlock
+    started = {"a": asyncio.Event(), "b": asyncio.Event()}
+
+    def meet(me, other):
+        async def fn(results):
+            started[me].set()
+            await asyncio.wait_for(started[other].wait(), 1)
+            return me
+        return fn
+
+    results = await StageScheduler([
+        Stage("root", _const(0)),
+        Stage("a", meet("a", "b"), depends_on=("root",)),
+        Stage("b", meet("b", "a"), depends_on=("root",)),
+    ]).run()
+    assert results["a"] == "a" and results["b"] == "b"
+
+
+async def test_on_complete_follows_dependency_order():
+    completed = []
+
+    async def on_complete(name, result):
+        completed.append((name, result))
+
+    await StageScheduler([
+        Stage("c", _const(3), depends_on=("b",)),
+        Stage("b", _const(2), depends_on=("a",)),
+        Stage("a", _const(1)),
+    ], on_complete=on_complete).run()
+    assert completed == [("a", 1), ("b", 2), ("c", 3)]
+
+
+async def test_initial_results_skip_stages():
+    calls = []
+
+    async def a(results):
+        calls.append("a")
+        return "fresh"
+
+    results = await StageScheduler([
+        Stage("a", a),
+        Stage("b", _const("b"), depends_on=("a",)),
+    ]).run({"a": "cached"})
+    assert calls == []
+    assert results == {"a": "cached", "b": "b"}
+
+
+async def test_failure_cancels_running_stages_and_skips_dependents():
+    cancelled = asyncio.Event()
+    dependent_ran = []
+
+    async def slow(results):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    async def broken(results):
+        raise ValueError("boom")
+
+    async def dependent(results):
+        dependent_ran.append(True)
+
+    with pytest.raises(ValueError, match="boom"):
+        await StageScheduler([
+            Stage("slow", slow),
+            Stage("broken", broken),
+            Stage("dependent", dependent, depends_on=("broken",)),
+        ]).run()
+    assert cancelled.is_set()
+    assert dependent_ran == []
+
+
+def test_unknown_dependency_is_rejected():
+    with pytest.raises(ValueError, match="unknown"):
+        StageScheduler([Stage("a", _const(1), depends_on=("missing",))])
+
+
+def test_duplicate_names_are_rejected():
+    with pytest.raises(ValueError, match="Duplicate"):
+        StageScheduler([Stage("a", _const(1)), Stage("a", _const(2))])
+
+
+async def test_dependency_cycle_is_reported():
+    with pytest.raises(RuntimeError, match="Unresolvable"):
+        await StageScheduler([
+            Stage("a", _const(1), depends_on=("b",)),
+            Stage("b", _const(2), depends_on=("a",)),
+        ]).run()
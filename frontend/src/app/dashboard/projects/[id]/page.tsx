@@ -69,13 +69,11 @@ export default function ProjectDetailsPage({ params }: { params: Promise<{ id: s
                 const raw = localStorage.getItem("geotech_session");
                 const token = raw ? JSON.parse(raw)?.token : null;
                 const res = await fetch(
-                    `${process.env.NEXT_PUBLIC_API_URL}/api/v1/dashboard/projects`,
+                    `${process.env.NEXT_PUBLIC_API_URL}/api/v1/dashboard/projects/${id}`,
                     { headers: token ? { Authorization: `Bearer ${token}` } : {} }
                 );
                 if (res.ok) {
-                    const data = await res.json();
-                    const found = data.projects?.find((p: Project) => p.id.toString() === id);
-                    setProject(found || null);
+                    setProject(await res.json());
                 }
             } catch (err) {
                 console.error("Failed to load project details:", err);
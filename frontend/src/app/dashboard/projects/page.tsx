@@ -15,7 +15,7 @@ interface Project {
     end_date: string | null;
     tags: string[] | null;
     date_created: string;
-    photos?: { directus_files_id: { id: string; filename_disk: string } }[];
+    photos?: { directus_files_id: { id: string; filename_disk?: string } }[];
     documents?: { directus_files_id: { id: string; filename_download: string; title?: string } }[];
     machinery_used?: { machinery_id: { id: string; name: string; category: string } }[];
 }
@@ -40,30 +40,38 @@ const formatDate = (d: string | null) => {
 
 export default function ProjectsPage() {
     const [projects, setProjects] = useState<Project[]>([]);
+    const [nextCursor, setNextCursor] = useState<string | null>(null);
     const [loading, setLoading] = useState(true);
+    const [loadingMore, setLoadingMore] = useState(false);
+
+    const fetchProjects = async (cursor: string | null = null) => {
+        const raw = localStorage.getItem("geotech_session");
+        const token = raw ? JSON.parse(raw)?.token : null;
+        const query = cursor ? `?cursor=${encodeURIComponent(cursor)}` : "";
+        const res = await fetch(
+            `${process.env.NEXT_PUBLIC_API_URL}/api/v1/dashboard/projects${query}`,
+            { headers: token ? { Authorization: `Bearer ${token}` } : {} }
+        );
+        if (res.ok) {
+            const data = await res.json();
+            setProjects((prev) => (cursor ? [...prev, ...(data.projects || [])] : data.projects || []));
+            setNextCursor(data.next_cursor || null);
+        }
+    };
 
     useEffect(() => {
-        const fetchProjects = async () => {
-            try {
-                const raw = localStorage.getItem("geotech_session");
-                const token = raw ? JSON.parse(raw)?.token : null;
-                const res = await fetch(
-                    `${process.env.NEXT_PUBLIC_API_URL}/api/v1/dashboard/projects`,
-                    { headers: token ? { Authorization: `Bearer ${token}` } : {} }
-                );
-                if (res.ok) {
-                    const data = await res.json();
-                    setProjects(data.projects || []);
-                }
-            } catch (err) {
-                console.error("Failed to load projects:", err);
-            } finally {
-                setLoading(false);
-            }
-        };
-        fetchProjects();
+        fetchProjects()
+            .catch((err) => console.error("Failed to load projects:", err))
+            .finally(() => setLoading(false));
     }, []);
 
+    const loadMore = () => {
+        setLoadingMore(true);
+        fetchProjects(nextCursor)
+            .catch((err) => console.error("Failed to load more projects:", err))
+            .finally(() => setLoadingMore(false));
+    };
+
     if (loading) {
         return (
             <div className="flex items-center justify-center min-h-[400px]">
@@ -217,6 +225,15 @@ export default function ProjectsPage() {
                             </div>
                         </a>
                     ))}
+                    {nextCursor && (
+                        <button
+                            onClick={loadMore}
+                            disabled={loadingMore}
+                            className="w-full py-3 rounded-xl border border-white/10 text-xs font-bold uppercase tracking-widest text-white/40 hover:text-white hover:border-orange-500/40 transition-colors disabled:opacity-50"
+                        >
+                            {loadingMore ? <Loader2 className="w-4 h-4 animate-spin mx-auto" /> : "Показать ещё"}
+                        </button>
+                    )}
                 </div>
             )}
         </div>
@@ -53,6 +53,7 @@ export function SmartDropzone() {
     const [chatMessages, setChatMessages] = useState<ChatMessage[]>([]);
     const [chatInput, setChatInput] = useState("");
     const [isThinking, setIsThinking] = useState(false);
+    const [chatSessionId, setChatSessionId] = useState<string | null>(null);
     const [isLeadSubmitting, setIsLeadSubmitting] = useState(false);
     const [leadSubmitted, setLeadSubmitted] = useState(false);
     const [showLeadForm, setShowLeadForm] = useState(false);
@@ -102,6 +103,8 @@ export function SmartDropzone() {
         setIsUploading(true);
         setError(null);
         setProposal(null);
+        setChatMessages([]);
+        setChatSessionId(null);
 
         const formData = new FormData();
         formData.append("file", file);
@@ -150,20 +153,48 @@ export function SmartDropzone() {
         setIsThinking(true);
 
         try {
-            const response = await fetch(`${process.env.NEXT_PUBLIC_API_URL}/api/v1/ai/chat`, {
+            // History lives on the server: only the first turn carries the document context
+            const response = await fetch(`${process.env.NEXT_PUBLIC_API_URL}/api/v1/ai/chat/stream`, {
                 method: "POST",
                 headers: { "Content-Type": "application/json" },
-                body: JSON.stringify({
-                    message: userMsg,
-                    history: chatMessages,
-                    context: proposal.technical_summary
-                }),
+                body: JSON.stringify(chatSessionId
+                    ? { session_id: chatSessionId, message: userMsg }
+                    : { message: userMsg, context: proposal.technical_summary }),
             });
 
-            if (!response.ok) throw new Error("Ошибка связи с AI");
-
-            const data = await response.json() as { answer: string };
-            setChatMessages(prev => [...prev, { role: 'assistant', content: data.answer }]);
+            if (!response.ok || !response.body) throw new Error("Ошибка связи с AI");
+
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = "";
+            let started = false;
+            for (;;) {
+                const { done, value } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+                const lines = buffer.split("\n");
+                buffer = lines.pop() ?? "";
+                for (const line of lines) {
+                    if (!line.trim()) continue;
+                    const { event, data } = JSON.parse(line) as { event: string; data: unknown };
+                    if (event === "session") {
+                        setChatSessionId((data as { session_id: string }).session_id);
+                    } else if (event === "token") {
+                        const token = data as string;
+                        if (!started) {
+                            started = true;
+                            setChatMessages(prev => [...prev, { role: 'assistant', content: token }]);
+                        } else {
+                            setChatMessages(prev => [
+                                ...prev.slice(0, -1),
+                                { role: 'assistant', content: prev[prev.length - 1].content + token },
+                            ]);
+                        }
+                    } else if (event === "error") {
+                        throw new Error((data as { detail: string }).detail);
+                    }
+                }
+            }
         } catch {
             setChatMessages(prev => [...prev, { role: 'assistant', content: "Извините, произошла ошибка. Попробуйте позже." }]);
         } finally {
@@ -421,6 +452,7 @@ export function SmartDropzone() {
                                                 onClick={() => {
                                                     setProposal(null);
                                                     setChatMessages([]);
+                                                    setChatSessionId(null);
                                                     setLeadSubmitted(false);
                                                     setShowLeadForm(false);
                                                 }}